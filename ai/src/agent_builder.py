@@ -1,34 +1,75 @@
-from queue import Queue
+import threading
+from typing import NamedTuple, Optional, Tuple
+from langchain.chat_models import ChatOpenAI
 
-from openai_utils.models import get_openai_llm
+from openai_utils.router import Role, get_role_llm
+from openai_utils.models import get_openai_embeddings
 from query_tools.retrieval_tool import get_retrieval_tool
+from query_tools.engine_router import EMBEDDING_MODEL as ROUTER_EMBEDDING_MODEL
 from math_tools.math_tool import get_math_tool
-from framework.agent import Agent
-from framework.agent_stream import AgentStream
+from framework.agent import Agent, StepMode
+from framework.agent_tool import AgentTool
 
 MAX_ITERATIONS = 10  # Num. of iterations
 AGENT_TIMEOUT = 240  # In seconds
+STREAMING_STEPS = True  # Stream agent steps, which stop at the Observation keyword
+STEP_MODE = StepMode.REACT  # Or StepMode.FUNCTIONS for native tool calling
+SPECULATIVE_RETRIEVAL = True  # Start retrieval on the question while the first step is generated
+FUSED_RETRIEVAL_PLANNING = True  # Sub queries and their engines from one LLM call instead of one per sub query
+LOCAL_ENGINE_ROUTING = True  # Embedding router in front of the LLM engine chooser
+ENGINE_RACE_WIDTH = 2  # Engines searched at once per sub query, the first good result wins, 1 turns racing off
+ENGINE_DEADLINES = {'Wikipedia': 8.0, 'google_serper': 5.0}  # In seconds, the others get engine_racing's default
 
 
-def build_agent(stream_queue: Queue = None):
+class Registry(NamedTuple):
+    """Immutable set of LLM clients, tools and the agent built once per process"""
+    llm: ChatOpenAI
+    tools: Tuple[AgentTool, ...]
+    agent: Agent
 
-    gpt3 = get_openai_llm(
-        temperature=0.05,
-        model_name='gpt-3.5-turb'
-    )
-    gpt4 = get_openai_llm(
-        temperature=0.05,
-        model_name='gpt-4-1106-preview'
-    )
 
-    queue = Queue() if not stream_queue else stream_queue
-    stream = AgentStream(queue=queue, is_verbose=True)
+_registry: Optional[Registry] = None
+_registry_lock = threading.Lock()
+
 
-    retrieval_tool = get_retrieval_tool(llm=gpt4)
-    math_tool = get_math_tool(max_iter=MAX_ITERATIONS)
+def build_registry() -> Registry:
+
+    planner_llm = get_role_llm(Role.PLANNER)
+
+    retrieval_tool = get_retrieval_tool(
+        llm=planner_llm,
+        sub_query_llm=get_role_llm(Role.SUB_QUERY),
+        chooser_llm=get_role_llm(Role.CHOOSER),
+        summary_llm=get_role_llm(Role.SUMMARIZER),
+        plan_llm=get_role_llm(Role.RETRIEVAL_PLANNER),
+        fused_planning=FUSED_RETRIEVAL_PLANNING,
+        router_embeddings=get_openai_embeddings(model=ROUTER_EMBEDDING_MODEL) if LOCAL_ENGINE_ROUTING else None,
+        race_width=ENGINE_RACE_WIDTH,
+        engine_deadlines=ENGINE_DEADLINES
+    )
+    math_tool = get_math_tool(max_iter=MAX_ITERATIONS, streaming=STREAMING_STEPS, mode=STEP_MODE)
 
     # when giving tools to LLM, we must pass as list of tools
     tools = [retrieval_tool, math_tool]
 
-    agent = Agent(llm=gpt4, tools=tools, max_iterations=MAX_ITERATIONS, stream=stream)
-    return agent
+    agent = Agent(
+        llm=planner_llm,
+        tools=tools,
+        max_iterations=MAX_ITERATIONS,
+        streaming=STREAMING_STEPS,
+        mode=STEP_MODE,
+        speculative_tool=retrieval_tool.name if SPECULATIVE_RETRIEVAL else None
+    )
+    return Registry(llm=planner_llm, tools=tuple(tools), agent=agent)
+
+
+def get_registry() -> Registry:
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = build_registry()
+
+    return _registry
+
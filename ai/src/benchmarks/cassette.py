@@ -0,0 +1,128 @@
+"""
+Cassettes of real runs for the offline benchmarks. A cassette is a prompt recording of openai_utils.recorder
+(served with PROMPT_RECORD_PATH set): every routed LLM call with its messages, output and latency.
+
+Replaying it, the agent's steps are answered from the recorded planner calls, and the tools are stubs which
+return the observations found in the recorded step prompts, so recorded tasks run again without any API.
+"""
+
+import re
+import json
+import asyncio
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from framework.keywords import Keyword
+from framework.agent_tool import AgentTool
+from framework.transcript import TRUNCATION_NOTE
+from openai_utils.router import Role
+
+QUESTION_MARKER = f'\n{Keyword.QUESTION}: '
+record_pattern = re.compile(
+    r'\n(' + '|'.join([re.escape(k) for k in [
+        Keyword.QUESTION, Keyword.THOUGHT, Keyword.INPUT, Keyword.ACTION, Keyword.OBSERVATION, Keyword.ANSWER
+    ]]) + r'): '
+)
+
+
+def load_cassette(path: str, role: Optional[str] = Role.PLANNER) -> List[Dict]:
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    return [r for r in records if role is None or r['role'] == role]
+
+
+def prompt_of(record: Dict) -> str:
+    return '\n'.join([m['content'] for m in record['messages'] if m.get('content')])
+
+
+def workflow_key(prompt: str) -> Optional[str]:
+    """The question and workflow of a step prompt, which don't depend on the tool descriptions"""
+    index = prompt.rfind(QUESTION_MARKER)
+    return prompt[index:] if index >= 0 else None
+
+
+def questions(records: List[Dict]) -> List[str]:
+    found = []
+    for record in records:
+        key = workflow_key(prompt_of(record))
+        if key is not None:
+            question = key[len(QUESTION_MARKER):].split('\n')[0]
+            if question not in found:
+                found.append(question)
+
+    return found
+
+
+def parse_workflow(workflow: str) -> List[Tuple[str, str]]:
+    parts = record_pattern.split(workflow)
+    return [(parts[i], parts[i + 1].strip()) for i in range(1, len(parts) - 1, 2)]
+
+
+def observations(records: List[Dict]) -> Dict[Tuple[str, str], str]:
+    """Observation of every (tool, input) pair seen in the recorded step prompts"""
+    found: Dict[Tuple[str, str], str] = {}
+
+    for record in records:
+        key = workflow_key(prompt_of(record))
+        if key is None:
+            continue
+
+        actions = []
+        results = []
+        for keyword, text in parse_workflow(key) + [(Keyword.THOUGHT, '')]:
+            if keyword == Keyword.ACTION:
+                actions.append([text, None])
+            elif keyword == Keyword.INPUT and actions:
+                actions[-1][1] = text
+            elif keyword == Keyword.OBSERVATION:
+                results.append(text)
+            elif results:
+                # Several observations of the same step are prefixed with their tool name
+                for (tool, input), result in zip(actions, results):
+                    if len(results) > 1 and result.startswith(f'{tool}: '):
+                        result = result[len(tool) + 2:]
+                    # Older observations may have been truncated in later prompts
+                    if (tool, input) not in found or found[(tool, input)].endswith(TRUNCATION_NOTE):
+                        found[(tool, input)] = result
+                actions = []
+                results = []
+
+    return found
+
+
+def cassette_script(records: List[Dict], fallback: Optional[Callable[[str], str]] = None) -> Callable[[str], str]:
+    """Script of a ScriptedChatModel answering the recorded step prompts"""
+    outputs = {workflow_key(prompt_of(r)): r['output'] for r in records}
+    stats = Counter()
+
+    def script(prompt: str) -> str:
+        key = workflow_key(prompt)
+        if key in outputs:
+            stats['hits'] += 1
+            return outputs[key]
+
+        stats['misses'] += 1
+        if fallback is None:
+            raise KeyError(f'Step prompt not in the cassette: {prompt[-200:]!r}')
+
+        return fallback(prompt)
+
+    script.stats = stats
+    return script
+
+
+def stub_tools(records: List[Dict], latency: float = 0.0) -> List[AgentTool]:
+    """Tools answering the recorded observations, named like the recorded actions"""
+    by_tool = defaultdict(dict)
+    for (tool, input), observation in observations(records).items():
+        by_tool[tool][input] = observation
+
+    def stub(name: str, answers: Dict[str, str]) -> AgentTool:
+        async def function(input: str) -> str:
+            await asyncio.sleep(latency)
+            return answers.get(input, f'No recorded observation for {input}')
+
+        return AgentTool(function=function, name=name, description=f'Recorded {name}')
+
+    return [stub(name, answers) for name, answers in by_tool.items()]
@@ -0,0 +1,66 @@
+"""
+Concurrency stress test for Agent runs.
+
+One outer agent and one nested agent are built once and shared by every run. Each run must
+get back the answer derived from its own question, any transcript leak between runs fails.
+
+Run from ai/src: python -m benchmarks.concurrency
+"""
+
+import io
+import sys
+import random
+import asyncio
+import contextlib
+from queue import Queue
+
+from framework.agent import Agent
+from framework.agent_tool import AgentTool
+from framework.agent_stream import AgentStream
+from benchmarks.fake_llm import ScriptedChatModel, react_script
+
+RUNS = 200
+MAX_LATENCY = 0.02  # In seconds
+
+
+def quiet_stream() -> AgentStream:
+    return AgentStream(queue=Queue(), is_verbose=False)
+
+
+def build_agents() -> Agent:
+    async def echo(input: str) -> str:
+        await asyncio.sleep(random.uniform(0, MAX_LATENCY))
+        return f'echo:{input}'
+
+    inner = Agent(
+        llm=ScriptedChatModel(script=react_script('Echo')),
+        tools=[AgentTool(function=echo, name='Echo', description='Echoes the input')],
+        max_iterations=3,
+        stream=quiet_stream()
+    )
+
+    async def nested(input: str) -> str:
+        await asyncio.sleep(random.uniform(0, MAX_LATENCY))
+        return await inner.invoke(input)
+
+    return Agent(
+        llm=ScriptedChatModel(script=react_script('Nested')),
+        tools=[AgentTool(function=nested, name='Nested', description='Runs the nested agent')],
+        max_iterations=3
+    )
+
+
+async def stress() -> int:
+    agent = build_agents()
+    questions = [f'task-{i}' for i in range(RUNS)]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        answers = await asyncio.gather(*[agent.invoke(q, stream=quiet_stream()) for q in questions])
+
+    return sum(answer != f'echo:{q}' for q, answer in zip(questions, answers))
+
+
+if __name__ == '__main__':
+    failures = asyncio.run(stress())
+    print(f'{RUNS} concurrent runs, {failures} mismatched answers')
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,91 @@
+"""
+Latency of the retrieval tool with engine racing, by race width (1 is racing off).
+
+Offline: the LLM calls are scripted without latency, and every engine is simulated with a lognormal latency,
+a share of stalls, which only the engine deadline ends, and a share of empty results. The report has the
+retrieval latency percentiles, the searches sent per sub query and the racing stats.
+
+Run from ai/src: python -m benchmarks.engine_racing [--runs 200] [--widths 1,2,3]
+"""
+
+import io
+import json
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+import numpy as np
+
+from framework.agent_tool import AgentTool
+from query_tools.retrieval_tool import get_retrieval_tool
+from query_tools.engine_racing import racing_stats, get_racing_stats
+from benchmarks.fake_llm import ScriptedChatModel
+from benchmarks.suite import ENGINES, SUB_QUERIES, retrieval_script
+
+RUNS = 200
+WIDTHS = [1, 2, 3]
+CONCURRENCY = 20
+MEDIAN_LATENCY = 0.05  # In seconds
+SIGMA = 0.5
+STALL_RATE = 0.05  # Share of searches which hang until their deadline
+STALL_LATENCY = 5.0  # In seconds
+EMPTY_RATE = 0.05  # Share of searches without a result
+DEADLINE = 1.0  # In seconds, of every engine
+
+
+def simulated_engine(name: str, searches: list) -> AgentTool:
+    async def search(query: str) -> str:
+        searches.append(name)
+        stalled = random.random() < STALL_RATE
+        await asyncio.sleep(STALL_LATENCY if stalled else random.lognormvariate(np.log(MEDIAN_LATENCY), SIGMA))
+        if random.random() < EMPTY_RATE:
+            return f'No good {name} Search Result was found'
+
+        return f'{name} results for {query}: ' + 'a passage about the sub query. ' * 3
+
+    return AgentTool(function=search, name=name, description=f'Simulated {name}')
+
+
+async def bench(width: int, runs: int) -> dict:
+    searches = []
+    tool = get_retrieval_tool(
+        llm=ScriptedChatModel(script=retrieval_script),
+        search_tools=[simulated_engine(name, searches) for name in ENGINES],
+        race_width=width,
+        engine_deadlines={name: DEADLINE for name in ENGINES}
+    )
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def run(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await tool.invoke(f'query {i}')
+            latencies.append(time.perf_counter() - start)
+
+    racing_stats.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*[run(i) for i in range(runs)])
+
+    return {
+        'p50_ms': 1000 * float(np.percentile(latencies, 50)),
+        'p99_ms': 1000 * float(np.percentile(latencies, 99)),
+        'max_ms': 1000 * max(latencies),
+        'searches_per_sub_query': len(searches) / (runs * SUB_QUERIES),
+        'racing': get_racing_stats() if width > 1 else None
+    }
+
+
+async def main(runs: int, widths: list) -> dict:
+    random.seed(0)
+    return {width: await bench(width, runs) for width in widths}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=RUNS)
+    parser.add_argument('--widths', default=','.join(map(str, WIDTHS)), help='Comma separated')
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(main(args.runs, [int(w) for w in args.widths.split(',')])), indent=4))
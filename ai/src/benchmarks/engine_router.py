@@ -0,0 +1,111 @@
+"""
+Offline evaluation of the local engine router against the LLM engine chooser, on the chooser calls of a
+prompt recording (served with PROMPT_RECORD_PATH set, the two-stage retrieval path makes them).
+
+The decisions are split in folds, the sub queries of every fold are routed by prototypes which learned from
+the other folds. For every confidence margin the report has the share of sub queries routed locally, their
+agreement with the chooser, the chooser calls saved, and the recorded chooser time saved against the time
+spent on the sub query embeddings.
+
+Run from ai/src: python -m benchmarks.engine_router --recording prompts.jsonl [--folds 5] [--margins 0,0.02]
+"""
+
+import json
+import time
+import asyncio
+import argparse
+from statistics import mean
+from typing import Dict, List, Tuple
+import numpy as np
+
+from openai_utils.models import get_openai_embeddings
+from query_tools.engine_router import EMBEDDING_MODEL, CONFIDENCE_MARGIN, EnginePrototypes, chooser_decisions
+
+FOLDS = 5
+MARGINS = [0.0, 0.01, 0.02, CONFIDENCE_MARGIN, 0.05, 0.08]
+BATCH_SIZE = 3  # Sub queries embedded per call, like the router does for a retrieval
+
+
+async def embed(embeddings, texts: List[str]) -> Tuple[np.ndarray, List[float]]:
+    """Embeddings of the texts, in calls of BATCH_SIZE texts, and the latency of every call"""
+    vectors = []
+    latencies = []
+    for i in range(0, len(texts), BATCH_SIZE):
+        start = time.perf_counter()
+        vectors.extend(await embeddings.aembed_documents(texts[i:i + BATCH_SIZE]))
+        latencies.append(time.perf_counter() - start)
+
+    return np.asarray(vectors, dtype=np.float32), latencies
+
+
+async def evaluate(records: List[Dict], folds: int, margins: List[float], embeddings=None) -> Dict:
+    embeddings = embeddings or get_openai_embeddings(model=EMBEDDING_MODEL)
+    decisions = [d for d in chooser_decisions(records) if d['engine'] in d['engines']]
+    if not decisions:
+        return {'decisions': 0}
+
+    engines = {}
+    for decision in decisions:
+        engines.update(decision['engines'])
+    names = list(engines)
+
+    description_vectors, _ = await embed(embeddings, [engines[name] for name in names])
+    vectors, embedding_latencies = await embed(embeddings, [d['query'] for d in decisions])
+    labels = np.array([d['engine'] for d in decisions])
+    chooser_latencies = np.array([d['latency'] or 0.0 for d in decisions])
+
+    # Engine and confidence of every sub query, from the prototypes of the other folds
+    predicted = np.empty(len(decisions), dtype=object)
+    confidence = np.zeros(len(decisions))
+    fold_of = np.arange(len(decisions)) % folds
+    for fold in range(folds):
+        test = fold_of == fold
+        if not test.any():
+            continue
+
+        prototypes = EnginePrototypes(names, description_vectors)
+        prototypes.add(vectors[~test], list(labels[~test]))
+        routes = prototypes.route(vectors[test], margin=0.0)
+        predicted[test] = [engine for engine, _ in routes]
+        confidence[test] = [c for _, c in routes]
+
+    description_only = EnginePrototypes(names, description_vectors).route(vectors, margin=0.0)
+    agrees = predicted == labels
+
+    results = {}
+    for margin in margins:
+        routed = confidence >= margin
+        results[margin] = {
+            'local_rate': float(routed.mean()),
+            'agreement_routed': float(agrees[routed].mean()) if routed.any() else None,
+            # The chooser decides the other sub queries, which agree by definition
+            'agreement_overall': float((agrees & routed).sum() + (~routed).sum()) / len(decisions),
+            'chooser_calls_saved': int(routed.sum()),
+            'chooser_s_saved': float(chooser_latencies[routed].sum())
+        }
+
+    return {
+        'decisions': len(decisions),
+        'engines': {name: int((labels == name).sum()) for name in names},
+        'chooser_ms': 1000 * float(chooser_latencies.mean()),
+        'embedding_ms_per_call': 1000 * mean(embedding_latencies),
+        'embedding_s_spent': sum(embedding_latencies),
+        'description_only_agreement': float(np.mean([engine == label for (engine, _), label in zip(
+            description_only, labels
+        )])),
+        'margins': results
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recording', required=True, help='Prompt recording, see openai_utils.recorder')
+    parser.add_argument('--folds', type=int, default=FOLDS)
+    parser.add_argument('--margins', default=','.join(map(str, MARGINS)), help='Comma separated')
+    args = parser.parse_args()
+
+    with open(args.recording) as f:
+        recorded = [json.loads(line) for line in f if line.strip()]
+
+    report = asyncio.run(evaluate(recorded, args.folds, [float(m) for m in args.margins.split(',')]))
+    print(json.dumps(report, indent=4))
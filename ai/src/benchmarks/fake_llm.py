@@ -0,0 +1,75 @@
+import re
+import time
+import asyncio
+from typing import Any, AsyncIterator, Callable, List, Optional
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+from langchain.schema.messages import AIMessageChunk
+from langchain.schema.output import ChatGenerationChunk
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Deterministic offline chat model, the completion is computed from the prompt by a script"""
+    script: Callable[[str], str]
+    latency: float = 0.0  # In seconds
+
+    @property
+    def _llm_type(self) -> str:
+        return 'scripted-chat'
+
+    def _complete(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> str:
+        text = self.script('\n'.join([m.content for m in messages]))
+        for s in stop or []:
+            text = text.split(s)[0]
+
+        return text
+
+    def _result(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> ChatResult:
+        message = AIMessage(content=self._complete(messages, stop))
+
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(
+            self, messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any) -> ChatResult:
+
+        time.sleep(self.latency)
+        return self._result(messages, stop)
+
+    async def _agenerate(
+            self, messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any) -> ChatResult:
+
+        await asyncio.sleep(self.latency)
+        return self._result(messages, stop)
+
+    async def _astream(
+            self, messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+
+        await asyncio.sleep(self.latency)
+        for token in re.findall(r'\s*\S+', self._complete(messages, stop)):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def react_script(tool_name: str) -> Callable[[str], str]:
+    """Calls tool_name once with the question, then answers with the observation"""
+
+    def script(prompt: str) -> str:
+        question_index = prompt.rfind('\nQuestion: ')
+        question = prompt[question_index + len('\nQuestion: '):].split('\n')[0]
+
+        observation_index = prompt.rfind('\nObservation: ')
+        if observation_index > question_index:
+            observation = prompt[observation_index + len('\nObservation: '):].split('\n')[0]
+            return f"Thought: I now know the final answer\nFinal Answer: {observation}"
+
+        return f"Thought: I should use {tool_name}\nAction: {tool_name}\nAction Input: {question}\nObservation:"
+
+    return script
@@ -0,0 +1,94 @@
+"""
+Latency, tokens and output agreement of every model assignment per role.
+
+Replays the prompts recorded with PROMPT_RECORD_PATH set (see openai_utils.recorder) on each
+candidate model of the role, against the live OpenAI API. Agreement compares the replayed output
+with the recorded one: equal JSON scores 1, otherwise the difflib ratio of the two texts.
+
+Run from ai/src: python -m benchmarks.roles prompts.jsonl [--samples N] [--models gpt-3.5-turbo,gpt-4-1106-preview]
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+from difflib import SequenceMatcher
+from collections import defaultdict
+from statistics import mean, median
+from langchain.adapters.openai import convert_dict_to_message
+from langchain.callbacks import get_openai_callback
+
+from openai_utils.models import get_openai_llm
+from openai_utils.router import get_role_models
+
+SAMPLES = 20  # Recorded prompts replayed per role
+
+
+def agreement(expected: str, output: str) -> float:
+    try:
+        if json.loads(expected) == json.loads(output):
+            return 1.0
+    except ValueError:
+        pass
+
+    return SequenceMatcher(a=expected, b=output).ratio()
+
+
+def load_records(path: str, samples: int) -> dict:
+    records = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            records[record['role']].append(record)
+
+    # The latest recordings are the closest to the current prompts
+    return {role: calls[-samples:] for role, calls in records.items()}
+
+
+async def replay(model_name: str, records: list) -> dict:
+    llm = get_openai_llm(temperature=0.05, model_name=model_name, cache=False)
+
+    latencies, scores = [], []
+    with get_openai_callback() as cb:
+        for record in records:
+            messages = [convert_dict_to_message(m) for m in record['messages']]
+
+            start = time.perf_counter()
+            output = await llm.ainvoke(messages)
+            latencies.append(time.perf_counter() - start)
+            scores.append(agreement(record['output'], output.content))
+
+    return {
+        'samples': len(records),
+        'p50_s': median(latencies),
+        'max_s': max(latencies),
+        'tokens_per_call': cb.total_tokens / len(records),
+        'cost_per_call': cb.total_cost / len(records),
+        'agreement': mean(scores)
+    }
+
+
+async def compare(records: dict, models: list) -> dict:
+    role_models = get_role_models()
+    report = {}
+
+    for role, calls in records.items():
+        candidates = models or role_models.get(role, [])
+        report[role] = {model_name: await replay(model_name, calls) for model_name in candidates}
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('records')
+    parser.add_argument('--samples', type=int, default=SAMPLES)
+    parser.add_argument('--models', help='Comma separated models, every model of the role by default')
+    args = parser.parse_args()
+
+    models = args.models.split(',') if args.models else []
+    report = asyncio.run(compare(load_records(args.records, args.samples), models))
+
+    json.dump(report, sys.stdout, indent=4)
+    print()
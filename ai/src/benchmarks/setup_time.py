@@ -0,0 +1,46 @@
+"""
+Per-request setup cost of the agent graph.
+
+Before: every request rebuilt the LLM clients, chains and tools (build_registry + start).
+After: the registry is built once at startup and a request only allocates its AgentRun.
+
+Run from ai/src: python -m benchmarks.setup_time
+"""
+
+import time
+import tracemalloc
+from statistics import mean, median
+
+from agent_builder import build_registry, get_registry
+
+ROUNDS = 50
+
+
+def measure(setup) -> dict:
+    timings = []
+    tracemalloc.start()
+    for i in range(ROUNDS):
+        start = time.perf_counter()
+        setup()
+        timings.append((time.perf_counter() - start) * 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'mean_ms': mean(timings), 'p50_ms': median(timings), 'peak_kb': peak / 1024}
+
+
+def main():
+    get_registry()
+
+    before = measure(lambda: build_registry().agent.start(question=''))
+    after = measure(lambda: get_registry().agent.start(question=''))
+
+    for name, result in [('per-request build', before), ('shared registry', after)]:
+        print(f"{name:>18}: mean {result['mean_ms']:.3f} ms, p50 {result['p50_ms']:.3f} ms, "
+              f"peak {result['peak_kb']:.1f} KiB")
+
+    print(f'Speedup: {before["mean_ms"] / after["mean_ms"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Latency of agent runs with and without speculative retrieval.
+
+Offline: the step model and the retrieval tool are simulated with fixed latencies. A share of the
+tasks makes the agent call a different tool first, so the speculation is cancelled for those.
+
+Run from ai/src: python -m benchmarks.speculation
+"""
+
+import io
+import time
+import json
+import asyncio
+import contextlib
+from queue import Queue
+from statistics import mean
+
+from framework.agent import Agent
+from framework.agent_tool import AgentTool
+from framework.agent_stream import AgentStream
+from framework.speculation import get_speculation_stats
+from benchmarks.fake_llm import ScriptedChatModel
+
+RUNS = 50
+STEP_LATENCY = 0.3  # In seconds
+RETRIEVAL_LATENCY = 0.5  # In seconds
+MISS_EVERY = 5  # Every n-th task calls the other tool first
+
+
+def script(prompt: str) -> str:
+    question_index = prompt.rfind('\nQuestion: ')
+    question = prompt[question_index + len('\nQuestion: '):].split('\n')[0]
+    if prompt.rfind('\nObservation: ') > question_index:
+        return "Thought: I now know the final answer\nFinal Answer: done"
+
+    tool = 'Calculator' if question.endswith('calculate') else 'Retrieval tool'
+    return f"Thought: I should use {tool}\nAction: {tool}\nAction Input: {question}\nObservation:"
+
+
+def build_agent(speculate: bool) -> Agent:
+    async def retrieve(input: str) -> str:
+        await asyncio.sleep(RETRIEVAL_LATENCY)
+        return f'retrieved:{input}'
+
+    async def calculate(input: str) -> str:
+        return '42'
+
+    tools = [
+        AgentTool(function=retrieve, name='Retrieval tool', description='Retrieves'),
+        AgentTool(function=calculate, name='Calculator', description='Calculates')
+    ]
+
+    return Agent(
+        llm=ScriptedChatModel(script=script, latency=STEP_LATENCY),
+        tools=tools,
+        max_iterations=3,
+        speculative_tool='Retrieval tool' if speculate else None
+    )
+
+
+async def measure(speculate: bool) -> dict:
+    agent = build_agent(speculate)
+    tasks = [f'task {i}' + (' calculate' if i % MISS_EVERY == 0 else '') for i in range(RUNS)]
+
+    async def run(task: str) -> float:
+        start = time.perf_counter()
+        await agent.invoke(task, stream=AgentStream(queue=Queue(), is_verbose=False))
+        return time.perf_counter() - start
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        latencies = await asyncio.gather(*[run(task) for task in tasks])
+
+    return {'mean_s': mean(latencies), 'max_s': max(latencies)}
+
+
+async def compare() -> dict:
+    return {
+        'without': await measure(speculate=False),
+        'with': await measure(speculate=True),
+        'speculation': get_speculation_stats()
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(asyncio.run(compare()), indent=4))
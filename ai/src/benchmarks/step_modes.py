@@ -0,0 +1,93 @@
+"""
+Iterations and tokens per task for the ReAct and function-calling step modes.
+
+Runs every task through the production tools with both modes against the live OpenAI API,
+so OPENAI_API_KEY and the tool keys must be set. The agents are built as in production, ReAct steps are
+streamed when STREAMING_STEPS is on, and the nested math agent runs in the compared mode too. Tokens are
+counted by the task ledger, which also sees streamed completions, and the LLM response cache is off so a
+mode never replays the other's answers. Tasks are read one per line from the file given as the first
+argument, or taken from TASKS.
+
+Run from ai/src: python -m benchmarks.step_modes [tasks.txt]
+"""
+
+import io
+import sys
+import json
+import asyncio
+import contextlib
+from statistics import mean
+from typing import Any, Optional
+from langchain.globals import set_llm_cache
+from langchain.schema.cache import BaseCache, RETURN_VAL_TYPE
+
+from agent_builder import get_registry, MAX_ITERATIONS, STREAMING_STEPS
+from framework.agent import Agent, StepMode
+from framework.agent_stream import DiscardingStream
+from math_tools.math_tool import get_math_tool
+from ledger import TaskLedger, current_ledger
+
+TASKS = [
+    "Give me the definition of uniform continuity based on academic books.",
+    "What is 17 to the power of 0.35?",
+    "Write a calculus question about the chain rule for first year students and type it in LaTeX.",
+]
+
+
+class NoCache(BaseCache):
+    """Installed in place of the response cache, the clients are built with caching on"""
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        pass
+
+    def clear(self, **kwargs: Any) -> None:
+        pass
+
+
+async def run_task(agent: Agent, task: str) -> dict:
+    run = agent.start(question=task, stream=DiscardingStream())
+    ledger = TaskLedger(task)
+    current_ledger.set(ledger)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        await run.invoke()
+
+    prompt_tokens = sum([m['prompt_tokens'] for m in ledger.models.values()])
+    completion_tokens = sum([m['completion_tokens'] for m in ledger.models.values()])
+
+    return {
+        'iterations': run.iterations,
+        'parse_failures': run.parse_failures,
+        'llm_calls': ledger.llm_calls,
+        'tokens': prompt_tokens + completion_tokens,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens
+    }
+
+
+async def compare(tasks: list) -> dict:
+    registry = get_registry()
+    set_llm_cache(NoCache())
+    report = {}
+
+    for mode in [StepMode.REACT, StepMode.FUNCTIONS]:
+        math_tool = get_math_tool(max_iter=MAX_ITERATIONS, streaming=STREAMING_STEPS, mode=mode)
+        tools = [math_tool if t.name == math_tool.name else t for t in registry.tools]
+        agent = Agent(
+            llm=registry.llm, tools=tools, max_iterations=MAX_ITERATIONS, streaming=STREAMING_STEPS, mode=mode
+        )
+        results = [await run_task(agent, task) for task in tasks]
+
+        report[mode] = {key: mean([r[key] for r in results]) for key in results[0]}
+
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            TASKS = [line.strip() for line in f if line.strip()]
+
+    print(json.dumps(asyncio.run(compare(TASKS)), indent=4))
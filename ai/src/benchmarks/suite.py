@@ -0,0 +1,234 @@
+"""
+Offline benchmark suite of the framework's own overhead: every LLM is a ScriptedChatModel without latency
+and every tool a stub, so the timings are the agent, parser, chain and tool plumbing alone.
+
+- agent: Agent.invoke throughput and per-iteration overhead, with plain and streamed steps;
+- parser: parse_step and the streamed StepParser per step;
+- retrieval: retrieval_tool fan-out over sub queries, engine choice, search and summary, with the fused plan
+  and with the two-stage sub query and engine chooser calls;
+- wrappers: chain_as_tool with a direct binding and with the wrapper LLM;
+- cassette: replay of recorded tasks, when a cassette is given (see benchmarks.cassette).
+
+Results are printed as JSON, tagged with the commit, to compare them across commits.
+
+Run from ai/src: python -m benchmarks.suite [--levels 1,10,100] [--cassette prompts.jsonl] [--output results.json]
+"""
+
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import contextlib
+import subprocess
+from queue import Queue
+from collections import Counter
+from statistics import mean
+from typing import Awaitable, Callable, Dict, List
+
+from langchain.prompts import PromptTemplate
+from langchain.chains import LLMChain
+
+from framework.agent import Agent
+from framework.agent_tool import AgentTool
+from framework.agent_stream import AgentStream
+from framework.step_parser import StepParser, parse_step
+from framework.chain_wrappers import chain_as_tool
+from query_tools.retrieval_tool import get_retrieval_tool
+from benchmarks.fake_llm import ScriptedChatModel
+from benchmarks.cassette import load_cassette, questions, cassette_script, stub_tools
+
+LEVELS = [1, 10, 100]  # Concurrent runs
+MIN_RUNS = 200  # Runs per level, at least the level itself
+ITERATIONS = 4  # Agent iterations per run, the last one answers
+PARSER_ROUNDS = 5000
+SUB_QUERIES = 3
+ENGINES = ['Wikipedia', 'Google Search', 'Academic library']
+
+STEP = "Thought: I should look it up\nAction: Stub\nAction Input: {question} #{i}\nObservation:"
+ANSWER = "Thought: I now know the final answer\nFinal Answer: {question}"
+
+
+def quiet_stream() -> AgentStream:
+    return AgentStream(queue=Queue(), is_verbose=False)
+
+
+async def stub(input: str) -> str:
+    return f'stub:{input}'
+
+
+async def measure(call: Callable[[int], Awaitable], level: int) -> Dict[str, float]:
+    """Runs the call MIN_RUNS times with the given number of concurrent calls"""
+    runs = max(MIN_RUNS, level)
+    semaphore = asyncio.Semaphore(level)
+    latencies = []
+
+    async def run(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*[run(i) for i in range(runs)])
+    elapsed = time.perf_counter() - start
+
+    return {'runs': runs, 'runs_per_s': runs / elapsed, 'mean_ms': 1000 * mean(latencies)}
+
+
+def agent_script(prompt: str) -> str:
+    question_index = prompt.rfind('\nQuestion: ')
+    question = prompt[question_index + len('\nQuestion: '):].split('\n')[0]
+    steps = prompt.count('\nObservation: ', question_index)
+
+    if steps + 1 >= ITERATIONS:
+        return ANSWER.format(question=question)
+
+    return STEP.format(question=question, i=steps)
+
+
+async def bench_agent(levels: List[int], streaming: bool) -> Dict:
+    agent = Agent(
+        llm=ScriptedChatModel(script=agent_script),
+        tools=[AgentTool(function=stub, name='Stub', description='Returns its input')],
+        max_iterations=ITERATIONS,
+        streaming=streaming
+    )
+
+    results = {}
+    for level in levels:
+        result = await measure(lambda i: agent.invoke(f'task {i}', stream=quiet_stream()), level)
+        result['iteration_overhead_ms'] = result['mean_ms'] / ITERATIONS
+        results[level] = result
+
+    return results
+
+
+def bench_parser() -> Dict:
+    tool_list = ('Stub', 'Other')
+    step = STEP.format(question='What is the derivative of x squared', i=0)
+    tokens = step.split(' ')
+
+    start = time.perf_counter()
+    for i in range(PARSER_ROUNDS):
+        parse_step(step, tool_list=tool_list)
+    parse_us = 1e6 * (time.perf_counter() - start) / PARSER_ROUNDS
+
+    start = time.perf_counter()
+    for i in range(PARSER_ROUNDS):
+        parser = StepParser(tool_list=tool_list)
+        for token in tokens:
+            parser.feed(token + ' ')
+        parser.result()
+    stream_us = 1e6 * (time.perf_counter() - start) / PARSER_ROUNDS
+
+    return {'parse_step_us': parse_us, 'stream_parser_us': stream_us, 'step_tokens': len(tokens)}
+
+
+def retrieval_script(prompt: str) -> str:
+    if 'Plan the search' in prompt:
+        return json.dumps({'queries': [
+            {'query': f'sub query {i}', 'engine': ENGINES[i % len(ENGINES)]} for i in range(SUB_QUERIES)
+        ]})
+    if 'Break it down to sub queries' in prompt:
+        return json.dumps({'queries': [f'sub query {i}' for i in range(SUB_QUERIES)]})
+    if 'Decide which engine is best' in prompt:
+        return json.dumps({'engine': ENGINES[len(prompt) % len(ENGINES)]})
+
+    return 'Summary of the results.'
+
+
+async def bench_retrieval(levels: List[int], fused_planning: bool) -> Dict:
+    calls = Counter()
+
+    def script(prompt: str) -> str:
+        calls['llm'] += 1
+        return retrieval_script(prompt)
+
+    engines = [AgentTool(function=stub, name=name, description=f'Stub {name}') for name in ENGINES]
+    tool = get_retrieval_tool(llm=ScriptedChatModel(script=script), search_tools=engines, fused_planning=fused_planning)
+
+    results = {}
+    for level in levels:
+        calls.clear()
+        results[level] = await measure(lambda i: tool.invoke(f'query {i}'), level)
+        results[level]['llm_calls_per_run'] = calls['llm'] / results[level]['runs']
+
+    return results
+
+
+async def bench_wrappers(levels: List[int]) -> Dict:
+    variables = {'question': 'The question', 'level': 'The difficulty level'}
+    chain = LLMChain(
+        llm=ScriptedChatModel(script=lambda prompt: 'Chain output.'),
+        prompt=PromptTemplate.from_template('{question} {level}')
+    )
+    binder_llm = ScriptedChatModel(script=lambda prompt: json.dumps({'question': 'q', 'level': 'easy'}))
+    tool = chain_as_tool(
+        llm=binder_llm, chain=chain, variables=variables, tool_name='Stub chain', tool_description='Stub chain'
+    )
+
+    direct = 'question: What is a limit?\nlevel: easy'
+    wrapped = 'A question about limits for first year students'
+
+    return {
+        'direct': {level: await measure(lambda i: tool.invoke(direct), level) for level in levels},
+        'llm': {level: await measure(lambda i: tool.invoke(wrapped), level) for level in levels}
+    }
+
+
+async def bench_cassette(path: str, levels: List[int]) -> Dict:
+    records = load_cassette(path)
+    script = cassette_script(records, fallback=lambda prompt: ANSWER.format(question='unrecorded step'))
+    agent = Agent(llm=ScriptedChatModel(script=script), tools=stub_tools(records), max_iterations=10)
+    tasks = questions(records)
+
+    results = {}
+    for level in levels:
+        results[level] = await measure(lambda i: agent.invoke(tasks[i % len(tasks)], stream=quiet_stream()), level)
+
+    steps = script.stats['hits'] + script.stats['misses']
+    return {'tasks': len(tasks), 'steps': len(records), 'hit_rate': script.stats['hits'] / steps, **results}
+
+
+def commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def run_suite(levels: List[int], cassette: str = None) -> Dict:
+    results = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'agent': await bench_agent(levels, streaming=False),
+        'agent_streaming': await bench_agent(levels, streaming=True),
+        'parser': bench_parser(),
+        'retrieval': await bench_retrieval(levels, fused_planning=True),
+        'retrieval_two_stage': await bench_retrieval(levels, fused_planning=False),
+        'wrappers': await bench_wrappers(levels)
+    }
+    if cassette:
+        results['cassette'] = await bench_cassette(cassette, levels)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', default=','.join(map(str, LEVELS)), help='Comma separated concurrency levels')
+    parser.add_argument('--cassette', help='Prompt recording to replay')
+    parser.add_argument('--output', help='Written to stdout by default')
+    args = parser.parse_args()
+
+    results = asyncio.run(run_suite([int(level) for level in args.levels.split(',')], args.cassette))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    else:
+        json.dump(results, sys.stdout, indent=4)
+        print()
@@ -5,16 +5,45 @@ load_dotenv()
 
 # OpenAI
 OPENAI_API_KEY = os.environ['OPENAI_API_KEY']
+OPENAI_API_BASE = os.environ.get('OPENAI_API_BASE', 'https://api.openai.com/v1')  # Also read by langchain
 
 # Wolfram Alpha
 WOLFRAM_ALPHA_APPID = os.environ['WOLFRAM_ALPHA_APPID']
+WOLFRAM_ALPHA_API_URL = os.environ.get('WOLFRAM_ALPHA_API_URL', 'https://api.wolframalpha.com/v2/query')
 
 # Serper API
 SERPER_API_KEY = os.environ['SERPER_API_KEY']
+SERPER_API_URL = os.environ.get('SERPER_API_URL', 'https://google.serper.dev')
+
+# Wikipedia
+WIKIPEDIA_API_URL = os.environ.get('WIKIPEDIA_API_URL', 'https://en.wikipedia.org/w/api.php')
 
 # Vector Store API
 VS_API_URL = os.environ['VS_API_URL']
 
+# LLM response cache
+LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH', 'llm_cache.sqlite')
+
+# Cost and latency ledger of the served tasks
+LEDGER_PATH = os.environ.get('LEDGER_PATH', 'ledger.sqlite')
+
+# Span traces of the served tasks, as JSONL, tracing is off when unset
+TRACE_PATH = os.environ.get('TRACE_PATH')
+
+# Model routing, a JSON object mapping roles to a list of models, the first one preferred
+ROLE_MODELS = os.environ.get('ROLE_MODELS')
+PROMPT_RECORD_PATH = os.environ.get('PROMPT_RECORD_PATH')
+
+# Prompt recording whose engine chooser calls seed the local engine router
+ENGINE_ROUTER_DECISIONS = os.environ.get('ENGINE_ROUTER_DECISIONS')
+
+# Folded stack profiles of the requests sent with the profile flag, which must be the token, off when unset
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+
+# Warmup steps run before the service reports ready, comma separated, the others happen on first use
+WARMUP_STEPS = os.environ.get('WARMUP_STEPS', 'imports,agent,pools,caches')
+
 # Flask
 SERVER_HOST = os.environ['SERVER_HOST']
 SERVER_PORT = int(os.environ['SERVER_PORT'])
@@ -1,6 +1,7 @@
+import json
 import inspect
 import asyncio
-from queue import Queue
+from types import MappingProxyType
 from typing import List, Dict, Union, Optional
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
@@ -9,7 +10,17 @@ from langchain.schema.language_model import BaseLanguageModel
 from framework import console
 from framework.keywords import Keyword
 from framework.agent_tool import AgentTool
-from framework.agent_stream import AgentStream
+from framework.agent_stream import AgentStream, DiscardingStream
+from framework.transcript import Transcript
+from framework.speculation import SIMILARITY_THRESHOLD, Speculation
+from framework.step_parser import STOP_SEQUENCES, StepParser, parse_step
+from framework.function_calling import (
+    function_step_prompt, final_answer_schema, function_name, tool_schema, parse_function_step
+)
+from openai_utils.tokens import num_tokens
+from ledger import record_iterations
+from metrics import AGENT_RUNS, AGENT_ITERATIONS, AGENT_PROMPT_TOKENS
+from tracing import span
 
 
 step_template = f"""You are a great decision maker but terrible at anything else.
@@ -23,7 +34,8 @@ Use this format:
 {Keyword.THOUGHT}: you should always think about what to do
 {Keyword.ACTION}: the action to take, should be one of [{{tool_names}}]
 {Keyword.INPUT}: the input to the action
-{Keyword.OBSERVATION}: stop and wait for the result of the action
+...(If several actions don't depend on each other, this {Keyword.ACTION}/{Keyword.INPUT} can repeat to run them together)
+{Keyword.OBSERVATION}: stop and wait for the results of the actions
 ...(This {Keyword.THOUGHT}/{Keyword.ACTION}/{Keyword.INPUT}/{Keyword.OBSERVATION} can repeat N times)
 
 When you have enough information to answer the question, use the following format:
@@ -41,128 +53,243 @@ Begin!
 {{workflow}}
 """
 
+step_prompt = PromptTemplate.from_template(step_template)
+
+MAX_PROMPT_TOKENS = 6000  # Step prompt size above which older observations are compacted
+OBSERVATION_TOKENS = 200  # Size a compacted observation is truncated to
+MAX_ACTIONS = 4  # Actions run concurrently in a single step
+
+
+class StepMode:
+    REACT = 'react'  # Free-text ReAct format parsed from the completion
+    FUNCTIONS = 'functions'  # Native tool calling of the chat model
+
 
 class Agent:
+    """Immutable agent definition, safe to share between concurrent invocations"""
     def __init__(
             self, llm: BaseLanguageModel,
             tools: List[AgentTool],
             max_iterations: int,
-            stream: Optional[AgentStream] = None):
+            stream: Optional[AgentStream] = None,
+            streaming: bool = False,
+            mode: str = StepMode.REACT,
+            max_actions: int = MAX_ACTIONS,
+            max_prompt_tokens: Optional[int] = MAX_PROMPT_TOKENS,
+            observation_tokens: int = OBSERVATION_TOKENS,
+            speculative_tool: Optional[str] = None,
+            speculation_threshold: float = SIMILARITY_THRESHOLD):
 
         self.model = llm
-        self.tools = tools
+        self.model_name = getattr(llm, 'model_name', 'gpt-4')
+        self.tools = tuple(tools)
         self.max_iter = max_iterations
-        self.stream = AgentStream(queue=Queue(), is_verbose=True) if not stream else stream
-
-        self.question = ''
-        self.workflow = ''
-        self.answer = ''
-        self.tool_list = [f'{t.name}' for t in self.tools]
+        self.stream = stream
+        self.streaming = streaming
+        self.mode = mode
+        self.max_actions = max_actions
+        self.max_prompt_tokens = max_prompt_tokens
+        self.observation_tokens = observation_tokens
+        self.speculation_threshold = speculation_threshold
+
+        self.tool_list = tuple(f'{t.name}' for t in self.tools)
         self.tool_names = ','.join([f'{t.name}' for t in self.tools])
         self.tool_desc = '\n'.join([f'{t.name}: {t.description}' for t in self.tools])
-        self.tool_map = {t.name: t for t in self.tools}
+        self.tool_map = MappingProxyType({t.name: t for t in self.tools})
+        self.speculative_tool = self.tool_map.get(speculative_tool) if speculative_tool else None
+        self.step_chain = LLMChain(llm=self.model, prompt=step_prompt)
 
-    def step(self) -> Union[Dict, None]:
-        step_prompt = PromptTemplate.from_template(step_template)
-        step_chain = LLMChain(llm=self.model, prompt=step_prompt)
-        try:
-            output = step_chain(
-                inputs={
-                    'tool_desc': self.tool_desc,
-                    'tool_names': self.tool_names,
-                    'question': self.question,
-                    'workflow': self.workflow
-                }
+        base_prompt = step_prompt.format(tool_desc=self.tool_desc, tool_names=self.tool_names, question='', workflow='')
+
+        if self.mode == StepMode.FUNCTIONS:
+            schemas = [tool_schema(t) for t in self.tools] + [final_answer_schema]
+            self.function_map = MappingProxyType({function_name(t.name): t.name for t in self.tools})
+            self.function_chain = function_step_prompt | self.model.bind(tools=schemas)
+            base_prompt = function_step_prompt.format(question='', workflow='') + json.dumps(schemas)
+
+        self.base_tokens = num_tokens(base_prompt, model_name=self.model_name)
+
+    def start(self, question: str, stream: Optional[AgentStream] = None) -> 'AgentRun':
+        if not stream:
+            stream = self.stream if self.stream else DiscardingStream(is_verbose=True)
+
+        return AgentRun(agent=self, question=question, stream=stream)
+
+    async def invoke(self, question: str, stream: Optional[AgentStream] = None) -> str:
+        run = self.start(question=question, stream=stream)
+
+        with span('agent', 'agent', model=self.model_name, mode=self.mode) as agent_span:
+            answer = await run.invoke()
+            agent_span.set(
+                iterations=run.iterations,
+                parse_failures=run.parse_failures,
+                max_prompt_tokens=max(run.prompt_tokens, default=None)
             )
-            step = output['text']
-        except Exception as e:
-            raise e
 
-        result = {}
+        return answer
 
-        try:
-            if '\nObservation:' in step:
-                thought_index = step.find('Thought:')
-                action_index = step.find('Action:')
-                action_input_index = step.find('Action Input:')
-                observation_index = step.find('Observation:')
 
-                result['thought'] = step[thought_index + len('Thought:'):action_index].strip()
-                result['tool'] = step[action_index + len('Action:'):action_input_index].strip()
-                result['input'] = step[action_input_index + len('Action Input:'):observation_index].strip()
+class AgentRun:
+    """Per-invocation session of an Agent, holds the transcript of a single run"""
+    def __init__(self, agent: Agent, question: str, stream: AgentStream):
+        self.agent = agent
+        self.stream = stream
 
-                if result['tool'] not in self.tool_list:
-                    return None
+        self.question = question
+        self.transcript = Transcript(model_name=agent.model_name, observation_tokens=agent.observation_tokens)
+        self.answer = ''
 
-            elif '\nFinal Answer:' in step:
-                answer_index = step.find('Final Answer:')
-                result['answer'] = step[answer_index + len('Final Answer:'):].strip()
+        # Prompt size of every step, after compaction
+        self.prompt_tokens: List[int] = []
+        self.iterations = 0
+        self.parse_failures = 0
+        self.question_tokens = num_tokens(question, model_name=agent.model_name)
 
-            else:
-                return None
+    @property
+    def workflow(self) -> str:
+        return self.transcript.render()
 
-            return result
+    def record(self, keyword: str, text: str):
+        record = self.transcript.add(keyword=keyword, text=text)
+        self.stream.write(record.render())
 
-        except Exception as e:
-            raise e
+    def render_workflow(self) -> str:
+        fixed_tokens = self.agent.base_tokens + self.question_tokens
+
+        budget = None
+        if self.agent.max_prompt_tokens is not None:
+            budget = self.agent.max_prompt_tokens - fixed_tokens
+
+        workflow = self.transcript.render(max_tokens=budget)
+        self.prompt_tokens.append(fixed_tokens + num_tokens(workflow, model_name=self.agent.model_name))
+        AGENT_PROMPT_TOKENS.observe(self.prompt_tokens[-1])
+
+        return workflow
+
+    def step_inputs(self) -> Dict:
+        return {
+            'tool_desc': self.agent.tool_desc,
+            'tool_names': self.agent.tool_names,
+            'question': self.question,
+            'workflow': self.render_workflow()
+        }
+
+    async def step(self) -> Union[Dict, None]:
+        if self.agent.mode == StepMode.FUNCTIONS:
+            return await self.function_step()
+
+        if self.agent.streaming:
+            return await self.stream_step()
+
+        output = await self.agent.step_chain.ainvoke(input={**self.step_inputs(), 'stop': STOP_SEQUENCES})
+        return parse_step(output['text'], tool_list=self.agent.tool_list)
+
+    async def stream_step(self) -> Union[Dict, None]:
+        parser = StepParser(tool_list=self.agent.tool_list)
+        prompt = step_prompt.format_prompt(**self.step_inputs())
+
+        # The completion ends with the action, closing the stream early (on cancellation) cancels it
+        tokens = self.agent.model.astream(prompt, stop=STOP_SEQUENCES)
+        try:
+            async for chunk in tokens:
+                parser.feed(chunk if isinstance(chunk, str) else chunk.content)
+        finally:
+            await tokens.aclose()
+
+        return parser.result()
+
+    async def function_step(self) -> Union[Dict, None]:
+        message = await self.agent.function_chain.ainvoke(self.step_inputs())
+        return parse_function_step(message, function_map=self.agent.function_map)
 
     def process_step(self, data: Dict) -> bool:
         if data is None:
-            self.workflow += "\n\nCould not parse your thought.\nStick to the format you were given!\n"
+            self.parse_failures += 1
+            self.transcript.add(
+                keyword=None,
+                text="\n\nCould not parse your thought.\nStick to the format you were given!\n"
+            )
 
             return False
 
         elif 'answer' in data.keys():
             self.answer = data['answer']
 
-            self.workflow += f"\nThought: I now know the final answer"
-            self.stream.write(f"\nThought: I now know the final answer")
-
-            self.workflow += f"\nFinal Answer: {data['answer']}"
-            self.stream.write(f"\nFinal Answer: {data['answer']}")
+            self.record(Keyword.THOUGHT, "I now know the final answer")
+            self.record(Keyword.ANSWER, data['answer'])
 
             return True
 
         else:
-            self.workflow += f"\nThought: {data['thought']}"
-            self.stream.write(f"\nThought: {data['thought']}")
+            # Only the actions which run are kept, one without an observation would pass for done
+            data['actions'] = data['actions'][:self.agent.max_actions]
 
-            self.workflow += f"\nAction: {data['tool']}"
-            self.stream.write(f"\nAction: {data['tool']}")
-
-            self.workflow += f"\nAction Input: {data['input']}"
-            self.stream.write(f"\nAction Input: {data['input']}")
+            self.record(Keyword.THOUGHT, data['thought'])
+            for action in data['actions']:
+                self.record(Keyword.ACTION, action['tool'])
+                self.record(Keyword.INPUT, action['input'])
 
             return False
 
-    async def invoke(self, question: str) -> str:
-        self.question = question
-        self.workflow = ''
-        self.answer = ''
-
+    async def invoke(self) -> str:
         console.bold('\n> CustomAgent is running\n')
 
-        self.workflow += f"\nQuestion: {question}"
-        self.stream.write(f"\nQuestion: {question}")
+        self.record(Keyword.QUESTION, self.question)
 
-        for i in range(self.max_iter):
-            data = self.step()
-            is_answered = self.process_step(data=data)
+        # Started on the raw question while the first step is generated, resolved by the first step
+        speculation = None
+        AGENT_RUNS.inc()
+        if self.agent.speculative_tool is not None:
+            speculation = Speculation(self.agent.speculative_tool, self.question, self.agent.speculation_threshold)
 
-            if is_answered:
-                break
+        try:
+            for i in range(self.agent.max_iter):
+                self.iterations += 1
+                with span('agent.step', 'agent', iteration=self.iterations) as step_span:
+                    data = await self.step()
+                    step_span.set(prompt_tokens=self.prompt_tokens[-1] if self.prompt_tokens else None)
+                is_answered = self.process_step(data=data)
+
+                if is_answered:
+                    break
+
+                # Unparsable step, the transcript tells the model to stick to the format
+                if data is None:
+                    continue
+
+                # Independent actions of the same step run concurrently
+                actions = data['actions']
+                invokes = []
+                for action in actions:
+                    if speculation is not None and speculation.matches(action):
+                        invokes.append(speculation.adopt())
+                        speculation = None
+                    else:
+                        invokes.append(self.agent.tool_map[action['tool']].invoke(action['input']))
+
+                if speculation is not None:
+                    speculation.cancel()
+                    speculation = None
+
+                observations = await asyncio.gather(*invokes)
+
+                for action, observation in zip(actions, observations):
+                    prefix = f"{action['tool']}: " if len(actions) > 1 else ''
+                    self.record(Keyword.OBSERVATION, prefix + observation)
 
-            try:
-                observation = await self.tool_map[data['tool']].invoke(data['input'])
-                self.workflow += f"\nObservation: {observation}"
-                self.stream.write(f"\nObservation: {observation}")
+        except Exception as e:
+            console.bold('\n> CustomAgent is exiting due to exception...\n')
+            raise e
 
-            except Exception as e:
-                self.stream.write(None)
-                console.bold('\n> CustomAgent is exiting due to exception...\n')
-                raise e
+        finally:
+            # The stream ends however the run does, its reader waits for it
+            self.stream.write(None)
+            if speculation is not None:
+                speculation.cancel()
+            record_iterations(self.iterations)
+            AGENT_ITERATIONS.observe(self.iterations)
+            AGENT_RUNS.dec()
 
-        self.stream.write(None)
         console.bold('\n> CustomAgent is finished\n')
 
         return self.answer
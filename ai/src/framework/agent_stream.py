@@ -3,6 +3,7 @@ from typing import Union, Optional
 from queue import Queue
 
 from framework import console
+from metrics import track_queue
 
 
 class AgentStream:
@@ -11,6 +12,7 @@ class AgentStream:
             is_verbose: Optional[bool] = False):
 
         self.q = queue
+        track_queue(queue)
         self.is_verbose = is_verbose
 
     def write(self, input: Union[str, None]):
@@ -35,4 +37,11 @@ class AgentStream:
         return self.q.get()
 
 
+class DiscardingStream(AgentStream):
+    """Stream nobody reads, of nested agents and of runs without a client: shown when verbose, never queued"""
+    def __init__(self, is_verbose: Optional[bool] = False):
+        super().__init__(queue=Queue(), is_verbose=is_verbose)
 
+    def write(self, input: Union[str, None]):
+        if input is not None and self.is_verbose:
+            console.highlight(text=input)
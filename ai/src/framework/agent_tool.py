@@ -1,7 +1,14 @@
+import time
 import inspect
 import asyncio
+import contextvars
 from typing import Callable
 
+from ledger import current_tool, record_tool_call
+from metrics import TOOL_LATENCY
+from tracing import span
+from profiler import attached
+
 
 class AgentTool:
     def __init__(self, function: Callable, name: str, description: str):
@@ -9,9 +16,28 @@ class AgentTool:
         self.name = name
         self.description = description
 
+    def run_attached(self, input: str) -> str:
+        # Sampled with the request when it's profiled, the executor thread isn't its own
+        with attached():
+            return self.function(input)
+
     async def invoke(self, input: str) -> str:
-        if inspect.iscoroutinefunction(self.function):
-            return await self.function(input)
+        # LLM calls made while the tool runs are attributed to it in the task ledger
+        tool_token = current_tool.set(self.name)
+        start = time.monotonic()
+
+        try:
+            with span(f'tool {self.name}', 'tool'):
+                if inspect.iscoroutinefunction(self.function):
+                    return await self.function(input)
+
+                # The thread runs in a copy of the context, so the ledger and the current span follow it
+                loop = asyncio.get_running_loop()
+                context = contextvars.copy_context()
+                return await loop.run_in_executor(None, lambda: context.run(self.run_attached, input))
 
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, lambda: self.function(input))
+        finally:
+            latency = time.monotonic() - start
+            record_tool_call(self.name, latency)
+            TOOL_LATENCY.labels(self.name).observe(latency)
+            current_tool.reset(tool_token)
@@ -1,10 +1,12 @@
 import json
-from typing import Optional
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Optional, Union
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from langchain.schema.language_model import BaseLanguageModel
 
 from framework.agent_tool import AgentTool
+from tracing import span
 
 
 wrapper_template = """Here is a documentation of a specific JSON scheme:
@@ -25,6 +27,86 @@ Begin!
 JSON:
 """
 
+wrapper_prompt = PromptTemplate.from_template(wrapper_template)
+
+wrapper_stats = Counter()
+
+
+def get_json_scheme(variables: dict) -> str:
+    json_scheme = ',\n\t'.join(['"' + name + '": "' + desc + '"' for name, desc in variables.items()])
+    return '{\n\t' + json_scheme + '\n}'
+
+
+def get_wrapper_chain(llm: BaseLanguageModel) -> LLMChain:
+    return LLMChain(llm=llm, prompt=wrapper_prompt)
+
+
+def get_wrapper_stats() -> Dict[str, int]:
+    """How many requests were bound by each path, 'llm' being the wrapper LLM fallback"""
+    return dict(wrapper_stats)
+
+
+def strip_code_block(text: str) -> str:
+    text = text.replace('```json', '')
+    return text.replace('```', '').strip()
+
+
+def bind_directly(request: str, variables: dict) -> Union[dict, None]:
+    """Binds the request to the tool variables without an LLM call, when its structure allows it"""
+
+    # Valid JSON with every variable
+    try:
+        inputs = json.loads(strip_code_block(request), strict=False)
+        if isinstance(inputs, dict) and all([name in inputs for name in variables]):
+            wrapper_stats['json'] += 1
+            return {name: str(inputs[name]) for name in variables}
+    except ValueError:
+        pass
+
+    # The whole request is the only variable
+    if len(variables) == 1:
+        wrapper_stats['single'] += 1
+        return {name: request for name in variables}
+
+    # "name: value" lines, a line without a known name continues the previous value
+    inputs = {}
+    name = None
+    for line in request.split('\n'):
+        key, separator, value = line.partition(':')
+        if separator and key.strip() in variables:
+            name = key.strip()
+            inputs[name] = value.strip()
+        elif name is not None:
+            inputs[name] += '\n' + line
+
+    if inputs and all([name in inputs for name in variables]):
+        wrapper_stats['lines'] += 1
+        return {name: value.strip() for name, value in inputs.items()}
+
+    return None
+
+
+def get_variable_binder(llm: BaseLanguageModel, variables: dict) -> Callable[[str], Awaitable[dict]]:
+    json_scheme = get_json_scheme(variables=variables)
+    wrapper_chain = get_wrapper_chain(llm=llm)
+
+    async def bind(request: str) -> dict:
+        inputs = bind_directly(request=request, variables=variables)
+        if inputs is not None:
+            return inputs
+
+        wrapper_stats['llm'] += 1
+        with span('wrapper', 'chain'):
+            response = await wrapper_chain.ainvoke(
+                input={
+                    'json_scheme': json_scheme,
+                    'request': request
+                })
+
+        return json.loads(strip_code_block(response['text']), strict=False)
+
+    return bind
+
 
 def chain_as_tool(
         llm: BaseLanguageModel,
@@ -34,30 +116,18 @@ def chain_as_tool(
         tool_description: str
 ) -> AgentTool:
 
-    def wrapper(request: Optional[str] = None) -> str:
-        json_scheme = ',\n\t'.join(['"' + name + '": "' + desc + '"' for name, desc in variables.items()])
-        json_scheme = '{\n\t' + json_scheme + '\n}'
-
-        wrapper_prompt = PromptTemplate.from_template(wrapper_template)
-        wrapper_chain = LLMChain(llm=llm, prompt=wrapper_prompt)
+    bind = get_variable_binder(llm=llm, variables=variables)
 
+    async def wrapper(request: Optional[str] = None) -> str:
         # check for the values we have been given
         if not request:
             return """Could not continue with an empty request from the tool"""
 
-        response = wrapper_chain(
-            inputs={
-                'json_scheme': json_scheme,
-                'request': request
-            })
-        scheme = response['text']
-        scheme = scheme.replace('```json', '')
-        scheme = scheme.replace('```', '')
-
         try:
-            inputs = json.loads(scheme, strict=False)
+            inputs = await bind(request)
 
-            output = chain.invoke(inputs)
+            with span(f'chain {tool_name}', 'chain'):
+                output = await chain.ainvoke(inputs)
             return output['text']
 
         except ValueError as e:
@@ -79,30 +149,18 @@ def sequential_chain_as_tool(
         tool_description: str
 ) -> AgentTool:
 
-    def wrapper(request: Optional[str] = None) -> str:
-        json_scheme = ',\n\t'.join(['"' + name + '": "' + desc + '"' for name, desc in variables.items()])
-        json_scheme = '{\n\t' + json_scheme + '\n}'
-
-        wrapper_prompt = PromptTemplate.from_template(wrapper_template)
-        wrapper_chain = LLMChain(llm=llm, prompt=wrapper_prompt)
+    bind = get_variable_binder(llm=llm, variables=variables)
 
+    async def wrapper(request: Optional[str] = None) -> str:
         # check for the values we have been given
         if not request:
             return """Could not continue with an empty request from the tool"""
 
-        response = wrapper_chain(
-            inputs={
-                'json_scheme': json_scheme,
-                'request': request
-            })
-        scheme = response['text']
-        scheme = scheme.replace('```json', '')
-        scheme = scheme.replace('```', '')
-
         try:
-            inputs = json.loads(scheme, strict=False)
+            inputs = await bind(request)
 
-            output = sequential_chain.invoke(inputs)
+            with span(f'chain {tool_name}', 'chain'):
+                output = await sequential_chain.ainvoke(inputs)
             return output['output']['text']
 
         except ValueError as e:
@@ -125,30 +183,18 @@ def code_chain_as_tool(
         language: str
 ) -> AgentTool:
 
-    def wrapper(request: Optional[str] = None) -> str:
-        json_scheme = ',\n\t'.join(['"' + name + '": "' + desc + '"' for name, desc in variables.items()])
-        json_scheme = '{\n\t' + json_scheme + '\n}'
-
-        wrapper_prompt = PromptTemplate.from_template(wrapper_template)
-        wrapper_chain = LLMChain(llm=llm, prompt=wrapper_prompt)
+    bind = get_variable_binder(llm=llm, variables=variables)
 
+    async def wrapper(request: Optional[str] = None) -> str:
         # check for the values we have been given
         if not request:
             return """Could not continue with an empty request from the tool"""
 
-        response = wrapper_chain(
-            inputs={
-                'json_scheme': json_scheme,
-                'request': request
-            })
-        scheme = response['text']
-        scheme = scheme.replace('```json', '')
-        scheme = scheme.replace('```', '')
-
         try:
-            inputs = json.loads(scheme, strict=False)
+            inputs = await bind(request)
 
-            output = chain.invoke(inputs)['text']
+            with span(f'chain {tool_name}', 'chain'):
+                output = (await chain.ainvoke(inputs))['text']
             output = output.replace(f'```{language}', '')
             output = output.replace('```', '')
 
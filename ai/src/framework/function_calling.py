@@ -0,0 +1,95 @@
+import re
+import json
+from typing import Dict, Mapping, Union
+from langchain.prompts import PromptTemplate
+from langchain.schema.messages import BaseMessage
+
+from framework.keywords import Keyword
+from framework.agent_tool import AgentTool
+
+
+function_step_template = f"""You are a great decision maker but terrible at anything else.
+Answer the following question as best you can by calling the tools you were given.
+
+Call several tools at once when their inputs don't depend on each other. When you have enough information 
+to answer the question, call the final_answer tool with the final answer to the original input question.
+
+Remember, you're only good at decision making and nothing else. 
+Don't attempt to do anything on your own, always use your tools.
+When you write the input for the tools, give as much details as are known to you.
+
+Begin!
+
+{Keyword.QUESTION} {{question}}
+{{workflow}}
+"""
+
+function_step_prompt = PromptTemplate.from_template(function_step_template)
+
+FINAL_ANSWER = 'final_answer'
+
+final_answer_schema = {
+    "type": "function",
+    "function": {
+        "name": FINAL_ANSWER,
+        "description": "Give the final answer to the original input question",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "answer": {"type": "string", "description": "The final answer to the original input question"}
+            },
+            "required": ["answer"]
+        }
+    }
+}
+
+
+def function_name(tool_name: str) -> str:
+    """OpenAI function names may only contain letters, digits, underscores and dashes"""
+    return re.sub(r'[^a-zA-Z0-9_-]', '_', tool_name)
+
+
+def tool_schema(tool: AgentTool) -> Dict:
+    return {
+        "type": "function",
+        "function": {
+            "name": function_name(tool.name),
+            "description": tool.description,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "thought": {"type": "string", "description": "Why you are using this tool"},
+                    "input": {"type": "string", "description": "The input to the tool, with all the known details"}
+                },
+                "required": ["input"]
+            }
+        }
+    }
+
+
+def parse_function_step(message: BaseMessage, function_map: Mapping[str, str]) -> Union[Dict, None]:
+    tool_calls = message.additional_kwargs.get('tool_calls')
+
+    # A plain reply without a tool call can only be an answer
+    if not tool_calls:
+        return {'answer': message.content.strip()} if message.content else None
+
+    thought = message.content or ''
+    actions = []
+    for tool_call in tool_calls:
+        call = tool_call['function']
+        try:
+            arguments = json.loads(call['arguments'], strict=False)
+        except ValueError:
+            return None
+
+        if call['name'] == FINAL_ANSWER:
+            return {'answer': str(arguments.get('answer', '')).strip()}
+
+        if call['name'] not in function_map:
+            return None
+
+        thought = arguments.get('thought', thought)
+        actions.append({'tool': function_map[call['name']], 'input': str(arguments.get('input', '')).strip()})
+
+    return {'thought': str(thought).strip(), 'actions': actions}
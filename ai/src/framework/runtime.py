@@ -0,0 +1,37 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+from profiler import current_profiler
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Process-wide event loop, running on a daemon thread, which drives every agent run"""
+    global _loop, _thread
+
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                _thread = threading.Thread(target=loop.run_forever, name='agent-runtime', daemon=True)
+                _thread.start()
+                _loop = loop
+
+    return _loop
+
+
+def submit(coroutine: Coroutine[Any, Any, Any]) -> Future:
+    """Schedule a coroutine on the runtime loop, usable from any thread"""
+    loop = get_event_loop()
+    # The run's tasks inherit the caller's context, a profiled request follows them on the loop thread
+    profiler = current_profiler.get()
+    if profiler is not None:
+        profiler.track(loop, _thread.ident)
+
+    return asyncio.run_coroutine_threadsafe(coroutine, loop)
@@ -0,0 +1,77 @@
+"""
+Speculative tool calls: a tool the agent nearly always calls first is started on the raw question
+while the first step is still being generated. If the agent then calls that tool with a similar input,
+the running call is adopted instead of starting a new one, otherwise it is cancelled.
+"""
+
+import re
+import time
+import asyncio
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from framework.agent_tool import AgentTool
+from tracing import span
+
+
+SIMILARITY_THRESHOLD = 0.5  # Word Jaccard similarity of the question and the action input
+
+speculation_stats = Counter()
+
+
+def similarity(a: str, b: str) -> float:
+    words_a = set(re.findall(r'\w+', a.lower()))
+    words_b = set(re.findall(r'\w+', b.lower()))
+    if not words_a or not words_b:
+        return 0.0
+
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def get_speculation_stats() -> Dict[str, Any]:
+    """Adopted and cancelled speculative calls, and the tool time the adopted ones saved"""
+    stats = dict(speculation_stats)
+    resolved = stats.get('hits', 0) + stats.get('misses', 0)
+    stats['hit_rate'] = stats.get('hits', 0) / resolved if resolved else 0.0
+
+    return stats
+
+
+class Speculation:
+    def __init__(self, tool: AgentTool, question: str, threshold: float = SIMILARITY_THRESHOLD):
+        self.tool = tool
+        self.question = question
+        self.threshold = threshold
+
+        self.start = time.monotonic()
+        self.finished: Optional[float] = None
+        self.task = asyncio.ensure_future(self.run())
+        speculation_stats['started'] += 1
+
+    async def run(self) -> str:
+        try:
+            with span('speculation', 'agent', tool=self.tool.name):
+                return await self.tool.invoke(self.question)
+        finally:
+            self.finished = time.monotonic()
+
+    def matches(self, action: Dict) -> bool:
+        return action['tool'] == self.tool.name and similarity(self.question, action['input']) >= self.threshold
+
+    def adopt(self) -> 'asyncio.Future[str]':
+        # Tool time already spent when the agent asked for the call
+        saved = (self.finished or time.monotonic()) - self.start
+        speculation_stats['hits'] += 1
+        speculation_stats['saved_ms'] += int(1000 * saved)
+
+        return self.task
+
+    def cancel(self):
+        if self.task.done():
+            # Retrieved so a failed speculation isn't reported as a never retrieved exception
+            if not self.task.cancelled():
+                self.task.exception()
+        else:
+            self.task.cancel()
+
+        speculation_stats['misses'] += 1
@@ -0,0 +1,63 @@
+import re
+from typing import Dict, List, Sequence, Union
+
+from framework.keywords import Keyword
+
+
+# The model must stop and wait for the tool instead of hallucinating an observation
+STOP_SEQUENCES = [f'\n{Keyword.OBSERVATION}:']
+
+# One or more Action / Action Input pairs, an input ends where the next action starts
+action_pattern = re.compile(
+    rf'{Keyword.ACTION}:(.*?)\n{Keyword.INPUT}:(.*?)(?=\n{Keyword.ACTION}:|$)',
+    flags=re.DOTALL
+)
+
+
+def parse_step(step: str, tool_list: Sequence[str]) -> Union[Dict, None]:
+    result = {}
+
+    thought_index = step.find(f'{Keyword.THOUGHT}:')
+    action_index = step.find(f'{Keyword.ACTION}:')
+    action_input_index = step.find(f'{Keyword.INPUT}:')
+    answer_index = step.find(f'{Keyword.ANSWER}:')
+
+    if action_index != -1 and action_input_index > action_index and \
+            (answer_index == -1 or answer_index > action_input_index):
+        observation_index = step.find(f'{Keyword.OBSERVATION}', action_input_index)
+        if observation_index == -1:
+            observation_index = len(step)
+
+        result['thought'] = step[thought_index + len(f'{Keyword.THOUGHT}:'):action_index].strip()
+        result['actions'] = [
+            {'tool': tool.strip(), 'input': input.strip()}
+            for tool, input in action_pattern.findall(step[action_index:observation_index])
+        ]
+
+        if not result['actions'] or any([a['tool'] not in tool_list for a in result['actions']]):
+            return None
+
+    elif answer_index != -1:
+        result['answer'] = step[answer_index + len(f'{Keyword.ANSWER}:'):].strip()
+
+    else:
+        return None
+
+    return result
+
+
+class StepParser:
+    """
+    Parser for a streamed step completion, which collects the tokens as they arrive.
+    The completion stops at the Observation keyword, see STOP_SEQUENCES, so the end of the stream is where
+    the Action Input is complete and the tool can be dispatched.
+    """
+    def __init__(self, tool_list: Sequence[str]):
+        self.tool_list = tool_list
+        self.tokens: List[str] = []
+
+    def feed(self, token: str):
+        self.tokens.append(token)
+
+    def result(self) -> Union[Dict, None]:
+        return parse_step(''.join(self.tokens), tool_list=self.tool_list)
@@ -0,0 +1,71 @@
+from typing import List, Optional
+
+from framework.keywords import Keyword
+from openai_utils.tokens import num_tokens, truncate_tokens
+
+
+TRUNCATION_NOTE = ' ...[truncated]'
+
+
+class StepRecord:
+    """A single typed entry of the agent workflow, e.g. a Thought or an Observation"""
+    def __init__(self, keyword: Optional[str], text: str):
+        self.keyword = keyword
+        self.text = text
+        self.tokens = None
+
+    def render(self, text: Optional[str] = None) -> str:
+        text = self.text if text is None else text
+        if self.keyword is None:
+            return text
+
+        return f"\n{self.keyword}: {text}"
+
+
+class Transcript:
+    """
+    Agent workflow held as a list of step records and rendered on demand.
+    When the rendering exceeds the token budget, older observations are truncated,
+    oldest first, while the latest observation is always kept whole.
+    """
+    def __init__(self, model_name: str, observation_tokens: int):
+        self.model_name = model_name
+        self.observation_tokens = observation_tokens
+        self.records: List[StepRecord] = []
+
+    def add(self, keyword: Optional[str], text: str) -> StepRecord:
+        record = StepRecord(keyword=keyword, text=text)
+        self.records.append(record)
+
+        return record
+
+    def count(self, record: StepRecord) -> int:
+        if record.tokens is None:
+            record.tokens = num_tokens(record.render(), model_name=self.model_name)
+
+        return record.tokens
+
+    def num_tokens(self) -> int:
+        return sum([self.count(r) for r in self.records])
+
+    def render(self, max_tokens: Optional[int] = None) -> str:
+        rendered = [r.render() for r in self.records]
+        if max_tokens is None:
+            return ''.join(rendered)
+
+        total = self.num_tokens()
+        observations = [i for i, r in enumerate(self.records) if r.keyword == Keyword.OBSERVATION]
+
+        for i in observations[:-1]:
+            if total <= max_tokens:
+                break
+
+            record = self.records[i]
+            if self.count(record) <= self.observation_tokens:
+                continue
+
+            text = truncate_tokens(record.text, self.observation_tokens, model_name=self.model_name)
+            rendered[i] = record.render(text + TRUNCATION_NOTE)
+            total -= self.count(record) - num_tokens(rendered[i], model_name=self.model_name)
+
+        return ''.join(rendered)
@@ -0,0 +1,231 @@
+"""
+Process-wide HTTP connection pool shared by every outbound client: OpenAI, Serper, Wolfram Alpha,
+Wikipedia and the vector store. Connections are kept alive between calls, every host gets its own
+cap of concurrent requests, and the pool records how often a connection was reused and how long a
+request waited for one.
+
+The async client belongs to the agent runtime loop (see framework.runtime), the connections it keeps
+can't be used from another event loop.
+"""
+
+import time
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+import httpx
+
+from config import OPENAI_API_BASE, SERPER_API_URL, WOLFRAM_ALPHA_API_URL, WIKIPEDIA_API_URL, VS_API_URL
+from tracing import span
+
+
+MAX_CONNECTIONS = 100  # Open connections over all hosts
+MAX_KEEPALIVE = 40  # Idle connections kept open
+KEEPALIVE_EXPIRY = 90  # In seconds, before an idle connection is closed
+CONNECT_TIMEOUT = 10  # In seconds
+READ_TIMEOUT = 180  # In seconds, long completions stream slowly
+HOST_REQUESTS = 16  # Concurrent requests per host without an entry in HOST_LIMITS
+
+# Concurrent requests per host
+HOST_LIMITS = {
+    urlparse(OPENAI_API_BASE).hostname: 64,
+    urlparse(SERPER_API_URL).hostname: 16,
+    urlparse(WOLFRAM_ALPHA_API_URL).hostname: 8,
+    urlparse(WIKIPEDIA_API_URL).hostname: 8,
+    urlparse(VS_API_URL).hostname: 16,
+}
+
+# httpcore trace events which open a new connection rather than reuse a pooled one
+CONNECT_EVENTS = ('connection.connect_tcp.started', 'connection.connect_unix_socket.started')
+SEND_EVENTS = ('http11.send_request_headers.started', 'http2.send_request_headers.started')
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.in_flight = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class PoolStats:
+    def __init__(self):
+        self.hosts: Dict[str, HostStats] = defaultdict(HostStats)
+        self.lock = threading.Lock()
+
+    def start(self, host: str):
+        with self.lock:
+            self.hosts[host].in_flight += 1
+
+    def finish(self, host: str, wait: float, is_new_connection: bool):
+        with self.lock:
+            stats = self.hosts[host]
+            stats.requests += 1
+            stats.in_flight -= 1
+            stats.new_connections += is_new_connection
+            stats.wait_total += wait
+            stats.wait_max = max(stats.wait_max, wait)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {
+                host: {
+                    'requests': stats.requests,
+                    'in_flight': stats.in_flight,
+                    'new_connections': stats.new_connections,
+                    'reuse_ratio': 1 - stats.new_connections / stats.requests if stats.requests else 0.0,
+                    'mean_wait_ms': 1000 * stats.wait_total / stats.requests if stats.requests else 0.0,
+                    'max_wait_ms': 1000 * stats.wait_max
+                } for host, stats in self.hosts.items()
+            }
+
+
+class RequestTrace:
+    """Times the wait for a connection of a single request from the httpcore trace events"""
+    def __init__(self):
+        self.start = time.monotonic()
+        self.wait: Optional[float] = None
+        self.is_new_connection = False
+
+    def event(self, name: str):
+        if self.wait is None and (name in CONNECT_EVENTS or name in SEND_EVENTS):
+            self.wait = time.monotonic() - self.start
+        if name in CONNECT_EVENTS:
+            self.is_new_connection = True
+
+
+class PooledAsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, stats: PoolStats):
+        self.transport = transport
+        self.stats = stats
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(HOST_LIMITS.get(host, HOST_REQUESTS))
+
+        return self.semaphores[host]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        trace = RequestTrace()
+
+        async def on_event(name: str, info: dict):
+            trace.event(name)
+
+        request.extensions['trace'] = on_event
+        self.stats.start(host)
+        try:
+            with span(f'http {host}', 'http', method=request.method, path=request.url.path) as http_span:
+                async with self.semaphore(host):
+                    response = await self.transport.handle_async_request(request)
+                http_span.set(status=response.status_code, new_connection=trace.is_new_connection)
+
+                return response
+        finally:
+            self.stats.finish(host, trace.wait or time.monotonic() - trace.start, trace.is_new_connection)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class PooledTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, stats: PoolStats):
+        self.transport = transport
+        self.stats = stats
+        self.semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self.lock = threading.Lock()
+
+    def semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(HOST_LIMITS.get(host, HOST_REQUESTS))
+
+            return self.semaphores[host]
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        trace = RequestTrace()
+
+        request.extensions['trace'] = lambda name, info: trace.event(name)
+        self.stats.start(host)
+        try:
+            with span(f'http {host}', 'http', method=request.method, path=request.url.path) as http_span:
+                with self.semaphore(host):
+                    response = self.transport.handle_request(request)
+                http_span.set(status=response.status_code, new_connection=trace.is_new_connection)
+
+                return response
+        finally:
+            self.stats.finish(host, trace.wait or time.monotonic() - trace.start, trace.is_new_connection)
+
+    def close(self):
+        self.transport.close()
+
+
+_stats = PoolStats()
+_async_client: Optional[httpx.AsyncClient] = None
+_sync_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+
+def get_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+
+def get_timeout() -> httpx.Timeout:
+    return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                transport = httpx.AsyncHTTPTransport(limits=get_limits())
+                _async_client = httpx.AsyncClient(
+                    transport=PooledAsyncTransport(transport, _stats),
+                    timeout=get_timeout()
+                )
+
+    return _async_client
+
+
+def get_sync_client() -> httpx.Client:
+    global _sync_client
+
+    if _sync_client is None:
+        with _client_lock:
+            if _sync_client is None:
+                transport = httpx.HTTPTransport(limits=get_limits())
+                _sync_client = httpx.Client(
+                    transport=PooledTransport(transport, _stats),
+                    timeout=get_timeout()
+                )
+
+    return _sync_client
+
+
+async def prime(urls: List[str]):
+    """Opens a kept alive connection to the host of every url ahead of the first requests"""
+    client = get_async_client()
+
+    async def head(url: str):
+        try:
+            await client.head(url, timeout=CONNECT_TIMEOUT)
+        except httpx.HTTPError as e:
+            print(f'Could not prime a connection to {url}: {e}')
+
+    await asyncio.gather(*[head(url) for url in urls])
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """Reuse ratio and connection wait of the requests sent to every host"""
+    return _stats.get_stats()
@@ -0,0 +1,269 @@
+"""
+Cost and latency ledger of the served tasks. Every task run gets a TaskLedger in a context variable,
+the LLM clients and the agent tools add their calls to it, and a row is queued when the run ends, which a
+writer thread inserts into SQLite so the event loop never waits for a commit.
+
+Report over a time window, from ai/src: python ledger.py [--hours 24] [--top 5]
+"""
+
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import argparse
+import threading
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, List, Optional
+
+from config import LEDGER_PATH
+
+
+# USD per 1K tokens, prompt and completion
+MODEL_PRICES = {
+    'gpt-4-1106-preview': (0.01, 0.03),
+    'gpt-4': (0.03, 0.06),
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'gpt-3.5-turbo-1106': (0.001, 0.002),
+}
+
+current_ledger: ContextVar[Optional['TaskLedger']] = ContextVar('current_ledger', default=None)
+current_tool: ContextVar[Optional[str]] = ContextVar('current_tool', default=None)
+
+
+def call_cost(model_name: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model_name, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class TaskLedger:
+    """Calls made while serving a single task"""
+    def __init__(self, task: str):
+        self.task = task
+        self.started = time.time()
+        self.duration = 0.0
+        self.status = 'ok'
+        self.cached = False
+        self.iterations = 0
+        self.llm_calls = 0
+
+        self.models: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self.roles: Dict[str, int] = defaultdict(int)
+        self.tools: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self.lock = threading.Lock()
+
+    def add_llm_call(self, role: Optional[str], model_name: str, prompt_tokens: int, completion_tokens: int):
+        tokens = prompt_tokens + completion_tokens
+        tool = current_tool.get()
+
+        with self.lock:
+            self.llm_calls += 1
+
+            model = self.models[model_name]
+            model['calls'] += 1
+            model['prompt_tokens'] += prompt_tokens
+            model['completion_tokens'] += completion_tokens
+            model['cost'] += call_cost(model_name, prompt_tokens, completion_tokens)
+
+            self.roles[role or 'unrouted'] += tokens
+            if tool is not None:
+                self.tools[tool]['tokens'] += tokens
+
+    def add_tool_call(self, tool: str, latency: float):
+        with self.lock:
+            self.tools[tool]['calls'] += 1
+            self.tools[tool]['latency'] += latency
+
+    def row(self) -> tuple:
+        with self.lock:
+            prompt_tokens = sum([m['prompt_tokens'] for m in self.models.values()])
+            completion_tokens = sum([m['completion_tokens'] for m in self.models.values()])
+            cost = sum([m['cost'] for m in self.models.values()])
+
+            return (
+                self.started, self.duration, self.status, int(self.cached), self.iterations, self.llm_calls,
+                int(prompt_tokens), int(completion_tokens), cost,
+                json.dumps(self.models), json.dumps(self.roles), json.dumps(self.tools), self.task
+            )
+
+
+class Ledger:
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS task_ledger ('
+            'started REAL NOT NULL, duration REAL NOT NULL, status TEXT NOT NULL, cached INTEGER NOT NULL, '
+            'iterations INTEGER NOT NULL, llm_calls INTEGER NOT NULL, prompt_tokens INTEGER NOT NULL, '
+            'completion_tokens INTEGER NOT NULL, cost REAL NOT NULL, '
+            'models TEXT NOT NULL, roles TEXT NOT NULL, tools TEXT NOT NULL, task TEXT NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS task_ledger_started ON task_ledger (started)')
+        self.db.commit()
+
+        self.queue = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self.write_loop, name='ledger-writer', daemon=True)
+        self.writer.start()
+        atexit.register(self.flush)
+
+    def write(self, ledger: TaskLedger):
+        """Queues the row of the task for the writer thread"""
+        self.queue.put(ledger.row())
+
+    def write_loop(self):
+        while True:
+            rows = [self.queue.get()]
+            self.insert(rows + self.drain())
+
+    def drain(self) -> List[tuple]:
+        rows = []
+        while True:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                return rows
+
+    def insert(self, rows: List[tuple]):
+        """Inserts the rows in one transaction"""
+        if not rows:
+            return
+
+        try:
+            with self.lock:
+                self.db.executemany('INSERT INTO task_ledger VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self.db.commit()
+        except sqlite3.Error as e:
+            print(f'Could not write {len(rows)} rows to the task ledger: {e}')
+
+    def flush(self):
+        self.insert(self.drain())
+
+    def rows(self, since: float) -> List[Dict[str, Any]]:
+        self.flush()
+        with self.lock:
+            cursor = self.db.execute('SELECT * FROM task_ledger WHERE started >= ?', (since,))
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+_ledger: Optional[Ledger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> Ledger:
+    global _ledger
+
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = Ledger(LEDGER_PATH)
+
+    return _ledger
+
+
+def record_llm_call(role: Optional[str], model_name: str, prompt_tokens: int, completion_tokens: int):
+    ledger = current_ledger.get()
+    if ledger is not None:
+        ledger.add_llm_call(role, model_name, prompt_tokens, completion_tokens)
+
+
+def record_tool_call(tool: str, latency: float):
+    ledger = current_ledger.get()
+    if ledger is not None:
+        ledger.add_tool_call(tool, latency)
+
+
+def record_iterations(iterations: int):
+    """Iterations of the task's own agent, nested agents run inside a tool aren't counted"""
+    ledger = current_ledger.get()
+    if ledger is not None and current_tool.get() is None:
+        ledger.iterations += iterations
+
+
+def mark_cached():
+    ledger = current_ledger.get()
+    if ledger is not None:
+        ledger.cached = True
+
+
+async def ledgered(task: str, coroutine: Awaitable[Any]) -> Any:
+    """Awaits the coroutine serving the task and queues its ledger row when it ends"""
+    ledger = TaskLedger(task)
+    current_ledger.set(ledger)
+
+    start = time.monotonic()
+    try:
+        return await coroutine
+    except BaseException as e:
+        ledger.status = type(e).__name__
+        raise
+    finally:
+        ledger.duration = time.monotonic() - start
+        get_ledger().write(ledger)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(int(p * len(values)), len(values) - 1)]
+
+
+def report(hours: float, top: int) -> Dict[str, Any]:
+    rows = get_ledger().rows(since=time.time() - hours * 60 * 60)
+    if not rows:
+        return {'tasks': 0}
+
+    durations = [r['duration'] for r in rows]
+    tokens = [r['prompt_tokens'] + r['completion_tokens'] for r in rows]
+
+    tools = defaultdict(lambda: defaultdict(float))
+    roles = defaultdict(int)
+    models = defaultdict(lambda: defaultdict(float))
+    for r in rows:
+        for name, stats in json.loads(r['tools']).items():
+            for key, value in stats.items():
+                tools[name][key] += value
+        for name, value in json.loads(r['roles']).items():
+            roles[name] += value
+        for name, stats in json.loads(r['models']).items():
+            for key, value in stats.items():
+                models[name][key] += value
+
+    expensive_tools = sorted(tools.items(), key=lambda item: item[1]['tokens'], reverse=True)[:top]
+
+    return {
+        'tasks': len(rows),
+        'cached': sum([r['cached'] for r in rows]),
+        'failed': sum([r['status'] != 'ok' for r in rows]),
+        'latency_s': {
+            'p50': percentile(durations, 0.5),
+            'p95': percentile(durations, 0.95),
+            'p99': percentile(durations, 0.99)
+        },
+        'tokens_per_task': sum(tokens) / len(rows),
+        'cost_per_task': sum([r['cost'] for r in rows]) / len(rows),
+        'llm_calls_per_task': sum([r['llm_calls'] for r in rows]) / len(rows),
+        'iterations_per_task': sum([r['iterations'] for r in rows]) / len(rows),
+        'models': models,
+        'roles': roles,
+        'most_expensive_tools': {
+            name: {
+                'tokens': stats['tokens'],
+                'calls': stats['calls'],
+                'mean_latency_s': stats['latency'] / stats['calls'] if stats['calls'] else 0.0
+            } for name, stats in expensive_tools
+        }
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Latency, token and cost report of the served tasks')
+    parser.add_argument('--hours', type=float, default=24, help='Time window, ending now')
+    parser.add_argument('--top', type=int, default=5, help='Number of most expensive tools listed')
+    args = parser.parse_args()
+
+    print(json.dumps(report(args.hours, args.top), indent=4))
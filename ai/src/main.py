@@ -1,29 +1,88 @@
-import asyncio
-import threading
-from queue import Queue
+import time
+from queue import Queue, Empty
+from concurrent.futures import Future, TimeoutError
 from flask import Flask, Response, request, jsonify, stream_with_context
 from jsonschema import validate, ValidationError
 
-from agent_builder import build_agent
-from config import SERVER_HOST, SERVER_PORT
+from ledger import ledgered
+from tracing import traced
+from metrics import instrument
+from profiler import profile_requests
+from startup import Warmup, WarmupStep, add_probes, lazy_import, select_steps
+from framework import runtime
+from config import (
+    OPENAI_API_BASE, SERPER_API_URL, WOLFRAM_ALPHA_API_URL, WIKIPEDIA_API_URL, VS_API_URL, WARMUP_STEPS,
+    SERVER_HOST, SERVER_PORT
+)
+
+# Imported on first use or by the warmup, they pull in langchain and the OpenAI client
+agent_builder = lazy_import('agent_builder')
+task_cache = lazy_import('task_cache')
+scheduler = lazy_import('openai_utils.scheduler')
+agent_stream = lazy_import('framework.agent_stream')
+speculation = lazy_import('framework.speculation')
+chain_wrappers = lazy_import('framework.chain_wrappers')
+engine_router = lazy_import('query_tools.engine_router')
+engine_racing = lazy_import('query_tools.engine_racing')
+http_transport = lazy_import('http_transport')
+llm_cache = lazy_import('openai_utils.llm_cache')
+router = lazy_import('openai_utils.router')
+tokens = lazy_import('openai_utils.tokens')
 
 
 STREAM_CHUNK_SIZE = 1
 
+
+def import_modules():
+    for module in [agent_builder, task_cache, scheduler, agent_stream, speculation, http_transport]:
+        module.load()
+
+
+def build_agent():
+    agent_builder.get_registry()
+    runtime.get_event_loop()
+
+
+def prime_pools():
+    urls = [OPENAI_API_BASE, SERPER_API_URL, WOLFRAM_ALPHA_API_URL, WIKIPEDIA_API_URL, VS_API_URL + '/healthz']
+    runtime.submit(http_transport.prime(urls)).result()
+
+
+def prime_caches():
+    task_cache.get_task_cache()
+    llm_cache.get_response_cache()
+    for models in router.get_role_models().values():
+        for model_name in models:
+            tokens.get_encoding(model_name)
+
+
+warmup = Warmup(select_steps([
+    WarmupStep('imports', import_modules),
+    WarmupStep('agent', build_agent),
+    WarmupStep('pools', prime_pools, required=False),
+    WarmupStep('caches', prime_caches, required=False)
+], WARMUP_STEPS))
+
 app = Flask(__name__)
+instrument(app)
+profile_requests(app)
+add_probes(app, warmup)
 
 task_schema = {
     "type": "object",
     "properties": {
         "task": {
             "type": "string"
+        },
+        "cache": {
+            "type": "boolean"
         }
     }, "required": ["task"]
 }
 
 
 @app.route("/discord/task", methods=['POST'])
-async def task():
+def task():
     data = request.get_json()
 
     if data is None:
@@ -36,13 +95,19 @@ async def task():
         return jsonify({"error": str(e)}), 400
 
     task = request.json['task']
+    use_cache = request.json.get('cache', True)
 
     try:
-        agent = build_agent()
-        result = await agent.invoke(task)
+        agent = agent_builder.get_registry().agent
+        run = runtime.submit(ledgered(task, traced(task, task_cache.ainvoke_cached(agent, task, use_cache=use_cache))))
+        result = run.result(timeout=agent_builder.AGENT_TIMEOUT)
 
         return jsonify({"answer": result}), 200
 
+    except TimeoutError:
+        run.cancel()
+        return jsonify({"error": "Task timed out"}), 504
+
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -61,30 +126,71 @@ def task_stream():
         return jsonify({"error": str(e)}), 400
 
     task = request.json['task']
+    use_cache = request.json.get('cache', True)
 
     try:
         queue = Queue()
-        agent = build_agent(stream_queue=queue)
-
-        def awrapper(task: str):
-            asyncio.run(agent.invoke(task))
-
-        thread = threading.Thread(target=awrapper, args=[task])
-        thread.start()
-
-        stream = streamer(queue)
+        agent = agent_builder.get_registry().agent
+        stream = agent_stream.AgentStream(queue=queue, is_verbose=True)
+        run = runtime.submit(scheduler.prioritized(
+            scheduler.Priority.INTERACTIVE,
+            ledgered(task, traced(task, task_cache.ainvoke_cached(agent, task, stream=stream, use_cache=use_cache)))
+        ))
+
+        stream = streamer(queue, run=run, timeout=agent_builder.AGENT_TIMEOUT)
         return Response(stream_with_context(stream))
 
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 
-def streamer(q: Queue):
+@app.route("/stats/http", methods=['GET'])
+def http_stats():
+    return jsonify(http_transport.get_stats()), 200
+
+
+@app.route("/stats/speculation", methods=['GET'])
+def speculation_stats():
+    return jsonify(speculation.get_speculation_stats()), 200
+
+
+@app.route("/stats/wrappers", methods=['GET'])
+def wrapper_stats():
+    return jsonify(chain_wrappers.get_wrapper_stats()), 200
+
+
+@app.route("/stats/routing", methods=['GET'])
+def routing_stats():
+    return jsonify(engine_router.get_router_stats()), 200
+
+
+@app.route("/stats/racing", methods=['GET'])
+def racing_stats():
+    return jsonify(engine_racing.get_racing_stats()), 200
+
+
+@app.route("/stats/scheduler", methods=['GET'])
+def scheduler_stats():
+    return jsonify(scheduler.get_scheduler().get_stats()), 200
+
+
+@app.route("/stats/llm-cache", methods=['GET'])
+def llm_cache_stats():
+    return jsonify(llm_cache.get_response_cache().get_stats()), 200
+
+
+def streamer(q: Queue, run: Future, timeout: float):
+    deadline = time.monotonic() + timeout
     token = ""
     while token is not None:
         chunk = ""
         for i in range(STREAM_CHUNK_SIZE):
-            token = q.get()
+            try:
+                token = q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except Empty:
+                run.cancel()
+                token = None
+                chunk += "\nTask timed out"
             if token is None:
                 break
             else:
@@ -93,4 +199,5 @@ def streamer(q: Queue):
 
 
 if __name__ == '__main__':
+    warmup.start()
     app.run(host=SERVER_HOST, port=SERVER_PORT)
@@ -2,9 +2,9 @@ from queue import Queue
 from typing import Optional
 
 from framework.agent_tool import AgentTool
-from framework.agent import Agent
-from framework.agent_stream import AgentStream
-from openai_utils.models import get_openai_llm
+from framework.agent import Agent, StepMode
+from framework.agent_stream import AgentStream, DiscardingStream
+from openai_utils.router import Role, get_role_llm
 from math_tools.wolfram_alpha import get_wolfram_alpha_tool
 from math_tools.question_writer import get_question_writer_tool
 from math_tools.question_solver import get_question_solver_tool
@@ -15,55 +15,60 @@ from math_tools.latex_writer import get_latex_tool
 def get_math_tool(
         max_iter: Optional[int] = 6,
         stream_queue: Optional[Queue] = None,
-        timeout: Optional[int] = 180
+        timeout: Optional[int] = 180,
+        streaming: bool = False,
+        mode: str = StepMode.REACT
 ) -> AgentTool:
 
     # Language Models
-    gpt3 = get_openai_llm(
-        temperature=0.05,
-        model_name='gpt-3.5-turbo'
-    )
-    gpt4 = get_openai_llm(
-        temperature=0.05,
-        model_name='gpt-4-1106-preview'
-    )
+    planner_llm = get_role_llm(Role.PLANNER)
+    solver_llm = get_role_llm(Role.SOLVER)
+    latex_llm = get_role_llm(Role.LATEX)
+    wrapper_llm = get_role_llm(Role.WRAPPER)
 
     # Tools
     wolfram_tool = get_wolfram_alpha_tool()
     question_writer = get_question_writer_tool(
-        llm=gpt4,
-        latex_llm=gpt3,
-        wrapper_llm=gpt4
+        llm=solver_llm,
+        latex_llm=latex_llm,
+        wrapper_llm=wrapper_llm
     )
     question_solver = get_question_solver_tool(
-        llm=gpt4,
-        latex_llm=gpt3,
-        wrapper_llm=gpt4
+        llm=solver_llm,
+        latex_llm=latex_llm,
+        wrapper_llm=wrapper_llm
     )
     proofreader = get_proofreader_tool(
-        llm=gpt4,
-        latex_llm=gpt3,
-        wrapper_llm=gpt4
+        llm=solver_llm,
+        latex_llm=latex_llm,
+        wrapper_llm=wrapper_llm
     )
     latex_typer = get_latex_tool(
-        llm=gpt3,
-        wrapper_llm=gpt4
+        llm=latex_llm,
+        wrapper_llm=wrapper_llm
     )
 
     tools = [wolfram_tool, question_writer, question_solver, proofreader, latex_typer]
 
-    # Streamer
-    queue = Queue() if not stream_queue else stream_queue
-    stream = AgentStream(queue=queue, is_verbose=True)
+    # Streamer, the agent is shared by every run so without a reader its steps are only shown
+    stream = AgentStream(queue=stream_queue, is_verbose=True) if stream_queue else DiscardingStream(is_verbose=True)
 
     # Agent
-    math_agent = Agent(llm=gpt4, tools=tools, max_iterations=max_iter, stream=stream)
+    math_agent = Agent(
+        llm=planner_llm,
+        tools=tools,
+        max_iterations=max_iter,
+        stream=stream,
+        streaming=streaming,
+        mode=mode
+    )
 
     async def wrapper(input: Optional[str] = None) -> str:
         if not input:
             return """Could not continue with an empty input"""
 
         try:
+            # Every invocation gets its own run, so concurrent calls don't share a transcript
             return await math_agent.invoke(input)
 
         except Exception as e:
@@ -1,14 +1,53 @@
-from langchain.utilities.wolfram_alpha import WolframAlphaAPIWrapper
+import wolframalpha
+import xmltodict
+import multidict
 
+from config import WOLFRAM_ALPHA_APPID, WOLFRAM_ALPHA_API_URL
 from framework.agent_tool import AgentTool
+from http_transport import get_async_client
+
+
+class PooledWolframClient(wolframalpha.Client):
+    """Queries Wolfram Alpha through the shared connection pool instead of a new client per query"""
+    url = WOLFRAM_ALPHA_API_URL
+
+    async def aquery(self, input, params=(), **kwargs):
+        response = await get_async_client().get(
+            self.url,
+            params=multidict.MultiDict(params, appid=self.app_id, input=input, **kwargs),
+            timeout=self.timeout
+        )
+
+        doc = xmltodict.parse(response.content, postprocessor=wolframalpha.Document.make)
+        if 'error' in doc:
+            error = doc['error']
+            raise ValueError(f"Error {error['@status']}: {error['@message']}")
+
+        return doc['queryresult']
 
 
 def get_wolfram_alpha_tool() -> AgentTool:
     """Remember to create environment variable named WOLFRAM_ALPHA_APPID with your Wolfram API app id"""
 
-    wolfram_api = WolframAlphaAPIWrapper()
+    wolfram_client = PooledWolframClient(WOLFRAM_ALPHA_APPID)
+
+    async def wrapper(query: str) -> str:
+        # Formatted like langchain's WolframAlphaAPIWrapper.run
+        result = await wolfram_client.aquery(query)
+
+        try:
+            assumption = next(result.pods).text
+            answer = next(result.results).text
+        except StopIteration:
+            return "Wolfram Alpha wasn't able to answer it"
+
+        if not answer:
+            return "No good Wolfram Alpha Result was found"
+
+        return f"Assumption: {assumption} \nAnswer: {answer}"
+
     wolfram_tool = AgentTool(
-        function=wolfram_api.run,
+        function=wrapper,
         name='Wolfram Alpha',
         description='Useful for doing numerical calculation'
     )
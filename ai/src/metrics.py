@@ -0,0 +1,82 @@
+"""
+Prometheus metrics of the service, scraped from GET /metrics. Observations are lock-cheap counter and
+histogram updates, the queue depths are only computed when scraped.
+"""
+
+import time
+import weakref
+from queue import Queue
+from typing import Iterable, Iterator
+from flask import Flask, Response, request, g
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 240)  # In seconds
+ITERATION_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10)
+PROMPT_TOKEN_BUCKETS = (500, 1000, 2000, 3000, 4000, 5000, 6000, 8000, 12000, 16000)
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests served', ['route', 'method', 'status'])
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to respond, the first chunk for streams', ['route'],
+    buckets=LATENCY_BUCKETS
+)
+AGENT_RUNS = Gauge('agent_runs_in_flight', 'Agent runs in progress, nested runs included')
+AGENT_ITERATIONS = Histogram('agent_iterations', 'Iterations used per agent run', buckets=ITERATION_BUCKETS)
+AGENT_PROMPT_TOKENS = Histogram(
+    'agent_step_prompt_tokens', 'Agent step prompt size after compaction', buckets=PROMPT_TOKEN_BUCKETS
+)
+LLM_LATENCY = Histogram('llm_call_duration_seconds', 'LLM call latency', ['model'], buckets=LATENCY_BUCKETS)
+TOOL_LATENCY = Histogram('tool_call_duration_seconds', 'Agent tool latency', ['tool'], buckets=LATENCY_BUCKETS)
+EMBEDDING_LATENCY = Histogram('embedding_call_duration_seconds', 'Embedding call latency', buckets=LATENCY_BUCKETS)
+
+# Queues of the live agent streams, dropped once their stream is collected
+stream_queues = weakref.WeakSet()
+
+STREAM_QUEUES = Gauge('stream_queues', 'Live agent stream queues')
+STREAM_QUEUES.set_function(lambda: len(stream_queues))
+STREAM_QUEUE_DEPTH = Gauge('stream_queue_depth', 'Chunks waiting in all the agent stream queues')
+STREAM_QUEUE_DEPTH.set_function(lambda: sum([q.qsize() for q in list(stream_queues)]))
+
+
+def track_queue(queue: Queue):
+    stream_queues.add(queue)
+
+
+def observe_first_chunk(chunks: Iterable, route: str, start: float) -> Iterator:
+    """Passes a streamed response through and observes its latency when the first chunk is sent"""
+    observed = False
+    try:
+        for chunk in chunks:
+            if not observed:
+                REQUEST_LATENCY.labels(route).observe(time.monotonic() - start)
+                observed = True
+            yield chunk
+    finally:
+        if not observed:
+            REQUEST_LATENCY.labels(route).observe(time.monotonic() - start)
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def instrument(app: Flask):
+    """Counts and times every request of the app and serves the metrics at /metrics"""
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.monotonic()
+
+    @app.after_request
+    def observe_request(response: Response) -> Response:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUESTS.labels(route, request.method, response.status_code).inc()
+        if 'request_start' in g:
+            if response.is_streamed:
+                response.response = observe_first_chunk(response.response, route, g.request_start)
+            else:
+                REQUEST_LATENCY.labels(route).observe(time.monotonic() - g.request_start)
+
+        return response
+
+    @app.route("/metrics", methods=['GET'])
+    def metrics():
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
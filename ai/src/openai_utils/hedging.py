@@ -0,0 +1,152 @@
+"""
+Hedged requests: when a call has not returned by a percentile of the recent latencies of its model,
+a duplicate is sent and the first response wins, the other one is cancelled. The share of hedged calls
+is capped by a budget so hedging can never multiply the cost. Only idempotent, non-streaming calls
+may be hedged.
+
+Latencies and the hedge delay run from the moment a call leaves the scheduler's queue, the wait for a rate
+limit would otherwise pass for a slow response.
+"""
+
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+HEDGE_PERCENTILE = 0.95  # Of the recent latencies, after which a duplicate is sent
+MIN_SAMPLES = 20  # Latencies needed before any call is hedged
+RECENT_LATENCIES = 200  # Latencies kept per model
+HEDGE_BUDGET = 0.05  # Maximal share of calls which get a duplicate
+
+
+class Attempt:
+    """Start of a call's request, once the scheduler let it through"""
+    def __init__(self):
+        self.started: Optional[float] = None
+        self.event = asyncio.Event()
+
+    def start(self):
+        self.started = time.monotonic()
+        self.event.set()
+
+
+class ModelLatencies:
+    def __init__(self):
+        self.latencies = deque(maxlen=RECENT_LATENCIES)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+
+class HedgePolicy:
+    def __init__(
+            self, percentile: float = HEDGE_PERCENTILE,
+            min_samples: int = MIN_SAMPLES,
+            budget: float = HEDGE_BUDGET):
+
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = budget
+        self.models: Dict[str, ModelLatencies] = {}
+        self.lock = threading.Lock()
+
+    def model(self, model_name: str) -> ModelLatencies:
+        if model_name not in self.models:
+            self.models[model_name] = ModelLatencies()
+
+        return self.models[model_name]
+
+    def delay(self, model_name: str) -> Optional[float]:
+        with self.lock:
+            latencies = sorted(self.model(model_name).latencies)
+
+        if len(latencies) < self.min_samples:
+            return None
+
+        return latencies[min(int(self.percentile * len(latencies)), len(latencies) - 1)]
+
+    def take_budget(self, model_name: str) -> bool:
+        with self.lock:
+            model = self.model(model_name)
+            if model.hedges + 1 > self.budget * model.calls:
+                return False
+
+            model.hedges += 1
+            return True
+
+    def record(self, model_name: str, latency: float, is_hedge: bool = False):
+        with self.lock:
+            model = self.model(model_name)
+            model.calls += 1
+            model.latencies.append(latency)
+            if is_hedge:
+                model.hedge_wins += 1
+
+    async def arun(self, model_name: str, call: Callable[[Callable[[], None]], Awaitable[Any]]) -> Any:
+        """Runs the call, which is given the callback to make when its request is sent"""
+        attempt = Attempt()
+        primary = asyncio.ensure_future(call(attempt.start))
+        tasks = {primary: attempt}
+        started = asyncio.ensure_future(attempt.event.wait())
+
+        try:
+            delay = self.delay(model_name)
+            if delay is not None:
+                await asyncio.wait([primary, started], return_when=asyncio.FIRST_COMPLETED)
+                if not primary.done():
+                    done, _ = await asyncio.wait([primary], timeout=attempt.started + delay - time.monotonic())
+                    if not done and self.take_budget(model_name):
+                        hedge = Attempt()
+                        tasks[asyncio.ensure_future(call(hedge.start))] = hedge
+
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = done.pop()
+
+                # A failed attempt only loses when the other one can still answer
+                if winner.exception() is not None and pending:
+                    continue
+
+                result = winner.result()
+                self.record(model_name, time.monotonic() - tasks[winner].started, is_hedge=winner is not primary)
+                return result
+
+        finally:
+            started.cancel()
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            names = list(self.models)
+
+        stats = {}
+        for name in names:
+            model = self.models[name]
+            stats[name] = {
+                'calls': model.calls,
+                'hedges': model.hedges,
+                'hedge_wins': model.hedge_wins,
+                'hedge_delay': self.delay(name)
+            }
+
+        return stats
+
+
+_policy: Optional[HedgePolicy] = None
+_policy_lock = threading.Lock()
+
+
+def get_hedge_policy() -> HedgePolicy:
+    global _policy
+
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                _policy = HedgePolicy()
+
+    return _policy
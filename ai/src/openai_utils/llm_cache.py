@@ -0,0 +1,261 @@
+"""
+Exact-match cache for LLM responses, keyed on the model parameters (model, temperature, stop, bound tools)
+and the rendered prompt. An in-memory LRU sits in front of a SQLite table, both bounded in size, and entries
+expire after a TTL. Streaming calls are never cached, see get_openai_llm.
+
+Lookups and updates run on the event loop and never write to SQLite: new rows, access times (of memory
+hits too, so the disk LRU follows what is actually used) and expired keys are written behind by a flusher
+thread, every FLUSH_INTERVAL in a single transaction. The async lookup reads SQLite on a worker thread.
+"""
+
+import time
+import atexit
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Optional
+from langchain.globals import set_llm_cache
+from langchain.load.dump import dumps
+from langchain.load.load import loads
+from langchain.schema.cache import BaseCache, RETURN_VAL_TYPE
+
+from config import LLM_CACHE_PATH
+
+
+MEMORY_ENTRIES = 512  # Entries kept in the in-memory LRU
+DISK_ENTRIES = 50000  # Rows kept in SQLite, the least recently used are deleted above it
+TTL = 7 * 24 * 60 * 60  # In seconds
+PRUNE_INTERVAL = 100  # Inserts between two size checks of the SQLite table
+FLUSH_INTERVAL = 1.0  # In seconds, between two writes of the pending rows and access times to SQLite
+
+
+class LLMResponseCache(BaseCache):
+    def __init__(
+            self, path: str,
+            memory_entries: int = MEMORY_ENTRIES,
+            disk_entries: int = DISK_ENTRIES,
+            ttl: float = TTL,
+            flush_interval: float = FLUSH_INTERVAL):
+
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.stats = Counter()
+
+        self.memory: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.inserts = 0
+
+        # Disk writes waiting for the flusher thread: new rows, access times and expired keys
+        self.pending: Dict[str, tuple] = {}
+        self.touched: Dict[str, float] = {}
+        self.expired: set = set()
+        self.flushing: Dict[str, tuple] = {}  # Rows the flusher is writing, until they are committed
+
+        # Lookups read through their own connection, WAL lets them run while the flusher commits
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS llm_cache '
+            '(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self.db.commit()
+        self.reader_lock = threading.Lock()
+        self.writer = sqlite3.connect(path, check_same_thread=False)
+        self.writer_lock = threading.Lock()
+
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_loop, name='llm-cache-flusher', daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f'{llm_string}\n{prompt}'.encode()).hexdigest()
+
+    def remember(self, key: str, created: float, generations: RETURN_VAL_TYPE):
+        self.memory[key] = (created, generations)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def lookup_memory(self, key: str, now: float) -> Optional[RETURN_VAL_TYPE]:
+        with self.lock:
+            if key in self.memory:
+                created, generations = self.memory[key]
+                if now - created < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.touched[key] = now
+                    self.stats['memory_hits'] += 1
+                    return generations
+
+                del self.memory[key]
+
+        return None
+
+    def lookup_disk(self, key: str, now: float) -> Optional[RETURN_VAL_TYPE]:
+        """Reads the key from the rows not yet written or from SQLite, a blocking read alookup keeps off the loop"""
+        with self.lock:
+            row = self.pending.get(key) or self.flushing.get(key)
+
+        if row is not None:
+            row = row[1:3]
+        else:
+            with self.reader_lock:
+                row = self.db.execute('SELECT response, created FROM llm_cache WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+
+        response, created = row
+        if now - created >= self.ttl:
+            with self.lock:
+                self.pending.pop(key, None)
+                self.expired.add(key)
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+            return None
+
+        generations = loads(response)
+        with self.lock:
+            self.touched[key] = now
+            self.remember(key, created, generations)
+            self.stats['disk_hits'] += 1
+
+        return generations
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self.key(prompt, llm_string)
+        now = time.time()
+
+        generations = self.lookup_memory(key, now)
+        if generations is not None:
+            return generations
+
+        return self.lookup_disk(key, now)
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """Lookup which reads SQLite on a worker thread, memory hits are answered on the loop"""
+        key = self.key(prompt, llm_string)
+        now = time.time()
+
+        generations = self.lookup_memory(key, now)
+        if generations is not None:
+            return generations
+
+        return await asyncio.get_running_loop().run_in_executor(None, self.lookup_disk, key, now)
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        response = dumps(return_val)
+
+        with self.lock:
+            self.remember(key, now, return_val)
+            self.pending[key] = (key, response, now, now)
+            self.expired.discard(key)
+            self.stats['updates'] += 1
+
+    def flush_loop(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f'Could not flush the LLM response cache: {e}')
+
+    def flush(self):
+        """Writes the pending rows, access times and deletions in one transaction, off the event loop"""
+        with self.writer_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                self.flushing = pending
+                touched, self.touched = self.touched, {}
+                expired, self.expired = self.expired, set()
+
+            if not (pending or touched or expired):
+                return
+
+            try:
+                self.writer.executemany(
+                    'INSERT OR REPLACE INTO llm_cache (key, response, created, accessed) VALUES (?, ?, ?, ?)',
+                    [(key, response, created, max(accessed, touched.pop(key, 0.0)))
+                     for key, response, created, accessed in pending.values()]
+                )
+                self.writer.executemany(
+                    'UPDATE llm_cache SET accessed = MAX(accessed, ?) WHERE key = ?',
+                    [(accessed, key) for key, accessed in touched.items()]
+                )
+                self.writer.executemany('DELETE FROM llm_cache WHERE key = ?', [(key,) for key in expired])
+
+                inserts = self.inserts
+                self.inserts += len(pending)
+                if self.inserts // PRUNE_INTERVAL > inserts // PRUNE_INTERVAL:
+                    self.prune(time.time())
+
+                self.writer.commit()
+
+            finally:
+                with self.lock:
+                    self.flushing = {}
+
+    def close(self):
+        self.stopped.set()
+        self.flush()
+
+    def prune(self, now: float):
+        expired = self.writer.execute('DELETE FROM llm_cache WHERE created < ?', (now - self.ttl,)).rowcount
+        evicted = self.writer.execute(
+            'DELETE FROM llm_cache WHERE key IN '
+            '(SELECT key FROM llm_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+            (self.disk_entries,)
+        ).rowcount
+        with self.lock:
+            self.stats['expired'] += expired
+            self.stats['evictions'] += evicted
+
+    def clear(self, **kwargs: Any) -> None:
+        with self.lock:
+            self.memory.clear()
+            self.pending.clear()
+            self.flushing = {}
+            self.touched.clear()
+            self.expired.clear()
+
+        with self.writer_lock:
+            self.writer.execute('DELETE FROM llm_cache')
+            self.writer.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self.memory)
+
+        with self.reader_lock:
+            stats['disk_entries'] = self.db.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+
+        lookups = stats.get('memory_hits', 0) + stats.get('disk_hits', 0) + stats.get('misses', 0)
+        stats['hit_rate'] = (lookups - stats.get('misses', 0)) / lookups if lookups else 0.0
+
+        return stats
+
+
+_cache: Optional[LLMResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> LLMResponseCache:
+    """Process-wide response cache, installed as the langchain LLM cache on first use"""
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMResponseCache(path=LLM_CACHE_PATH)
+                set_llm_cache(_cache)
+
+    return _cache
@@ -1,26 +1,320 @@
-from typing import List
+import time
+import openai
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from langchain.pydantic_v1 import root_validator
+from langchain.globals import get_llm_cache
+from langchain.load.dump import dumps
 from langchain.chat_models import ChatOpenAI
+from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import BaseMessage, ChatResult
+from langchain.schema.output import ChatGenerationChunk
+from langchain.schema.messages import AIMessageChunk
 from langchain.chains.conversation.memory import ConversationBufferWindowMemory
 
 from config import OPENAI_API_KEY
+from http_transport import get_async_client, get_sync_client
+from openai_utils.tokens import num_tokens
+from openai_utils.llm_cache import LLMResponseCache, get_response_cache
+from openai_utils.scheduler import RETRIED_ERRORS, get_scheduler
+from openai_utils.hedging import get_hedge_policy
+from openai_utils.recorder import record_call
+from ledger import record_llm_call
+from metrics import LLM_LATENCY
+from tracing import span, start_span
+
+
+COMPLETION_TOKENS = 512  # Completion size assumed when max_tokens is not set
+FALLBACK_ERRORS = RETRIED_ERRORS  # Errors which the fallback models are tried on, once the scheduler gave up
+
+
+def pooled_clients(values: Dict) -> Tuple[openai.OpenAI, openai.AsyncOpenAI]:
+    """OpenAI clients of a langchain model sending their requests through the shared connection pool"""
+    client_params = {
+        'api_key': values['openai_api_key'],
+        'organization': values['openai_organization'],
+        'base_url': values['openai_api_base'],
+        'timeout': values['request_timeout'],
+        'max_retries': values['max_retries'],
+        'default_headers': values['default_headers'],
+        'default_query': values['default_query']
+    }
+
+    return (
+        openai.OpenAI(**client_params, http_client=get_sync_client()),
+        openai.AsyncOpenAI(**client_params, http_client=get_async_client())
+    )
+
+
+class ScheduledChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose calls wait for the process-wide scheduler, which also retries them"""
+    hedge: bool = False
+    """Whether slow non-streaming calls get a duplicate request, see openai_utils.hedging"""
+    role: Optional[str] = None
+    """Role the client was routed for, see openai_utils.router"""
+    fallback_llms: List[ChatOpenAI] = []
+    """Clients tried in order when a call fails with a rate limit, timeout, connection or server error"""
+
+    @root_validator()
+    def use_connection_pool(cls, values: Dict) -> Dict:
+        client, async_client = pooled_clients(values)
+        values['client'] = client.chat.completions
+        values['async_client'] = async_client.chat.completions
+        return values
+
+    def estimate_tokens(self, messages: List[BaseMessage]) -> int:
+        prompt = '\n'.join([m.content for m in messages if isinstance(m.content, str)])
+        return num_tokens(prompt, model_name=self.model_name) + (self.max_tokens or COMPLETION_TOKENS)
+
+    def settle(self, estimated: int, result: ChatResult):
+        usage = (result.llm_output or {}).get('token_usage') or {}
+        if 'total_tokens' in usage:
+            get_scheduler().limiter(self.model_name).settle(estimated, usage['total_tokens'])
+
+    def answered_by(self, result: ChatResult) -> str:
+        """Model of the result, which differs from the client's when a fallback answered"""
+        return (result.llm_output or {}).get('model_name', self.model_name)
+
+    def account(self, messages: List[BaseMessage], text: str, latency: float, result: Optional[ChatResult] = None):
+        """Records the call for prompt replays, in the metrics and in the ledger of the current task"""
+        model_name = self.answered_by(result) if result else self.model_name
+        record_call(self.role, model_name, messages, text, latency)
+        LLM_LATENCY.labels(model_name).observe(latency)
+
+        # Streamed completions report no usage, their tokens are counted locally
+        usage = ((result.llm_output or {}).get('token_usage') or {}) if result else {}
+        prompt_tokens = usage.get('prompt_tokens')
+        if prompt_tokens is None:
+            prompt_tokens = self.estimate_tokens(messages) - (self.max_tokens or COMPLETION_TOKENS)
+        completion_tokens = usage.get('completion_tokens', num_tokens(text, model_name=self.model_name))
+
+        record_llm_call(self.role, model_name, prompt_tokens, completion_tokens)
+
+    async def _agenerate_with_cache(
+            self, messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any) -> ChatResult:
+        """As langchain's, but the response cache is read off the event loop"""
+        llm_cache = get_llm_cache()
+        if not isinstance(llm_cache, LLMResponseCache) or (self.cache is not None and not self.cache):
+            return await super()._agenerate_with_cache(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        llm_string = self._get_llm_string(stop=stop, **kwargs)
+        prompt = dumps(messages)
+        generations = await llm_cache.alookup(prompt, llm_string)
+        if isinstance(generations, list):
+            return ChatResult(generations=generations)
+
+        result = await self._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        llm_cache.update(prompt, llm_string, result.generations)
+        return result
+
+    async def _agenerate(
+            self, messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any) -> ChatResult:
+
+        start = time.monotonic()
+        with span('llm', 'llm', model=self.model_name, role=self.role):
+            try:
+                result = await self._agenerate_scheduled(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except FALLBACK_ERRORS as e:
+                result = await self._agenerate_fallback(e, messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        self.account(messages, result.generations[0].text, time.monotonic() - start, result)
+        return result
+
+    async def _agenerate_fallback(self, error: Exception, messages: List[BaseMessage], **kwargs: Any) -> ChatResult:
+        # Accounted by this client, under the model which answered
+        for llm in self.fallback_llms:
+            try:
+                with span('llm.fallback', 'llm', model=llm.model_name, role=self.role):
+                    return await llm._agenerate_scheduled(messages, **kwargs)
+            except FALLBACK_ERRORS:
+                continue
+
+        raise error
+
+    async def _agenerate_scheduled(
+            self, messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any) -> ChatResult:
+
+        # Streamed generations are scheduled by _astream
+        if kwargs.get('stream', self.streaming):
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        tokens = self.estimate_tokens(messages)
+        generate = super()._agenerate
+
+        def call(on_acquired: Optional[Callable[[], None]] = None) -> Awaitable[ChatResult]:
+            return get_scheduler().arun(
+                self.model_name, tokens,
+                lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                on_acquired=on_acquired
+            )
+
+        if self.hedge:
+            result = await get_hedge_policy().arun(self.model_name, call)
+        else:
+            result = await call()
+        self.settle(tokens, result)
+
+        return result
+
+    def _generate(
+            self, messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any) -> ChatResult:
+
+        start = time.monotonic()
+        with span('llm', 'llm', model=self.model_name, role=self.role):
+            try:
+                result = self._generate_scheduled(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except FALLBACK_ERRORS as e:
+                result = self._generate_fallback(e, messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        self.account(messages, result.generations[0].text, time.monotonic() - start, result)
+        return result
+
+    def _generate_fallback(self, error: Exception, messages: List[BaseMessage], **kwargs: Any) -> ChatResult:
+        for llm in self.fallback_llms:
+            try:
+                with span('llm.fallback', 'llm', model=llm.model_name, role=self.role):
+                    return llm._generate_scheduled(messages, **kwargs)
+            except FALLBACK_ERRORS:
+                continue
+
+        raise error
+
+    def _generate_scheduled(
+            self, messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any) -> ChatResult:
+
+        # Streamed generations are scheduled by _stream
+        if kwargs.get('stream', self.streaming):
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        tokens = self.estimate_tokens(messages)
+        generate = super()._generate
+        result = get_scheduler().run(
+            self.model_name, tokens,
+            lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        )
+        self.settle(tokens, result)
+
+        return result
+
+    async def _astream(
+            self, messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+
+        text = ''
+        result = None
+        start = time.monotonic()
+        # Not made current, the consumer's code runs between the yields
+        llm_span = start_span('llm', 'llm', model=self.model_name, role=self.role, stream=True)
+        stream = super()._astream
+        # Retried by the scheduler until the first chunk, like the non-streaming calls
+        chunks = get_scheduler().astream(
+            self.model_name, self.estimate_tokens(messages),
+            lambda: stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        )
+        try:
+            async for chunk in chunks:
+                text += chunk.text
+                yield chunk
+
+        except FALLBACK_ERRORS as e:
+            # Once a token was streamed the completion can't be restarted on another model
+            if text or not self.fallback_llms:
+                llm_span.finish(error=e)
+                raise e
+
+            result = await self._agenerate_fallback(e, messages, stop=stop, run_manager=run_manager, **kwargs)
+            text = result.generations[0].text
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+
+        except GeneratorExit:
+            # Closed by a consumer which has read enough, the tokens streamed so far are still paid for
+            await chunks.aclose()
+            llm_span.set(closed=True)
+            llm_span.finish()
+            self.account(messages, text, time.monotonic() - start)
+            raise
+
+        except BaseException as e:
+            llm_span.finish(error=e)
+            raise e
+
+        llm_span.finish()
+        self.account(messages, text, time.monotonic() - start, result)
+
+    def _stream(
+            self, messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+
+        stream = super()._stream
+        yield from get_scheduler().stream(
+            self.model_name, self.estimate_tokens(messages),
+            lambda: stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        )
 
 
 def get_openai_llm(
         temperature=0.0,
         model_name='gpt-3.5-turbo',
-        streamers: List[BaseCallbackHandler] = None
+        streamers: List[BaseCallbackHandler] = None,
+        cache: bool = True,
+        hedge: bool = False,
+        role: Optional[str] = None,
+        fallback_llms: Optional[List[ChatOpenAI]] = None
 ) -> ChatOpenAI:
 
-    return ChatOpenAI(
+    # Streamed completions are never cached, the streamers expect to see every token
+    is_cached = cache and not streamers
+    if is_cached:
+        get_response_cache()
+
+    return ScheduledChatOpenAI(
         openai_api_key=OPENAI_API_KEY,
         temperature=temperature,
         model_name=model_name,
         streaming=False if not streamers else True,
-        callbacks=streamers
+        callbacks=streamers,
+        cache=is_cached,
+        hedge=hedge and not streamers,
+        role=role,
+        fallback_llms=fallback_llms or [],
+        max_retries=0  # Retried by the scheduler, with a backoff shared by every call to the model
     )
 
 
+class PooledOpenAIEmbeddings(OpenAIEmbeddings):
+    """OpenAIEmbeddings sending its requests through the shared connection pool"""
+
+    @root_validator()
+    def use_connection_pool(cls, values: Dict) -> Dict:
+        client, async_client = pooled_clients(values)
+        values['client'] = client.embeddings
+        values['async_client'] = async_client.embeddings
+        return values
+
+
+def get_openai_embeddings(model: str = 'text-embedding-ada-002') -> OpenAIEmbeddings:
+    return PooledOpenAIEmbeddings(openai_api_key=OPENAI_API_KEY, model=model)
+
+
 def get_conversational_memory() -> ConversationBufferWindowMemory:
 
     return ConversationBufferWindowMemory(
@@ -0,0 +1,35 @@
+"""
+Records the prompts and outputs of routed LLM calls as JSONL, when PROMPT_RECORD_PATH is set.
+The recordings are replayed by benchmarks.roles to compare models per role, and serve as cassettes
+of the offline benchmark suite, see benchmarks.cassette.
+"""
+
+import json
+import time
+import threading
+from typing import List, Optional
+from langchain.schema import BaseMessage
+from langchain.adapters.openai import convert_message_to_dict
+
+from config import PROMPT_RECORD_PATH
+
+
+_record_lock = threading.Lock()
+
+
+def record_call(role: Optional[str], model_name: str, messages: List[BaseMessage], output: str, latency: float):
+    if not PROMPT_RECORD_PATH or not role:
+        return
+
+    line = json.dumps({
+        'time': time.time(),
+        'role': role,
+        'model': model_name,
+        'messages': [convert_message_to_dict(m) for m in messages],
+        'output': output,
+        'latency': latency
+    })
+
+    with _record_lock:
+        with open(PROMPT_RECORD_PATH, 'a') as f:
+            f.write(line + '\n')
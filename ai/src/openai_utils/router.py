@@ -0,0 +1,64 @@
+import json
+from typing import Dict, List
+from langchain.chat_models import ChatOpenAI
+
+from config import ROLE_MODELS
+from openai_utils.models import get_openai_llm
+
+
+class Role:
+    PLANNER = 'planner'  # Agent steps, picks the tools and writes their inputs
+    SUB_QUERY = 'sub_query'  # Splits a retrieval query into sub queries
+    CHOOSER = 'chooser'  # Picks a search engine for a sub query
+    RETRIEVAL_PLANNER = 'retrieval_planner'  # Writes the sub queries with their search engines in one call
+    SUMMARIZER = 'summarizer'  # Summarizes the retrieval results
+    WRAPPER = 'wrapper'  # Fills a tool's JSON scheme from a request
+    SOLVER = 'solver'  # Writes, solves and proofreads math questions
+    LATEX = 'latex'  # Types text in LaTeX
+
+
+GPT3 = 'gpt-3.5-turbo'
+GPT4 = 'gpt-4-1106-preview'
+
+# Models of every role, the first is preferred and the others are fallbacks in order
+DEFAULT_ROLE_MODELS = {
+    Role.PLANNER: [GPT4, GPT3],
+    Role.SUB_QUERY: [GPT3, GPT4],
+    Role.CHOOSER: [GPT3, GPT4],
+    Role.RETRIEVAL_PLANNER: [GPT3, GPT4],
+    Role.SUMMARIZER: [GPT3, GPT4],
+    Role.WRAPPER: [GPT3, GPT4],
+    Role.SOLVER: [GPT4, GPT3],
+    Role.LATEX: [GPT3, GPT4],
+}
+
+
+# Short non-streaming calls, whose slow tail a duplicate request cuts, see openai_utils.hedging
+HEDGED_ROLES = {Role.SUB_QUERY, Role.CHOOSER, Role.RETRIEVAL_PLANNER, Role.SUMMARIZER, Role.WRAPPER, Role.LATEX}
+
+
+def get_role_models() -> Dict[str, List[str]]:
+    """Default routing, with the roles set in the ROLE_MODELS env var overridden"""
+    role_models = dict(DEFAULT_ROLE_MODELS)
+    if ROLE_MODELS:
+        role_models.update(json.loads(ROLE_MODELS))
+
+    return role_models
+
+
+def get_role_llm(role: str, temperature: float = 0.05, **kwargs) -> ChatOpenAI:
+    """Client of the role's preferred model, falling back to the next models on rate limit, timeout and server errors"""
+    model_name, *fallbacks = get_role_models()[role]
+    kwargs.setdefault('hedge', role in HEDGED_ROLES)
+
+    fallback_llms = [
+        get_openai_llm(temperature=temperature, model_name=fallback, role=role, **kwargs) for fallback in fallbacks
+    ]
+
+    return get_openai_llm(
+        temperature=temperature,
+        model_name=model_name,
+        role=role,
+        fallback_llms=fallback_llms,
+        **kwargs
+    )
@@ -0,0 +1,310 @@
+"""
+Process-wide scheduler for OpenAI calls. Every model has a token bucket for requests per minute and
+one for tokens per minute. Waiting calls are served by priority class, then in arrival order, only the
+head of the queue may take from the buckets so interactive work is never starved by batch work.
+A 429 from the API pauses the whole model for the backoff time, not only the call which got it.
+"""
+
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional
+
+import openai
+
+
+class Priority:
+    INTERACTIVE = 0  # Streamed to a user as it runs
+    DEFAULT = 1
+    BATCH = 2
+
+
+# Requests and tokens per minute
+MODEL_LIMITS = {
+    'gpt-4-1106-preview': (500, 150000),
+    'gpt-3.5-turbo': (3500, 160000),
+}
+DEFAULT_LIMITS = (500, 40000)
+
+MAX_QUEUE = 256  # Waiting calls per model
+POLL_INTERVAL = 0.05  # In seconds, how often a call behind the head of the queue checks again
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0  # In seconds, doubled on every retry
+BACKOFF_MAX = 30.0  # In seconds
+RECENT_WAITS = 1000  # Wait times kept for the percentiles
+
+RETRIED_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+current_priority: ContextVar[int] = ContextVar('current_priority', default=Priority.DEFAULT)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        # A call larger than the whole bucket waits for a full bucket
+        return max(0.0, min(amount, self.capacity) - self.level) / self.rate
+
+
+class ModelLimiter:
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, max_queue: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_queue = max_queue
+
+        self.lock = threading.Lock()
+        self.queue = []
+        self.cancelled = set()
+        self.paused_until = 0.0
+
+        self.waits = deque(maxlen=RECENT_WAITS)
+        self.calls = 0
+        self.rate_limited = 0
+        self.rejected = 0
+
+    def depth(self) -> int:
+        return len(self.queue) - len(self.cancelled)
+
+    def enqueue(self, ticket: tuple):
+        with self.lock:
+            if self.depth() >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(f'More than {self.max_queue} calls are waiting for the model')
+
+            heapq.heappush(self.queue, ticket)
+
+    def cancel(self, ticket: tuple):
+        with self.lock:
+            self.cancelled.add(ticket)
+            self.drop_cancelled()
+
+    def drop_cancelled(self):
+        while self.queue and self.queue[0] in self.cancelled:
+            self.cancelled.discard(heapq.heappop(self.queue))
+
+    def try_acquire(self, ticket: tuple, tokens: int) -> float:
+        """Takes from the buckets and returns 0 when the ticket may run, otherwise the time to wait"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+
+            self.drop_cancelled()
+            if self.queue[0] != ticket:
+                return POLL_INTERVAL
+
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.requests.time_until(1), self.tokens.time_until(tokens))
+            if wait > 0:
+                return wait
+
+            self.requests.level -= 1
+            self.tokens.level -= min(tokens, self.tokens.capacity)
+            heapq.heappop(self.queue)
+            self.calls += 1
+
+            return 0.0
+
+    def settle(self, estimated: int, actual: int):
+        """Charges the difference between the estimated and the reported token usage"""
+        with self.lock:
+            self.tokens.level -= actual - estimated
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.rate_limited += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            waits = sorted(self.waits)
+            depth = self.depth()
+
+        def percentile(p: float) -> float:
+            return waits[min(int(p * len(waits)), len(waits) - 1)] if waits else 0.0
+
+        return {
+            'queue_depth': depth,
+            'calls': self.calls,
+            'rate_limited': self.rate_limited,
+            'rejected': self.rejected,
+            'wait_p50': percentile(0.5),
+            'wait_p95': percentile(0.95),
+            'wait_max': waits[-1] if waits else 0.0
+        }
+
+
+class Scheduler:
+    def __init__(self, max_queue: int = MAX_QUEUE):
+        self.max_queue = max_queue
+        self.limiters: Dict[str, ModelLimiter] = {}
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+
+    def limiter(self, model_name: str) -> ModelLimiter:
+        with self.lock:
+            if model_name not in self.limiters:
+                rpm, tpm = MODEL_LIMITS.get(model_name, DEFAULT_LIMITS)
+                self.limiters[model_name] = ModelLimiter(rpm, tpm, max_queue=self.max_queue)
+
+            return self.limiters[model_name]
+
+    async def acquire(self, model_name: str, tokens: int):
+        limiter = self.limiter(model_name)
+        ticket = (current_priority.get(), next(self.counter))
+        limiter.enqueue(ticket)
+
+        start = time.monotonic()
+        try:
+            while True:
+                wait = limiter.try_acquire(ticket, tokens)
+                if wait == 0:
+                    break
+                await asyncio.sleep(min(wait, 1.0))
+        except BaseException:
+            limiter.cancel(ticket)
+            raise
+
+        limiter.waits.append(time.monotonic() - start)
+
+    def acquire_sync(self, model_name: str, tokens: int):
+        limiter = self.limiter(model_name)
+        ticket = (current_priority.get(), next(self.counter))
+        limiter.enqueue(ticket)
+
+        start = time.monotonic()
+        try:
+            while True:
+                wait = limiter.try_acquire(ticket, tokens)
+                if wait == 0:
+                    break
+                time.sleep(min(wait, 1.0))
+        except BaseException:
+            limiter.cancel(ticket)
+            raise
+
+        limiter.waits.append(time.monotonic() - start)
+
+    def backoff(self, model_name: str, attempt: int, error: Exception) -> float:
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+        if isinstance(error, openai.RateLimitError):
+            retry_after = error.response.headers.get('retry-after') if error.response is not None else None
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+
+            self.limiter(model_name).pause(delay)
+
+        return delay
+
+    async def arun(
+            self, model_name: str, tokens: int,
+            call: Callable[[], Awaitable[Any]],
+            on_acquired: Optional[Callable[[], None]] = None) -> Any:
+
+        for attempt in range(MAX_RETRIES + 1):
+            await self.acquire(model_name, tokens)
+            if on_acquired is not None:
+                on_acquired()
+            try:
+                return await call()
+            except RETRIED_ERRORS as e:
+                if attempt == MAX_RETRIES:
+                    raise e
+                await asyncio.sleep(self.backoff(model_name, attempt, e))
+
+    def run(self, model_name: str, tokens: int, call: Callable[[], Any]) -> Any:
+        for attempt in range(MAX_RETRIES + 1):
+            self.acquire_sync(model_name, tokens)
+            try:
+                return call()
+            except RETRIED_ERRORS as e:
+                if attempt == MAX_RETRIES:
+                    raise e
+                time.sleep(self.backoff(model_name, attempt, e))
+
+    async def astream(
+            self, model_name: str, tokens: int, stream: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Yields the chunks of the stream, which is retried like arun until its first chunk"""
+        for attempt in range(MAX_RETRIES + 1):
+            await self.acquire(model_name, tokens)
+            chunks = stream()
+            started = False
+            try:
+                async for chunk in chunks:
+                    started = True
+                    yield chunk
+                return
+            except RETRIED_ERRORS as e:
+                # Once a chunk was yielded the stream can't be restarted
+                if started or attempt == MAX_RETRIES:
+                    raise e
+                await asyncio.sleep(self.backoff(model_name, attempt, e))
+            finally:
+                # Closing the stream of a consumer which has read enough cancels the completion
+                await chunks.aclose()
+
+    def stream(self, model_name: str, tokens: int, stream: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+        for attempt in range(MAX_RETRIES + 1):
+            self.acquire_sync(model_name, tokens)
+            chunks = stream()
+            started = False
+            try:
+                for chunk in chunks:
+                    started = True
+                    yield chunk
+                return
+            except RETRIED_ERRORS as e:
+                if started or attempt == MAX_RETRIES:
+                    raise e
+                time.sleep(self.backoff(model_name, attempt, e))
+            finally:
+                chunks.close()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            limiters = dict(self.limiters)
+
+        return {name: limiter.get_stats() for name, limiter in limiters.items()}
+
+
+async def prioritized(priority: int, coroutine: Awaitable[Any]) -> Any:
+    """Awaits the coroutine with every OpenAI call it makes scheduled at the given priority"""
+    current_priority.set(priority)
+    return await coroutine
+
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler()
+
+    return _scheduler
@@ -1,9 +1,50 @@
+import tiktoken
+from functools import lru_cache
+from typing import Optional
 from langchain.callbacks import get_openai_callback
 
 
+DEFAULT_ENCODING = 'cl100k_base'
+CHARS_PER_TOKEN = 4  # Rough estimate, used only when no tokenizer can be loaded
+
+
 def count_tokens(chain, query):
     with get_openai_callback() as cb:
         result = chain.run(query)
         print(f'Spent a total {cb.total_tokens} tokens.')
 
     return result
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str) -> Optional[tiktoken.Encoding]:
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+    except Exception as e:
+        # The encoding files are downloaded on first use, which fails on offline hosts
+        print(f'Could not load a tokenizer for {model_name}, estimating token counts: {e}')
+        return None
+
+
+def num_tokens(text: str, model_name: str = 'gpt-4') -> int:
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model_name: str = 'gpt-4') -> str:
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+
+    return encoding.decode(tokens[:max_tokens])
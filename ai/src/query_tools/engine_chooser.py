@@ -28,19 +28,21 @@ JSON:
 
 json_scheme = """{"engine": "engine name"}"""
 
+engine_prompt = PromptTemplate.from_template(engine_template)
+
 
 def get_chooser_chain(llm: BaseLanguageModel) -> LLMChain:
-    engine_prompt = PromptTemplate.from_template(engine_template)
     engine_chain = LLMChain(llm=llm, prompt=engine_prompt)
 
     return engine_chain
 
 
-async def achoose_engine(llm: BaseLanguageModel, query: str, query_engines: Dict[str, str]) -> str:
-    chooser_chain = get_chooser_chain(llm=llm)
+def format_engines(query_engines: Dict[str, str]) -> str:
     engines = ',\n\t'.join([f'"{name}": "{desc}"' for name, desc in query_engines.items()])
-    engines = '{\n\t' + engines + '\n}'
+    return '{\n\t' + engines + '\n}'
+
 
+async def achoose_engine(chooser_chain: LLMChain, query: str, engines: str) -> str:
     response = await chooser_chain.ainvoke(
         input={
             'query': query,
@@ -57,26 +59,3 @@ async def achoose_engine(llm: BaseLanguageModel, query: str, query_engines: Dict
         raise e
 
     return scheme['engine']
-
-
-def choose_engine(llm: BaseLanguageModel, query: str, query_engines: Dict[str, str]) -> str:
-    chooser_chain = get_chooser_chain(llm=llm)
-    engines = ',\n\t'.join([f'"{name}": "{desc}"' for name, desc in query_engines.items()])
-    engines = '{\n\t' + engines + '\n}'
-
-    response = chooser_chain.invoke(
-        inputs={
-            'query': query,
-            'engines': engines,
-            'json_scheme': json_scheme
-        })
-    scheme = response['text']
-    scheme = scheme.replace('```json', '')
-    scheme = scheme.replace('```', '')
-
-    try:
-        scheme = json.loads(scheme, strict=False)
-    except ValueError as e:
-        raise e
-
-    return scheme['engine']
@@ -0,0 +1,137 @@
+"""
+Engine racing: a sub query is sent to its chosen engine and to the next best ones at once, the first result
+which passes a cheap quality check wins and the other searches are cancelled. Every engine of a race has a
+deadline, so a stalled page fetch or search can't hold the retrieval longer than that.
+
+When no result passes the check, the most relevant one is kept, and when every engine failed or missed its
+deadline the race fails like a single search would. Searches of sync tools run on a thread, which a
+cancellation abandons rather than stops.
+"""
+
+import re
+import asyncio
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from framework.agent_tool import AgentTool
+
+
+RACE_WIDTH = 2  # Engines raced per sub query
+ENGINE_DEADLINE = 10.0  # In seconds, of an engine without a deadline of its own
+MIN_RESULT_LENGTH = 50  # In characters
+MIN_RELEVANCE = 0.3  # Share of the sub query's terms found in the result
+NO_RESULT_PREFIX = 'no good'  # Of the search tools' answer when they found nothing
+
+STOP_WORDS = {
+    'the', 'and', 'for', 'are', 'was', 'were', 'what', 'which', 'who', 'whom', 'how', 'why', 'when', 'where',
+    'does', 'did', 'with', 'from', 'about', 'into', 'that', 'this', 'these', 'those', 'its', 'their', 'has',
+    'have', 'had', 'of', 'in', 'on', 'to', 'is', 'an', 'a', 'by', 'as', 'at', 'or', 'be'
+}
+
+word_pattern = re.compile(r'\w+')
+
+racing_stats = Counter()
+
+
+def terms(text: str) -> set:
+    return {word for word in word_pattern.findall(text.lower()) if len(word) > 2 and word not in STOP_WORDS}
+
+
+def relevance(query: str, result: str) -> float:
+    """Share of the query's terms which appear in the result"""
+    query_terms = terms(query)
+    if not query_terms:
+        return 1.0
+
+    return len(query_terms & terms(result)) / len(query_terms)
+
+
+def is_good_result(query: str, result: Any) -> bool:
+    if not isinstance(result, str):
+        return False
+
+    text = result.strip()
+    if len(text) < MIN_RESULT_LENGTH or text.lower().startswith(NO_RESULT_PREFIX):
+        return False
+
+    return relevance(query, text) >= MIN_RELEVANCE
+
+
+def race_candidates(engine: str, ranking: Tuple[str, ...], engine_names: List[str], width: int) -> List[str]:
+    """The chosen engine, then the router's next best ones, then the others in their own order"""
+    candidates = [engine]
+    for name in [*ranking, *engine_names]:
+        if name not in candidates and name in engine_names:
+            candidates.append(name)
+
+    return candidates[:width]
+
+
+def get_racing_stats() -> Dict[str, Any]:
+    """Races, the winners by rank, and the searches rejected, failed or late"""
+    stats = dict(racing_stats)
+    races = stats.get('races', 0)
+    stats['alternate_win_rate'] = stats.get('alternate_wins', 0) / races if races else 0.0
+
+    return stats
+
+
+async def arace(
+        query: str,
+        candidates: List[str],
+        tools: Dict[str, AgentTool],
+        deadlines: Optional[Dict[str, float]] = None) -> Tuple[str, str]:
+    """Engine and result of the first good search of the query among the candidates"""
+    # An engine name the planner or the chooser made up loses its place, not the whole retrieval
+    unknown = [name for name in candidates if name not in tools]
+    if unknown:
+        racing_stats['unknown_engines'] += len(unknown)
+        print(f'Unknown search engines left out of the race: {", ".join(unknown)}')
+        candidates = [name for name in candidates if name in tools]
+        if not candidates:
+            raise ValueError(f'No known search engine to race for: {query}')
+
+    deadlines = deadlines or {}
+    tasks = {
+        asyncio.ensure_future(asyncio.wait_for(
+            tools[name].invoke(query), timeout=deadlines.get(name, ENGINE_DEADLINE)
+        )): name for name in candidates
+    }
+    rank = {name: i for i, name in enumerate(candidates)}
+    rejected = []
+    errors = []
+    racing_stats['races'] += 1
+
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            # Searches which finished together are taken in the candidates' order
+            for task in sorted(done, key=lambda t: rank[tasks[t]]):
+                name = tasks[task]
+                if task.exception() is not None:
+                    is_late = isinstance(task.exception(), asyncio.TimeoutError)
+                    racing_stats['deadline_misses' if is_late else 'errors'] += 1
+                    errors.append(task.exception())
+                    continue
+
+                result = task.result()
+                if is_good_result(query, result):
+                    racing_stats['first_wins' if rank[name] == 0 else 'alternate_wins'] += 1
+                    racing_stats['cancelled'] += len(pending)
+                    return name, result
+
+                racing_stats['rejected'] += 1
+                rejected.append((name, result))
+
+        if rejected:
+            racing_stats['fallbacks'] += 1
+            return max(rejected, key=lambda r: (relevance(query, str(r[1])), -rank[r[0]]))
+
+        raise errors[0]
+
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,190 @@
+"""
+Local search engine router, in front of the LLM engine chooser. Every engine has a prototype embedding: the
+embedding of its description, plus those of the sub queries the LLM chooser routed to it. A sub query is
+routed to the engine of its most similar prototype, when that one is clearly ahead of the runner up, and
+left to the LLM chooser otherwise. The chooser's decisions are learned as they come.
+
+The router is seeded with the chooser calls of a prompt recording (ENGINE_ROUTER_DECISIONS), and evaluated
+against the chooser offline by benchmarks.engine_router.
+"""
+
+import re
+import json
+import asyncio
+import threading
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+from config import ENGINE_ROUTER_DECISIONS
+from metrics import EMBEDDING_LATENCY
+
+
+EMBEDDING_MODEL = 'text-embedding-ada-002'
+CONFIDENCE_MARGIN = 0.03  # Cosine similarity lead of the best prototype over the runner up, to route locally
+DESCRIPTION_WEIGHT = 3.0  # Weight of the description in a prototype, in sub queries
+MAX_SEED_DECISIONS = 2000  # The most recent ones of the recording
+
+chooser_call_pattern = re.compile(r'QUERY: \n(.*?)\n\nENGINES:\n(.*?)\n\nDecide which engine is best', re.DOTALL)
+
+router_stats = Counter()
+
+
+class Route(NamedTuple):
+    engine: Optional[str]  # None when the LLM chooser should decide
+    confidence: float
+    vector: Optional[np.ndarray]
+    ranking: Tuple[str, ...] = ()  # Every engine, from the most similar prototype down
+
+
+def unit(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def get_router_stats() -> Dict[str, Any]:
+    """Sub queries routed locally and deferred to the LLM chooser"""
+    stats = dict(router_stats)
+    total = stats.get('routed', 0) + stats.get('deferred', 0)
+    stats['local_rate'] = stats.get('routed', 0) / total if total else 0.0
+
+    return stats
+
+
+def chooser_decisions(records: List[Dict]) -> List[Dict[str, Any]]:
+    """Sub query, engines, chosen engine and latency of the LLM chooser calls of a prompt recording"""
+    decisions = []
+    for record in records:
+        prompt = '\n'.join([m['content'] for m in record['messages'] if m.get('content')])
+        match = chooser_call_pattern.search(prompt)
+        if match is None:
+            continue
+
+        try:
+            engines = json.loads(match.group(2), strict=False)
+            output = record['output'].replace('```json', '').replace('```', '')
+            engine = json.loads(output, strict=False)['engine']
+        except (ValueError, KeyError, TypeError):
+            continue
+
+        decisions.append({
+            'query': match.group(1).strip(),
+            'engines': engines,
+            'engine': engine,
+            'latency': record.get('latency')
+        })
+
+    return decisions
+
+
+def load_decisions(path: str) -> List[Tuple[str, str]]:
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    decisions = chooser_decisions(records)[-MAX_SEED_DECISIONS:]
+    return [(d['query'], d['engine']) for d in decisions]
+
+
+class EnginePrototypes:
+    """Vectorized scoring of sub query embeddings against the engine prototypes"""
+    def __init__(
+            self, names: List[str], description_vectors: np.ndarray, description_weight: float = DESCRIPTION_WEIGHT):
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.sums = description_weight * unit(np.asarray(description_vectors, dtype=np.float32))
+        self.prototypes = unit(self.sums)
+        self.lock = threading.Lock()
+
+    def add(self, vectors: np.ndarray, engines: List[str]):
+        known = [(vector, self.index[engine]) for vector, engine in zip(vectors, engines) if engine in self.index]
+        if not known:
+            return
+
+        with self.lock:
+            np.add.at(self.sums, [i for _, i in known], unit(np.stack([vector for vector, _ in known])))
+            self.prototypes = unit(self.sums)
+
+    def route(self, vectors: np.ndarray, margin: float) -> List[Tuple[Optional[str], float]]:
+        scores = unit(vectors) @ self.prototypes.T
+        best = scores.argmax(axis=1)
+        if len(self.names) > 1:
+            top = np.sort(scores, axis=1)
+            confidence = top[:, -1] - top[:, -2]
+        else:
+            confidence = np.ones(len(vectors))
+
+        return [
+            (self.names[b] if c >= margin else None, float(c)) for b, c in zip(best, confidence)
+        ]
+
+    def rank(self, vectors: np.ndarray) -> List[Tuple[str, ...]]:
+        order = np.argsort(-(unit(vectors) @ self.prototypes.T), axis=1)
+        return [tuple(self.names[i] for i in row) for row in order]
+
+
+class EngineRouter:
+    def __init__(
+            self, embeddings: Embeddings,
+            engines: Dict[str, str],
+            decisions: Optional[List[Tuple[str, str]]] = None,
+            margin: float = CONFIDENCE_MARGIN):
+
+        self.embeddings = embeddings
+        self.engines = engines
+        self.decisions = decisions or []
+        self.margin = margin
+        self.prototypes: Optional[EnginePrototypes] = None
+        self.lock: Optional[asyncio.Lock] = None  # Created on the loop of the first route
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        with EMBEDDING_LATENCY.time():
+            return np.asarray(await self.embeddings.aembed_documents(texts), dtype=np.float32)
+
+    async def aprototypes(self) -> EnginePrototypes:
+        if self.prototypes is None:
+            if self.lock is None:
+                self.lock = asyncio.Lock()
+
+            async with self.lock:
+                if self.prototypes is None:
+                    names = list(self.engines)
+                    prototypes = EnginePrototypes(names, await self.aembed([self.engines[n] for n in names]))
+                    if self.decisions:
+                        queries, chosen = zip(*self.decisions)
+                        prototypes.add(await self.aembed(list(queries)), list(chosen))
+                    self.prototypes = prototypes
+
+        return self.prototypes
+
+    async def aroute(self, queries: List[str]) -> List[Route]:
+        try:
+            prototypes = await self.aprototypes()
+            vectors = await self.aembed(queries)
+        except Exception as e:
+            # Routing is only a shortcut, the LLM chooser decides when it fails
+            router_stats['errors'] += 1
+            print(f'Could not route the sub queries locally: {e}')
+            return [Route(None, 0.0, None) for _ in queries]
+
+        routes = [Route(engine, confidence, vector, ranking) for (engine, confidence), vector, ranking in zip(
+            prototypes.route(vectors, self.margin), vectors, prototypes.rank(vectors)
+        )]
+        routed = sum([route.engine is not None for route in routes])
+        router_stats['routed'] += routed
+        router_stats['deferred'] += len(routes) - routed
+
+        return routes
+
+    def learn(self, routes: List[Route], engines: List[str]):
+        """Adds the LLM chooser's decisions on deferred sub queries to the prototypes"""
+        learned = [(route.vector, engine) for route, engine in zip(routes, engines) if route.vector is not None]
+        if self.prototypes is None or not learned:
+            return
+
+        self.prototypes.add(np.stack([vector for vector, _ in learned]), [engine for _, engine in learned])
+        router_stats['learned'] += len(learned)
+
+
+def get_engine_router(embeddings: Embeddings, engines: Dict[str, str]) -> EngineRouter:
+    decisions = load_decisions(ENGINE_ROUTER_DECISIONS) if ENGINE_ROUTER_DECISIONS else None
+    return EngineRouter(embeddings=embeddings, engines=engines, decisions=decisions)
@@ -0,0 +1,81 @@
+import json
+from typing import List, Optional, Tuple
+from langchain.prompts import PromptTemplate
+from langchain.chains import LLMChain
+from langchain.schema.language_model import BaseLanguageModel
+
+
+plan_template = """You are given a query and a list of query engine names with their description:
+
+QUERY:
+{query}
+
+ENGINES:
+{engines}
+
+Plan the search: break the query down to sub queries which are optimized for vector similarity search, with as
+few sub queries as possible, and decide which engine is best for each sub query. When writing the plan follow
+the format of the JSON scheme below:
+
+JSON:
+{json_scheme}
+
+Pay attention - Write only the JSON scheme and nothing more.
+
+Begin!
+
+JSON:
+"""
+
+json_scheme = """{
+    "queries": [
+        {"query": "1-st sub query", "engine": "engine name"},
+        {"query": "2-nd sub query", "engine": "engine name"},
+        ...
+        {"query": "n-th sub query", "engine": "engine name"}
+    ]
+}"""
+
+plan_prompt = PromptTemplate.from_template(plan_template)
+
+
+def get_plan_chain(llm: BaseLanguageModel) -> LLMChain:
+    plan_chain = LLMChain(llm=llm, prompt=plan_prompt)
+
+    return plan_chain
+
+
+def parse_plan(text: str, engine_names: List[str]) -> List[Tuple[str, Optional[str]]]:
+    """
+    Sub queries with their engines, None for an engine which isn't one of the engine names.
+    Raises ValueError when the plan isn't valid JSON of the scheme or has no sub queries.
+    """
+    scheme = text.replace('```json', '')
+    scheme = scheme.replace('```', '')
+    scheme = json.loads(scheme, strict=False)
+
+    queries = scheme.get('queries') if isinstance(scheme, dict) else None
+    if not isinstance(queries, list) or not queries:
+        raise ValueError(f'No sub queries in the plan: {text!r}')
+
+    plan = []
+    for item in queries:
+        if not isinstance(item, dict) or not isinstance(item.get('query'), str) or not item['query'].strip():
+            raise ValueError(f'Invalid sub query in the plan: {item!r}')
+
+        engine = item.get('engine')
+        plan.append((item['query'], engine if engine in engine_names else None))
+
+    return plan
+
+
+async def aget_plan(plan_chain: LLMChain, query: str, engines: str,
+                    engine_names: List[str]) -> List[Tuple[str, Optional[str]]]:
+    response = await plan_chain.ainvoke(
+        input={
+            'query': query,
+            'engines': engines,
+            'json_scheme': json_scheme
+        })
+
+    return parse_plan(response['text'], engine_names)
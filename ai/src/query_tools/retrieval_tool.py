@@ -1,13 +1,18 @@
 import asyncio
-from typing import Optional
+from typing import Dict, List, Optional
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from langchain.schema.language_model import BaseLanguageModel
+from langchain.schema.embeddings import Embeddings
 
 from openai_utils.models import get_openai_llm
 from framework.agent_tool import AgentTool
-from query_tools.sub_query_writer import get_sub_queries
-from query_tools.engine_chooser import achoose_engine
+from tracing import span
+from query_tools.sub_query_writer import get_sub_query_chain, aget_sub_queries
+from query_tools.engine_chooser import get_chooser_chain, format_engines, achoose_engine
+from query_tools.retrieval_planner import get_plan_chain, aget_plan
+from query_tools.engine_router import get_engine_router
+from query_tools.engine_racing import race_candidates, arace
 from query_tools.wikipedia import get_wikipedia_tool
 from query_tools.serper_api import get_google_search_tool
 from query_tools.vector_store import get_vector_store_tool
@@ -32,26 +37,46 @@ Begin!
 SUMMARY:
 """
 
+summary_prompt = PromptTemplate.from_template(template=summary_template)
+
 
 def get_summary_chain(llm: BaseLanguageModel) -> LLMChain:
-    summary_prompt = PromptTemplate.from_template(template=summary_template)
     summary_chain = LLMChain(llm=llm, prompt=summary_prompt)
 
     return summary_chain
 
 
-def summarize(llm: BaseLanguageModel, main_query: str, query_results: str) -> str:
-    summary_chain = get_summary_chain(llm=llm)
-    return summary_chain(
-        inputs={
+async def asummarize(summary_chain: LLMChain, main_query: str, query_results: str) -> str:
+    response = await summary_chain.ainvoke(
+        input={
             'query': main_query,
             'results': query_results
         }
-    )['text']
-
+    )
 
-def get_retrieval_tool(llm: BaseLanguageModel) -> AgentTool:
-    tools = [
+    return response['text']
+
+
+def get_retrieval_tool(
+        llm: BaseLanguageModel,
+        sub_query_llm: Optional[BaseLanguageModel] = None,
+        chooser_llm: Optional[BaseLanguageModel] = None,
+        summary_llm: Optional[BaseLanguageModel] = None,
+        plan_llm: Optional[BaseLanguageModel] = None,
+        search_tools: Optional[List[AgentTool]] = None,
+        fused_planning: bool = True,
+        router_embeddings: Optional[Embeddings] = None,
+        race_width: int = 1,
+        engine_deadlines: Optional[Dict[str, float]] = None
+) -> AgentTool:
+    """
+    With fused planning the sub queries and their engines come from a single LLM call, the separate sub query
+    and engine chooser calls are only made when the plan can't be parsed, or for its unknown engines.
+    With router embeddings, sub queries without an engine are routed locally first, see engine_router.
+    With a race width above one, every sub query is searched by that many engines at once and the first good
+    result is kept, within the engine deadlines, see engine_racing.
+    """
+    tools = search_tools or [
         get_wikipedia_tool(),
         get_google_search_tool(llm=llm),
         get_vector_store_tool()
@@ -63,30 +88,83 @@ def get_retrieval_tool(llm: BaseLanguageModel) -> AgentTool:
             'tool': t
         } for t in tools
     }
-    engines_desc = {t.name: t.description for t in tools}
+    engines_desc = format_engines({t.name: t.description for t in tools})
+    tools_by_name = {t.name: t for t in tools}
+
+    # Chains are compiled once per tool and shared by every invocation
+    sub_query_chain = get_sub_query_chain(llm=sub_query_llm or llm)
+    chooser_chain = get_chooser_chain(llm=chooser_llm or llm)
+    summary_chain = get_summary_chain(llm=summary_llm or llm)
+    plan_chain = get_plan_chain(llm=plan_llm or llm) if fused_planning else None
+    router = get_engine_router(router_embeddings, {t.name: t.description for t in tools}) if router_embeddings else None
+
+    async def aplan(query: str) -> Dict[str, Optional[str]]:
+        """Engine of every sub query, None where the plan named an unknown engine"""
+        if plan_chain is not None:
+            try:
+                with span('retrieval.plan', 'chain'):
+                    return dict(await aget_plan(
+                        plan_chain=plan_chain, query=query, engines=engines_desc, engine_names=list(engines)
+                    ))
+            except ValueError as e:
+                print(f'Could not parse the retrieval plan, planning in two stages: {e}')
+
+        with span('retrieval.sub_queries', 'chain'):
+            sub_queries = await aget_sub_queries(sub_query_chain=sub_query_chain, query=query)
+
+        return {sq: None for sq in sub_queries}
 
     async def wrapper(query: Optional[str] = None) -> str:
         if not query:
             return """Could not continue with an empty query"""
 
         try:
-            sub_queries = get_sub_queries(llm=llm, query=query)
-
-            # Step 1: Choose engines for each subquery in parallel
-            choosers = [achoose_engine(llm=llm, query=sq, query_engines=engines_desc) for sq in sub_queries]
-            engines_for_sub_queries = await asyncio.gather(*choosers)
-            sub_query_map = dict(zip(sub_queries, engines_for_sub_queries))
-
-            # Step 2: Perform sub queries in parallel
-            invokes = [engines[engine]['tool'].invoke(sq) for sq, engine in sub_query_map.items()]
-            results = await asyncio.gather(*invokes)
+            sub_query_map = await aplan(query)
+
+            # Step 1: Choose engines for the sub queries which have none, locally when the router is confident
+            unplanned = [sq for sq, engine in sub_query_map.items() if engine is None]
+            routes = {}
+            if unplanned and router is not None:
+                with span('retrieval.route_engines', 'chain', sub_queries=len(unplanned)):
+                    routes = dict(zip(unplanned, await router.aroute(unplanned)))
+                sub_query_map.update({sq: route.engine for sq, route in routes.items()})
+                unplanned = [sq for sq in unplanned if sub_query_map[sq] is None]
+
+            if unplanned:
+                with span('retrieval.choose_engines', 'chain', sub_queries=len(unplanned)):
+                    choosers = [
+                        achoose_engine(chooser_chain=chooser_chain, query=sq, engines=engines_desc) for sq in unplanned
+                    ]
+                    chosen = await asyncio.gather(*choosers)
+                sub_query_map.update(zip(unplanned, chosen))
+                if router is not None:
+                    router.learn([routes[sq] for sq in unplanned], chosen)
+            sub_queries = list(sub_query_map)
+
+            # Step 2: Perform sub queries in parallel, racing engines for each one in racing mode
+            with span('retrieval.search', 'chain', race_width=race_width):
+                if race_width > 1:
+                    races = [arace(
+                        query=sq,
+                        candidates=race_candidates(engine, routes[sq].ranking if sq in routes else (), list(engines),
+                                                   race_width),
+                        tools=tools_by_name,
+                        deadlines=engine_deadlines
+                    ) for sq, engine in sub_query_map.items()]
+                    winners = await asyncio.gather(*races)
+                    sub_query_map.update({sq: engine for sq, (engine, _) in zip(sub_queries, winners)})
+                    results = [result for _, result in winners]
+                else:
+                    invokes = [engines[engine]['tool'].invoke(sq) for sq, engine in sub_query_map.items()]
+                    results = await asyncio.gather(*invokes)
             result_map = dict(zip(sub_queries, results))
 
             output = []
             for sq, result in result_map.items():
                 output.append(f'SUB QUERY: {sq}\nSOURCE: {sub_query_map[sq]}\nRESULT: {result}')
 
-            return summarize(llm=llm, main_query=query, query_results='\n'.join(output))
+            with span('retrieval.summarize', 'chain'):
+                return await asummarize(summary_chain=summary_chain, main_query=query, query_results='\n'.join(output))
 
         except Exception as e:
             return "Failed to preform retrieval, might be caused by an error in one of the sub queries. Try again," \
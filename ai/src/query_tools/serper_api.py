@@ -1,12 +1,35 @@
-from langchain.tools import BaseTool
-from langchain.agents import load_tools
+from typing import Any
+from langchain.tools import GoogleSerperRun
+from langchain.utilities import GoogleSerperAPIWrapper
 from langchain.schema.language_model import BaseLanguageModel
 
+from config import SERPER_API_KEY, SERPER_API_URL
 from framework.agent_tool import AgentTool
+from http_transport import get_async_client
+
+
+class PooledSerperAPIWrapper(GoogleSerperAPIWrapper):
+    """Sends the searches through the shared connection pool instead of a new aiohttp session per search"""
+
+    async def _async_google_serper_search_results(
+            self, search_term: str, search_type: str = 'search', **kwargs: Any) -> dict:
+
+        headers = {
+            'X-API-KEY': self.serper_api_key or '',
+            'Content-Type': 'application/json',
+        }
+        params = {
+            'q': search_term,
+            **{key: value for key, value in kwargs.items() if value is not None},
+        }
+
+        response = await get_async_client().post(
+            f'{SERPER_API_URL}/{search_type}', params=params, headers=headers
+        )
+        return response.json()
 
 
 def get_google_search_tool(llm: BaseLanguageModel) -> AgentTool:
-    tools = load_tools(['google-serper'], llm=llm)
-    tool = tools[0]
+    tool = GoogleSerperRun(api_wrapper=PooledSerperAPIWrapper(serper_api_key=SERPER_API_KEY))
 
-    return AgentTool(function=tool.invoke, name=tool.name, description=tool.description)
+    return AgentTool(function=tool.ainvoke, name=tool.name, description=tool.description)
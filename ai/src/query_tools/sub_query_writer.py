@@ -32,23 +32,17 @@ json_scheme = """{
     ]
 }"""
 
+subquery_prompt = PromptTemplate.from_template(subquery_template)
+
 
 def get_sub_query_chain(llm: BaseLanguageModel) -> LLMChain:
-    subquery_prompt = PromptTemplate.from_template(subquery_template)
     subquery_chain = LLMChain(llm=llm, prompt=subquery_prompt)
 
     return subquery_chain
 
 
-def get_sub_queries(llm: BaseLanguageModel, query: str) -> List[str]:
-    sub_query_chain = get_sub_query_chain(llm)
-    response = sub_query_chain(
-        inputs={
-            'query': query,
-            'json_scheme': json_scheme
-        })
-    scheme = response['text']
-    scheme = scheme.replace('```json', '')
+def parse_sub_queries(text: str) -> List[str]:
+    scheme = text.replace('```json', '')
     scheme = scheme.replace('```', '')
     try:
         scheme = json.loads(scheme, strict=False)
@@ -56,3 +50,13 @@ def get_sub_queries(llm: BaseLanguageModel, query: str) -> List[str]:
         raise e
 
     return scheme['queries']
+
+
+async def aget_sub_queries(sub_query_chain: LLMChain, query: str) -> List[str]:
+    response = await sub_query_chain.ainvoke(
+        input={
+            'query': query,
+            'json_scheme': json_scheme
+        })
+
+    return parse_sub_queries(response['text'])
@@ -1,10 +1,10 @@
 import json
 import asyncio
-import requests
 from typing import List, Dict, Optional
 from jsonschema import validate, ValidationError
 
 from config import VS_API_URL
+from http_transport import get_async_client
 from framework.agent_tool import AgentTool
 
 
@@ -33,18 +33,8 @@ async def vector_search(query: str, k: Optional[int] = 3) -> List[Dict[str, str]
     url = VS_API_URL + '/vector/search'
     data = {'query': query, 'k': k}
 
-    # Set the Content-Type header to application/json
-    headers = {'Content-Type': 'application/json'}
-
-    # Convert the data to a JSON string
-    json_data = json.dumps(data)
-
-    # Send the request with the JSON data
-    event_loop = asyncio.get_running_loop()
-    request = event_loop.run_in_executor(None, lambda: requests.post(url=url, headers=headers, data=json_data))
-    while not request.done():
-        await asyncio.sleep(1)
-    response = await request
+    # Sent through the shared connection pool, kept alive between searches
+    response = await get_async_client().post(url=url, json=data, timeout=REQUEST_TIMEOUT)
 
     # Check if the response is valid JSON
     try:
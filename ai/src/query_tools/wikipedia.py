@@ -1,14 +1,68 @@
-from langchain.utilities import WikipediaAPIWrapper
-from langchain.tools import WikipediaQueryRun
+import asyncio
+from typing import Optional
 
+from config import WIKIPEDIA_API_URL
 from framework.agent_tool import AgentTool
+from http_transport import get_async_client
+
+
+USER_AGENT = 'wikipedia (https://github.com/goldsmith/Wikipedia/)'  # The one of the wikipedia package
+TOP_K_RESULTS = 3
+MAX_QUERY_LENGTH = 300  # In characters
+MAX_CONTENT_LENGTH = 4000  # In characters
+
+
+async def wiki_request(params: dict) -> dict:
+    response = await get_async_client().get(
+        WIKIPEDIA_API_URL,
+        params={'format': 'json', 'action': 'query', **params},
+        headers={'User-Agent': USER_AGENT}
+    )
+    return response.json()
+
+
+async def page_summary(title: str) -> Optional[str]:
+    response = await wiki_request({
+        'prop': 'extracts|pageprops',
+        'explaintext': '',
+        'exintro': '',
+        'redirects': '',
+        'titles': title
+    })
+
+    for page in response.get('query', {}).get('pages', {}).values():
+        # Missing and disambiguation pages are skipped, like the wikipedia package does
+        if 'missing' in page or 'disambiguation' in page.get('pageprops', {}):
+            return None
+
+        return page.get('extract')
+
+    return None
+
+
+async def search(query: str) -> str:
+    """Summaries of the top search results, formatted like langchain's WikipediaAPIWrapper.run"""
+    response = await wiki_request({
+        'list': 'search',
+        'srprop': '',
+        'srlimit': TOP_K_RESULTS,
+        'srsearch': query[:MAX_QUERY_LENGTH]
+    })
+    titles = [result['title'] for result in response.get('query', {}).get('search', [])]
+
+    summaries = await asyncio.gather(*[page_summary(title) for title in titles])
+    pages = [f'Page: {title}\nSummary: {summary}' for title, summary in zip(titles, summaries) if summary]
+
+    if not pages:
+        return "No good Wikipedia Search Result was found"
+
+    return '\n\n'.join(pages)[:MAX_CONTENT_LENGTH]
 
 
 def get_wikipedia_tool() -> AgentTool:
-    wikipedia = WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper())
 
     wikipedia_tool = AgentTool(
-        function=wikipedia.run,
+        function=search,
         name='Wikipedia',
         description='Useful for when you need to query wikipedia'
     )
@@ -0,0 +1,177 @@
+"""
+Semantic cache of whole task answers. An incoming task is embedded and compared against the embeddings
+of previously answered tasks, a stored answer is returned when the cosine similarity clears the threshold
+and the numbers and math symbols of both tasks are the same. Embeddings hardly tell apart tasks which only
+differ in their numbers, "integrate x^2 from 0 to 3" and "from 0 to 4" are well above the threshold.
+"""
+
+import re
+import time
+import threading
+import numpy as np
+from typing import Optional, Tuple
+from langchain.embeddings.openai import OpenAIEmbeddings
+
+from framework.agent import Agent
+from openai_utils.models import get_openai_embeddings
+from ledger import mark_cached
+from metrics import EMBEDDING_LATENCY
+from framework.keywords import Keyword
+from framework.agent_stream import AgentStream
+from framework.transcript import StepRecord
+
+
+CAPACITY = 2048  # Cached tasks, the least recently used is evicted above it
+SIMILARITY_THRESHOLD = 0.95  # Cosine similarity
+TTL = 24 * 60 * 60  # In seconds
+EMBEDDING_MODEL = 'text-embedding-ada-002'
+NON_VARIABLES = {'a', 'A', 'I'}  # Single letter words which aren't math variables
+
+# Numbers, LaTeX commands, operators, a minus which isn't a hyphen, and single letters
+symbol_pattern = re.compile(
+    r'\d+(?:[.,]\d+)*|\\[A-Za-z]+|[+*/^=<>()\[\]{}|!%√∫∑∏π∞]|(?<![A-Za-z])-|-(?![A-Za-z])|\b[A-Za-z]\b'
+)
+
+
+def signature(task: str) -> Tuple[str, ...]:
+    """Numbers and math symbols of the task, in order, which a cached task must match exactly"""
+    return tuple([token for token in symbol_pattern.findall(task) if token not in NON_VARIABLES])
+
+
+class TaskCache:
+    def __init__(
+            self, embeddings: OpenAIEmbeddings,
+            capacity: int = CAPACITY,
+            threshold: float = SIMILARITY_THRESHOLD,
+            ttl: float = TTL):
+
+        self.embeddings = embeddings
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+
+        self.lock = threading.Lock()
+        self.vectors: Optional[np.ndarray] = None  # Unit rows, allocated on first insert
+        self.created = np.zeros(capacity)
+        self.used = np.zeros(capacity)
+        self.tasks = [''] * capacity
+        self.signatures = [()] * capacity
+        self.answers = [''] * capacity
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.mismatches = 0  # Similar enough tasks rejected for their numbers or symbols
+
+    async def aembed(self, task: str) -> np.ndarray:
+        with EMBEDDING_LATENCY.time():
+            vector = np.asarray(await self.embeddings.aembed_query(task), dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def lookup(self, vector: np.ndarray, task_signature: Tuple[str, ...] = ()) -> Optional[str]:
+        with self.lock:
+            if self.size == 0:
+                self.misses += 1
+                return None
+
+            now = time.time()
+            similarities = self.vectors[:self.size] @ vector
+            similarities[self.created[:self.size] < now - self.ttl] = -1.0
+
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            matches = [int(i) for i in candidates[np.argsort(-similarities[candidates])]
+                       if self.signatures[i] == task_signature]
+            if not matches:
+                self.mismatches += len(candidates) > 0
+                self.misses += 1
+                return None
+
+            best = matches[0]
+            self.used[best] = now
+            self.hits += 1
+            return self.answers[best]
+
+    def insert(self, vector: np.ndarray, task: str, answer: str):
+        with self.lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+
+            if self.size < self.capacity:
+                index = self.size
+                self.size += 1
+            else:
+                index = int(np.argmin(self.used))
+
+            now = time.time()
+            self.vectors[index] = vector
+            self.created[index] = now
+            self.used[index] = now
+            self.tasks[index] = task
+            self.signatures[index] = signature(task)
+            self.answers[index] = answer
+
+    async def aget(self, task: str) -> Tuple[Optional[str], np.ndarray]:
+        vector = await self.aembed(task)
+        return self.lookup(vector, signature(task)), vector
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'mismatches': self.mismatches,
+            'size': self.size,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+_cache: Optional[TaskCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_task_cache() -> TaskCache:
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                embeddings = get_openai_embeddings(model=EMBEDDING_MODEL)
+                _cache = TaskCache(embeddings=embeddings)
+
+    return _cache
+
+
+def replay(stream: AgentStream, task: str, answer: str):
+    """Writes a cached answer to the stream the way an agent run would have finished"""
+    stream.write(StepRecord(Keyword.QUESTION, task).render())
+    stream.write(StepRecord(Keyword.THOUGHT, 'I now know the final answer').render())
+    stream.write(StepRecord(Keyword.ANSWER, answer).render())
+    stream.write(None)
+
+
+async def ainvoke_cached(
+        agent: Agent, task: str,
+        stream: Optional[AgentStream] = None,
+        use_cache: bool = True) -> str:
+
+    if not use_cache:
+        return await agent.invoke(task, stream=stream)
+
+    cache = get_task_cache()
+    try:
+        answer, vector = await cache.aget(task)
+    except Exception as e:
+        print(f'Task cache lookup failed, running the agent: {e}')
+        return await agent.invoke(task, stream=stream)
+
+    if answer is not None:
+        mark_cached()
+        if stream:
+            replay(stream=stream, task=task, answer=answer)
+        return answer
+
+    answer = await agent.invoke(task, stream=stream)
+    if answer:
+        cache.insert(vector=vector, task=task, answer=answer)
+
+    return answer
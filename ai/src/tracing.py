@@ -0,0 +1,199 @@
+"""
+Span tracing of the served tasks. A task run opens a trace, and the agent runs, steps, tool calls, LLM calls
+and outbound HTTP requests made while serving it open spans under the current span. The current span lives
+in a context variable, so the parent/child relationships follow asyncio tasks and the executor calls of
+AgentTool. Nothing is recorded outside a trace, and tracing is off unless TRACE_PATH is set.
+
+Finished traces are appended to TRACE_PATH as JSONL, one span per line. A trace is converted to the
+Chrome trace-event format, which chrome://tracing and Perfetto open as a timeline, from ai/src:
+python tracing.py [trace_id] [--output trace.json]
+"""
+
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import threading
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, List, Optional
+
+from config import TRACE_PATH
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.spans: List['Span'] = []
+        self.lock = threading.Lock()
+
+    def add(self, span: 'Span'):
+        with self.lock:
+            self.spans.append(span)
+
+
+class Span:
+    def __init__(self, trace: Trace, name: str, category: str, parent: Optional['Span'], attrs: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.thread = threading.get_ident()
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        self.task = id(task) if task else None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.duration = time.time() - self.start
+        if error is not None:
+            self.attrs['error'] = type(error).__name__
+        self.trace.add(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'category': self.category,
+            'start': self.start,
+            'duration': self.duration,
+            'thread': self.thread,
+            'task': self.task,
+            'attrs': self.attrs
+        }
+
+
+class NullSpan:
+    """Stands in for a span outside a trace"""
+    def set(self, **attrs):
+        pass
+
+    def finish(self, error: Optional[BaseException] = None):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+_export_lock = threading.Lock()
+
+
+def start_span(name: str, category: str = 'function', **attrs) -> Any:
+    """Starts a span under the current one without making it current, for async generators"""
+    trace = current_trace.get()
+    if trace is None:
+        return NULL_SPAN
+
+    return Span(trace, name, category, current_span.get(), attrs)
+
+
+class span:
+    """Context manager running its block in a new child span of the current span"""
+    def __init__(self, name: str, category: str = 'function', **attrs):
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.span = NULL_SPAN
+        self.token = None
+
+    def __enter__(self) -> Any:
+        self.span = start_span(self.name, self.category, **self.attrs)
+        if self.span is not NULL_SPAN:
+            self.token = current_span.set(self.span)
+
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.finish(error=exc)
+        if self.token is not None:
+            current_span.reset(self.token)
+
+
+def export(trace: Trace):
+    with trace.lock:
+        lines = [json.dumps(s.to_dict()) for s in trace.spans]
+
+    with _export_lock:
+        with open(TRACE_PATH, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+async def traced(task: str, coroutine: Awaitable[Any]) -> Any:
+    """Awaits the coroutine serving the task in a new trace, exported when it ends"""
+    if not TRACE_PATH:
+        return await coroutine
+
+    trace = Trace(name=task)
+    current_trace.set(trace)
+
+    try:
+        with span('task', 'task', task=task):
+            return await coroutine
+    finally:
+        export(trace)
+
+
+def load_trace(path: str, trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Spans of the trace, the last exported one by default"""
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    with open(path) as f:
+        for line in f:
+            s = json.loads(line)
+            traces.setdefault(s['trace_id'], []).append(s)
+
+    if trace_id is None:
+        trace_id = list(traces)[-1]
+
+    return traces[trace_id]
+
+
+def to_chrome(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Chrome trace-event format, every asyncio task (or thread outside a task) gets its own row"""
+    lanes: Dict[Any, int] = {}
+    start = min([s['start'] for s in spans])
+
+    events = []
+    for s in sorted(spans, key=lambda s: s['start']):
+        lane = lanes.setdefault(s['task'] or f"thread-{s['thread']}", len(lanes) + 1)
+        events.append({
+            'name': s['name'],
+            'cat': s['category'],
+            'ph': 'X',
+            'ts': (s['start'] - start) * 1e6,
+            'dur': s['duration'] * 1e6,
+            'pid': 1,
+            'tid': lane,
+            'args': {'span_id': s['span_id'], 'parent_id': s['parent_id'], **s['attrs']}
+        })
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts a trace to the Chrome trace-event format')
+    parser.add_argument('trace_id', nargs='?', help='The last exported trace by default')
+    parser.add_argument('--path', default=TRACE_PATH, help='JSONL file the traces were exported to')
+    parser.add_argument('--output', help='Written to stdout by default')
+    args = parser.parse_args()
+
+    chrome_trace = to_chrome(load_trace(args.path, args.trace_id))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(chrome_trace, f)
+    else:
+        json.dump(chrome_trace, sys.stdout)
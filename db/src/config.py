@@ -9,6 +9,13 @@ OPENAI_API_KEY = os.environ['OPENAI_API_KEY']
 # Vector Store
 VECTOR_STORE_PATH = os.environ['VECTOR_STORE_PATH']
 
+# Folded stack profiles of the requests sent with the profile flag, which must be the token, off when unset
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+
+# Warmup steps run before the service reports ready, comma separated, the others happen on first use
+WARMUP_STEPS = os.environ.get('WARMUP_STEPS', 'imports,index,embeddings')
+
 # Flask
 SERVER_HOST = os.environ['SERVER_HOST']
 SERVER_PORT = int(os.environ['SERVER_PORT'])
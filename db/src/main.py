@@ -1,12 +1,49 @@
+import threading
 from flask import Flask, request, jsonify
 from jsonschema import validate, ValidationError
 
-from config import VECTOR_STORE_PATH, SERVER_HOST, SERVER_PORT
-from vector_store import CustomVectorStore
+from config import VECTOR_STORE_PATH, WARMUP_STEPS, SERVER_HOST, SERVER_PORT
+from metrics import instrument
+from profiler import attached, profile_requests
+from startup import Warmup, WarmupStep, add_probes, lazy_import, select_steps
 
+# Imported on first use or by the warmup, langchain and faiss take most of the startup
+vector_store = lazy_import('vector_store')
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> 'vector_store.CustomVectorStore':
+    """The index is loaded by the warmup, or the first search when the warmup skips it"""
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = vector_store.CustomVectorStore(path_to_index=VECTOR_STORE_PATH)
+
+    return _store
+
+
+def load_index():
+    get_store().warm()
+
+
+def prime_embeddings():
+    get_store().embeddings.embed_query('warmup')
+
+
+warmup = Warmup(select_steps([
+    WarmupStep('imports', vector_store.load),
+    WarmupStep('index', load_index),
+    WarmupStep('embeddings', prime_embeddings, required=False)
+], WARMUP_STEPS))
 
-store = CustomVectorStore(path_to_index=VECTOR_STORE_PATH)
 app = Flask(__name__)
+instrument(app)
+profile_requests(app)
+add_probes(app, warmup)
 
 vector_search_schema = {
     "type": "object",
@@ -40,7 +77,9 @@ async def faiss_search():
     k = request.json["k"]
 
     try:
-        documents = await store.asearch(query=query, k=k)
+        # The view runs on a loop thread of its own, sampled with the request when it's profiled
+        with attached():
+            documents = await get_store().asearch(query=query, k=k)
         results = [{
             "id": i + 1,
             "data": documents[i].page_content,
@@ -54,5 +93,6 @@ async def faiss_search():
 
 
 if __name__ == '__main__':
+    warmup.start()
     app.run(host=SERVER_HOST, port=SERVER_PORT)
 
@@ -0,0 +1,37 @@
+"""
+Prometheus metrics of the service, scraped from GET /metrics. Observations are lock-cheap counter and
+histogram updates.
+"""
+
+import time
+from flask import Flask, Response, request, g
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # In seconds
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests served', ['route', 'method', 'status'])
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time to respond', ['route'], buckets=LATENCY_BUCKETS)
+SEARCH_LATENCY = Histogram('faiss_search_duration_seconds', 'FAISS index search latency', buckets=LATENCY_BUCKETS)
+EMBEDDING_LATENCY = Histogram('embedding_call_duration_seconds', 'Query embedding latency', buckets=LATENCY_BUCKETS)
+
+
+def instrument(app: Flask):
+    """Counts and times every request of the app and serves the metrics at /metrics"""
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.monotonic()
+
+    @app.after_request
+    def observe_request(response: Response) -> Response:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUESTS.labels(route, request.method, response.status_code).inc()
+        if 'request_start' in g:
+            REQUEST_LATENCY.labels(route).observe(time.monotonic() - g.request_start)
+
+        return response
+
+    @app.route("/metrics", methods=['GET'])
+    def metrics():
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,182 @@
+"""
+On-demand sampling profiler of single requests. Profiling is off unless PROFILE_TOKEN is set, then a request
+sent with the token in the X-Profile header or the profile query flag runs under a sampler thread until the
+response is closed. The profile is stored in PROFILE_DIR in the folded stacks format (flamegraph.pl,
+speedscope, inferno) and its path returned in the X-Profile header. Requests without the flag only pay for
+the flag lookup.
+
+Only the stacks of the request are sampled, not those of concurrent requests: its own thread, the event
+loop threads while they run one of its tasks (on the loops it tracks, see SamplingProfiler.track), and the
+threads it attached, like the loops of the async views and the FAISS search workers, see attached.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+import weakref
+import contextlib
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Coroutine, Dict, Iterator, Optional, Set
+from flask import Flask, Response, request, g
+
+from config import PROFILE_DIR, PROFILE_TOKEN
+
+
+SAMPLE_INTERVAL = 0.005  # In seconds
+PROFILE_HEADER = 'X-Profile'
+
+current_profiler: ContextVar[Optional['SamplingProfiler']] = ContextVar('current_profiler', default=None)
+
+# Tasks created in the context of a profiled request, on the loops which track them
+profiled_tasks = weakref.WeakKeyDictionary()
+
+# Profilers tracking the tasks of each loop, the loop has a task factory only while there is one
+tracking = Counter()
+tracking_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.threads: Set[int] = {threading.get_ident()}  # The request's own thread and the attached ones
+        self.loops: Dict[asyncio.AbstractEventLoop, int] = {}  # Tracked loops and the threads running them
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name='profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def track(self, loop: asyncio.AbstractEventLoop, thread_id: int):
+        """Samples the thread of the loop while it runs a task the request creates from now on"""
+        if loop not in self.loops:
+            self.loops[loop] = thread_id
+            track_tasks(loop)
+
+    def loop_threads(self) -> Set[int]:
+        """Threads of the tracked loops which are running a task of the request"""
+        threads = set()
+        for loop, thread_id in list(self.loops.items()):
+            task = asyncio.current_task(loop)
+            if task is not None and profiled_tasks.get(task) is self:
+                threads.add(thread_id)
+
+        return threads
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            threads = self.threads | self.loop_threads()
+            for ident, frame in sys._current_frames().items():
+                if ident not in threads:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+            self.samples += 1
+
+    def stop(self) -> str:
+        """Folded stacks, a line per distinct stack with its sample count"""
+        self.stopped.set()
+        self.thread.join()
+        for loop in self.loops:
+            untrack_tasks(loop)
+
+        return '\n'.join([f'{stack} {count}' for stack, count in self.stacks.most_common()]) + '\n'
+
+
+def create_task(loop: asyncio.AbstractEventLoop, coro: Coroutine, **kwargs: Any) -> asyncio.Task:
+    """Task factory which remembers the tasks of profiled requests"""
+    task = asyncio.Task(coro, loop=loop, **kwargs)
+    # The loop passes the context of the task from Python 3.11, before it is the current one
+    context = kwargs.get('context')
+    profiler = context.get(current_profiler) if context is not None else current_profiler.get()
+    if profiler is not None:
+        profiled_tasks[task] = profiler
+
+    return task
+
+
+def track_tasks(loop: asyncio.AbstractEventLoop):
+    with tracking_lock:
+        tracking[loop] += 1
+        if tracking[loop] == 1:
+            loop.set_task_factory(create_task)
+
+
+def untrack_tasks(loop: asyncio.AbstractEventLoop):
+    """Removes the task factory of the loop with the last profiler tracking it, tasks are then created as usual"""
+    with tracking_lock:
+        tracking[loop] -= 1
+        if tracking[loop] <= 0:
+            del tracking[loop]
+            if loop.get_task_factory() is create_task:
+                loop.set_task_factory(None)
+
+
+@contextlib.contextmanager
+def attached() -> Iterator[None]:
+    """Samples the current thread with the profiled request whose context it runs in, if any"""
+    profiler = current_profiler.get()
+    ident = threading.get_ident()
+    if profiler is not None:
+        profiler.threads.add(ident)
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.threads.discard(ident)
+
+
+def is_requested() -> bool:
+    if not PROFILE_TOKEN:
+        return False
+
+    return PROFILE_TOKEN in (request.headers.get(PROFILE_HEADER), request.args.get('profile'))
+
+
+def profile_requests(app: Flask):
+    """Profiles the requests of the app which ask for it"""
+
+    @app.before_request
+    def start_profiler():
+        if is_requested():
+            g.profiler = SamplingProfiler()
+            # Tasks and threads of the request inherit the context, concurrent requests don't
+            current_profiler.set(g.profiler)
+            g.profiler.start()
+
+    @app.after_request
+    def store_profile(response: Response) -> Response:
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+
+        # The thread may serve other requests, its tasks and threads were started by now
+        current_profiler.set(None)
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        route = request.path.strip('/').replace('/', '-') or 'root'
+        path = os.path.join(PROFILE_DIR, f'{int(time.time() * 1000)}-{route}.folded')
+
+        # Streamed responses keep running after the view returns, the profile ends when they are closed
+        def write_profile():
+            with open(path, 'w') as f:
+                f.write(profiler.stop())
+
+        response.call_on_close(write_profile)
+        response.headers[PROFILE_HEADER] = path
+
+        return response
@@ -0,0 +1,160 @@
+"""
+Fast startup: heavy modules are imported lazily, on first use or by the warmup. The warmup runs on a thread
+once the server is bound, and the readiness probe flips when it's done.
+
+- GET /healthz: liveness, answers as soon as the server is up;
+- GET /readyz: readiness, 503 until the warmup is done, with the timings of its steps and of the lazy imports.
+
+Import time profile of a module and its eager imports, by package: python startup.py [--module main] [--top 15]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import threading
+import subprocess
+from types import ModuleType
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from flask import Flask, jsonify
+
+
+STARTED = time.monotonic()
+
+import_times: Dict[str, float] = {}  # In seconds, of the lazy imports done so far
+
+
+class LazyModule:
+    """Stands for a module until one of its attributes is used, which imports it"""
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> ModuleType:
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    import_times[self._name] = time.perf_counter() - start
+                    self._module = module
+
+        return self._module
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self.load(), attribute)
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+class WarmupStep(NamedTuple):
+    name: str
+    function: Callable[[], None]
+    required: bool = True  # A failed required step keeps the service unready
+
+
+def select_steps(steps: List[WarmupStep], names: str) -> List[WarmupStep]:
+    """The steps named in a comma separated list, in their own order"""
+    selected = {name.strip() for name in names.split(',') if name.strip()}
+    unknown = selected - {step.name for step in steps}
+    if unknown:
+        raise ValueError(f'Unknown warmup steps: {", ".join(sorted(unknown))}')
+
+    return [step for step in steps if step.name in selected]
+
+
+class Warmup:
+    def __init__(self, steps: List[WarmupStep]):
+        self.steps = steps
+        self.timings: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.ready_after: Optional[float] = None
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        for step in self.steps:
+            start = time.perf_counter()
+            try:
+                step.function()
+            except Exception as e:
+                self.errors[step.name] = f'{type(e).__name__}: {e}'
+                print(f'Warmup step {step.name} failed: {self.errors[step.name]}')
+            self.timings[step.name] = time.perf_counter() - start
+
+        self.ready_after = time.monotonic() - STARTED
+        self.finished.set()
+
+    def is_ready(self) -> bool:
+        return self.finished.is_set() and not any([s.required and s.name in self.errors for s in self.steps])
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'ready': self.is_ready(),
+            'ready_after_s': self.ready_after,
+            'steps': {
+                step.name: {
+                    'seconds': self.timings.get(step.name),
+                    'required': step.required,
+                    **({'error': self.errors[step.name]} if step.name in self.errors else {})
+                } for step in self.steps
+            },
+            'imports_s': dict(import_times)
+        }
+
+
+def add_probes(app: Flask, warmup: Warmup):
+
+    @app.route('/healthz', methods=['GET'])
+    def healthz():
+        return jsonify({'status': 'ok'}), 200
+
+    @app.route('/readyz', methods=['GET'])
+    def readyz():
+        return jsonify(warmup.report()), 200 if warmup.is_ready() else 503
+
+
+def import_profile(module: str, top: int) -> Dict[str, Any]:
+    """Import times of a module and everything it imports eagerly, from python -X importtime"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+    )
+
+    packages = defaultdict(float)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        own, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        packages[name.split('.')[0]] += int(own) / 1000
+        modules[name] = int(cumulative) / 1000
+
+    by_package = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    by_module = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    return {
+        'module': module,
+        'total_ms': modules.get(module),
+        'packages_ms': dict(by_package),
+        'cumulative_ms': dict(by_module)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time profile, by package and by module')
+    parser.add_argument('--module', default='main', help='Module imported, from this directory')
+    parser.add_argument('--top', type=int, default=15, help='Number of packages and modules listed')
+    args = parser.parse_args()
+
+    print(json.dumps(import_profile(args.module, args.top), indent=4))
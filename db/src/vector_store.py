@@ -7,6 +7,7 @@ https://medium.com/@onkarmishra/using-langchain-for-question-answering-on-own-da
 
 import asyncio
 import threading
+import contextvars
 from queue import Queue
 from typing import List, Union, Optional
 from langchain.schema import Document
@@ -16,6 +17,8 @@ from langchain.text_splitter import CharacterTextSplitter
 from langchain.vectorstores import FAISS
 
 from config import VECTOR_STORE_PATH
+from metrics import EMBEDDING_LATENCY, SEARCH_LATENCY
+from profiler import attached
 
 
 class CustomVectorStore:
@@ -27,6 +30,10 @@ class CustomVectorStore:
         if self.is_init:
             self.store = FAISS.load_local(self.path, self.embeddings)
 
+    def warm(self):
+        """Searches the whole index once, so the first queries don't wait for it to be paged in"""
+        self.store.similarity_search_by_vector(embedding=[0.0] * self.store.index.d, k=1)
+
     def save(self):
         self.store.save_local(self.path)
 
@@ -49,19 +56,27 @@ class CustomVectorStore:
         raise NotImplementedError("Async insert_pdf is not yet implemented")
 
     def search(self, query: str, k: Optional[int] = 3) -> List[Document]:
-        return self.store.similarity_search(query=query, k=k)
+        # Embedding and index search are timed apart, similarity_search would do both
+        with EMBEDDING_LATENCY.time():
+            embedding = self.embeddings.embed_query(query)
+
+        with SEARCH_LATENCY.time():
+            return self.store.similarity_search_by_vector(embedding=embedding, k=k)
 
     async def asearch(self, query: str, k: Optional[int] = 3) -> List[Document]:
 
         def preform_query(query: str, k: int, document_queue: Queue[Union[Document, None]]):
-            documents = self.store.similarity_search(query=query, k=k)
+            with attached():
+                documents = self.search(query=query, k=k)
             for d in documents:
                 document_queue.put(d)
 
             document_queue.put(None)
 
         document_queue: Queue[Union[Document, None]] = Queue()
-        worker = threading.Thread(target=preform_query, args=[query, k, document_queue])
+        # The worker runs in the request's context, for the profiler to follow it
+        context = contextvars.copy_context()
+        worker = threading.Thread(target=context.run, args=[preform_query, query, k, document_queue])
         worker.start()
 
         document = {}
@@ -0,0 +1,313 @@
+"""
+Load test of the ai and db services against local stubs of the external APIs (see stubs.py).
+
+The stubs are served on their own loopback addresses, so the ai service keeps a connection pool limit per
+API like in production, and both services are started as subprocesses pointed at them. The db service gets
+a small FAISS index of stub embeddings unless one is given.
+
+Every scenario is driven at every concurrency level, by as many closed loop clients as the level:
+- task: POST /discord/task;
+- stream: POST /discord/task/stream, also timing the first non-empty chunk;
+- search: POST /vector/search.
+
+The report has the throughput, p50/p99 latencies, stream time to first chunk and the resident memory of both
+services after every level, printed as JSON.
+
+Run from loadtest/src: python main.py [--levels 1,4,16] [--requests 40] [--llm-latency lognormal:0.6,0.4]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+import httpx
+
+from stubs import StubLatencies, StubServer, create_app, embed
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+AI_DIR = os.path.join(ROOT, 'ai', 'src')
+DB_DIR = os.path.join(ROOT, 'db', 'src')
+
+LEVELS = [1, 4, 16]  # Concurrent clients
+REQUESTS = 40  # Requests per scenario and level, at least the level itself
+SCENARIOS = ['task', 'stream', 'search']
+AI_PORT = 5100
+DB_PORT = 5101
+BOOT_TIMEOUT = 120  # In seconds
+REQUEST_TIMEOUT = 300  # In seconds
+INDEX_DOCUMENTS = 200
+
+# Linux routes the whole 127.0.0.0/8 to the loopback interface
+STUB_HOSTS = {
+    'openai': '127.0.0.2',
+    'serper': '127.0.0.3',
+    'wolfram': '127.0.0.4',
+    'wikipedia': '127.0.0.5',
+}
+
+QUESTIONS = [
+    'What is the moment of inertia of a solid sphere',
+    'Who proved the spectral theorem for normal operators',
+    'How does Gauss law relate charge and electric flux',
+    'What is a Cauchy sequence',
+]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    """Resident memory of a process, None where /proc isn't available"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+def build_index(path: str):
+    """Index of stub embeddings for the db service, needs langchain and faiss"""
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    from langchain.vectorstores import FAISS
+
+    texts = [f'Passage {i} of a stub textbook, about {QUESTIONS[i % len(QUESTIONS)]}.' for i in range(INDEX_DOCUMENTS)]
+    # Embedded like the stub would, without a round trip per batch
+    store = FAISS.from_embeddings(
+        [(text, embed(text).tolist()) for text in texts],
+        OpenAIEmbeddings(openai_api_key='stub'),
+        metadatas=[{'page': i} for i in range(INDEX_DOCUMENTS)]
+    )
+    store.save_local(path)
+
+
+class Service:
+    def __init__(self, name: str, directory: str, port: int, env: Dict[str, str], log_dir: str):
+        self.name = name
+        self.url = f'http://127.0.0.1:{port}'
+        self.log = open(os.path.join(log_dir, f'{name}.log'), 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, 'main.py'],
+            cwd=directory,
+            env={**os.environ, **env, 'SERVER_HOST': '127.0.0.1', 'SERVER_PORT': str(port)},
+            stdout=self.log,
+            stderr=subprocess.STDOUT
+        )
+
+    def wait_ready(self, timeout: float = BOOT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'{self.name} exited with {self.process.returncode}, see {self.log.name}')
+            try:
+                if httpx.get(f'{self.url}/readyz', timeout=1).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            time.sleep(0.5)
+
+        raise TimeoutError(f'{self.name} was not ready after {timeout}s, see {self.log.name}')
+
+    def rss_mb(self) -> Optional[float]:
+        return rss_mb(self.process.pid)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+class Sample:
+    def __init__(self, latency: float, is_error: bool, first_chunk: Optional[float] = None):
+        self.latency = latency
+        self.is_error = is_error
+        self.first_chunk = first_chunk
+
+
+async def send_task(client: httpx.AsyncClient, url: str, task: str) -> Sample:
+    start = time.perf_counter()
+    response = await client.post(f'{url}/discord/task', json={'task': task, 'cache': False})
+
+    return Sample(time.perf_counter() - start, response.status_code != 200)
+
+
+async def send_stream(client: httpx.AsyncClient, url: str, task: str) -> Sample:
+    start = time.perf_counter()
+    first_chunk = None
+
+    async with client.stream('POST', f'{url}/discord/task/stream', json={'task': task, 'cache': False}) as response:
+        async for chunk in response.aiter_text():
+            if chunk and first_chunk is None:
+                first_chunk = time.perf_counter() - start
+
+    return Sample(time.perf_counter() - start, response.status_code != 200 or first_chunk is None, first_chunk)
+
+
+async def send_search(client: httpx.AsyncClient, url: str, query: str) -> Sample:
+    start = time.perf_counter()
+    response = await client.post(f'{url}/vector/search', json={'query': query, 'k': 3})
+
+    return Sample(time.perf_counter() - start, response.status_code != 200)
+
+
+async def drive(scenario: str, url: str, level: int, requests: int, run: int) -> Dict:
+    send = {'task': send_task, 'stream': send_stream, 'search': send_search}[scenario]
+    requests = max(requests, level)
+    samples: List[Sample] = []
+    next_request = iter(range(requests))
+
+    async def client_loop(client: httpx.AsyncClient):
+        for i in next_request:
+            # Unique tasks, so neither the task cache nor the LLM response cache answers them
+            text = f'{QUESTIONS[i % len(QUESTIONS)]} (run {run}, request {i})'
+            try:
+                samples.append(await send(client, url, text))
+            except httpx.HTTPError:
+                samples.append(Sample(REQUEST_TIMEOUT, True))
+
+    limits = httpx.Limits(max_connections=level, max_keepalive_connections=level)
+    async with httpx.AsyncClient(limits=limits, timeout=REQUEST_TIMEOUT) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(level)])
+        elapsed = time.perf_counter() - start
+
+    succeeded = [s for s in samples if not s.is_error]
+    latencies = [1000 * s.latency for s in succeeded]
+    first_chunks = [1000 * s.first_chunk for s in succeeded if s.first_chunk is not None]
+
+    result = {
+        'requests': requests,
+        'errors': requests - len(succeeded),
+        'throughput_rps': len(succeeded) / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+    }
+    if scenario == 'stream':
+        result['first_chunk_p50_ms'] = percentile(first_chunks, 50)
+        result['first_chunk_p99_ms'] = percentile(first_chunks, 99)
+
+    return result
+
+
+def start_stubs(latencies: StubLatencies, single_host: Optional[str]) -> Dict[str, StubServer]:
+    servers: Dict[str, StubServer] = {}
+    for api, host in STUB_HOSTS.items():
+        if single_host and servers:
+            servers[api] = next(iter(servers.values()))
+        else:
+            servers[api] = StubServer(create_app(latencies), single_host or host).start()
+
+    return servers
+
+
+def run_load(args: argparse.Namespace) -> Dict:
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='loadtest-')
+    os.makedirs(work_dir, exist_ok=True)
+
+    latencies = StubLatencies(
+        llm=args.llm_latency, token_interval=args.token_interval, embedding=args.embedding_latency,
+        search=args.search_latency
+    )
+    index = args.index
+    if index is None:
+        index = os.path.join(work_dir, 'index')
+        build_index(index)
+
+    stubs = start_stubs(latencies, args.stub_host)
+    openai_url = f"{stubs['openai'].url}/v1"
+
+    common_env = {'OPENAI_API_KEY': 'stub', 'OPENAI_API_BASE': openai_url, 'PROFILE_DIR': work_dir}
+    db = Service('db', DB_DIR, args.db_port, {**common_env, 'VECTOR_STORE_PATH': index}, work_dir)
+    ai = Service('ai', AI_DIR, args.ai_port, {
+        **common_env,
+        'WOLFRAM_ALPHA_APPID': 'stub',
+        'WOLFRAM_ALPHA_API_URL': f"{stubs['wolfram'].url}/v2/query",
+        'SERPER_API_KEY': 'stub',
+        'SERPER_API_URL': stubs['serper'].url,
+        'WIKIPEDIA_API_URL': f"{stubs['wikipedia'].url}/w/api.php",
+        'VS_API_URL': db.url,
+        'LLM_CACHE_PATH': os.path.join(work_dir, 'llm_cache.sqlite'),
+        'LEDGER_PATH': os.path.join(work_dir, 'ledger.sqlite'),
+    }, work_dir)
+    services = {'ai': ai, 'db': db}
+
+    try:
+        for service in services.values():
+            service.wait_ready()
+
+        baseline = {name: service.rss_mb() for name, service in services.items()}
+        results = {}
+        run = 0
+        for scenario in args.scenarios:
+            url = db.url if scenario == 'search' else ai.url
+            results[scenario] = {}
+            for level in args.levels:
+                run += 1
+                result = asyncio.run(drive(scenario, url, level, args.requests, run))
+                result['rss_mb'] = {name: service.rss_mb() for name, service in services.items()}
+                results[scenario][level] = result
+
+        final = {name: service.rss_mb() for name, service in services.items()}
+        return {
+            'stubs': {
+                'llm_latency': args.llm_latency,
+                'token_interval': args.token_interval,
+                'embedding_latency': args.embedding_latency,
+                'search_latency': args.search_latency
+            },
+            'work_dir': work_dir,
+            'results': results,
+            'rss_mb': {'baseline': baseline, 'final': final},
+            'rss_growth_mb': {
+                name: final[name] - baseline[name] if final[name] is not None and baseline[name] is not None else None
+                for name in services
+            }
+        }
+    finally:
+        for service in services.values():
+            service.stop()
+        for server in set(stubs.values()):
+            server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', default=','.join(map(str, LEVELS)), help='Comma separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=REQUESTS, help='Requests per scenario and level')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated, of task, stream, search')
+    parser.add_argument('--llm-latency', default='lognormal:0.6,0.4', help='Until the first token, in seconds')
+    parser.add_argument('--token-interval', type=float, default=0.01, help='Between tokens, in seconds')
+    parser.add_argument('--embedding-latency', default='lognormal:0.05,0.3')
+    parser.add_argument('--search-latency', default='lognormal:0.3,0.5', help='Of Serper, Wolfram and Wikipedia')
+    parser.add_argument('--stub-host', help='Serve every stub on this single address, where 127/8 isn\'t routed')
+    parser.add_argument('--index', help='FAISS index for the db service, a stub index is built by default')
+    parser.add_argument('--ai-port', type=int, default=AI_PORT)
+    parser.add_argument('--db-port', type=int, default=DB_PORT)
+    parser.add_argument('--work-dir', help='Logs, index, cache and ledger, a temporary directory by default')
+    parser.add_argument('--output', help='Written to stdout by default')
+    args = parser.parse_args()
+    args.levels = [int(level) for level in args.levels.split(',')]
+    args.scenarios = args.scenarios.split(',')
+
+    report = run_load(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
@@ -0,0 +1,273 @@
+"""
+Stand-ins of the external APIs the ai and db services call, so they can be loaded without keys or quota:
+
+- OpenAI: chat completions, plain and streamed as server sent events, and embeddings;
+- Serper: Google search results;
+- Wolfram Alpha: the XML query result of the v2 API;
+- Wikipedia: the MediaWiki search and extracts queries.
+
+Every response waits for a latency drawn from its API's distribution, streamed completions wait for it
+before the first token and then for the token interval between tokens.
+
+The stubs run on aiohttp rather than Flask: werkzeug closes every connection, and the services' connection
+pool would never reuse one.
+
+The chat stub plays the agent: a step without observations calls the retrieval tool on the question and
+the next one answers, the retrieval chains get a valid plan, sub queries, engines and a summary.
+"""
+
+import re
+import json
+import time
+import uuid
+import base64
+import zlib
+import random
+import asyncio
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from aiohttp import web
+
+
+EMBEDDING_SIZE = 1536  # The one of text-embedding-ada-002
+SUB_QUERIES = 2
+ENGINES = ['Wikipedia', 'google_serper', 'Academic library']  # Names of the retrieval tool's engines
+RETRIEVAL_TOOL = 'Retrieval tool'
+QUESTION_MARKER = '\nQuestion: '
+OBSERVATION_MARKER = '\nObservation: '
+
+WOLFRAM_RESULT = """<?xml version="1.0" encoding="UTF-8"?>
+<queryresult success="true" error="false" numpods="2">
+  <pod title="Input interpretation" id="Input" primary="false">
+    <subpod title=""><plaintext>{input}</plaintext></subpod>
+  </pod>
+  <pod title="Result" id="Result" primary="true">
+    <subpod title=""><plaintext>42</plaintext></subpod>
+  </pod>
+</queryresult>
+"""
+
+
+class Latency:
+    """
+    Latency distribution, in seconds, parsed from a spec:
+    fixed:0.2, uniform:0.1,0.5, exponential:0.3 (mean) or lognormal:0.6,0.4 (median and sigma)
+    """
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        self.params = [float(p) for p in params.split(',') if p]
+
+        if kind not in ('fixed', 'uniform', 'exponential', 'lognormal'):
+            raise ValueError(f'Unknown latency distribution: {spec}')
+
+    def sample(self) -> float:
+        if self.kind == 'fixed':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return random.uniform(*self.params)
+        if self.kind == 'exponential':
+            return random.expovariate(1 / self.params[0])
+
+        median, sigma = self.params
+        return random.lognormvariate(np.log(median), sigma)
+
+    async def wait(self):
+        await asyncio.sleep(max(0.0, self.sample()))
+
+
+class StubLatencies:
+    def __init__(
+            self, llm: str = 'lognormal:0.6,0.4',
+            token_interval: float = 0.01,
+            embedding: str = 'lognormal:0.05,0.3',
+            search: str = 'lognormal:0.3,0.5'):
+
+        self.llm = Latency(llm)
+        self.token_interval = token_interval  # In seconds
+        self.embedding = Latency(embedding)
+        self.search = Latency(search)
+
+
+def agent_step(prompt: str) -> str:
+    index = prompt.rfind(QUESTION_MARKER)
+    question = prompt[index + len(QUESTION_MARKER):].split('\n')[0]
+
+    if prompt.find(OBSERVATION_MARKER, index) >= 0:
+        return f"Thought: I now know the final answer\nFinal Answer: The answer to {question}"
+
+    return f"Thought: I should look it up\nAction: {RETRIEVAL_TOOL}\nAction Input: {question}\nObservation:"
+
+
+def complete(prompt: str) -> str:
+    if 'Plan the search' in prompt:
+        return json.dumps({'queries': [
+            {'query': f'sub query {i}', 'engine': ENGINES[(zlib.crc32(prompt.encode()) + i) % len(ENGINES)]}
+            for i in range(SUB_QUERIES)
+        ]})
+    if 'Break it down to sub queries' in prompt:
+        return json.dumps({'queries': [f'sub query {i}' for i in range(SUB_QUERIES)]})
+    if 'Decide which engine is best' in prompt:
+        return json.dumps({'engine': ENGINES[zlib.crc32(prompt.encode()) % len(ENGINES)]})
+    if QUESTION_MARKER in prompt:
+        return agent_step(prompt)
+
+    return 'A short summary of the results, which answers the main query.'
+
+
+def apply_stop(text: str, stop: Optional[List[str]]) -> str:
+    for s in stop or []:
+        text = text.split(s)[0]
+
+    return text
+
+
+def embed(text: str) -> np.ndarray:
+    """Deterministic unit vector of the text"""
+    vector = np.random.RandomState(zlib.crc32(text.encode())).standard_normal(EMBEDDING_SIZE).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def create_app(latencies: StubLatencies) -> web.Application:
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        prompt = '\n'.join([m.get('content') or '' for m in body['messages']])
+        stop = body.get('stop')
+        text = apply_stop(complete(prompt), [stop] if isinstance(stop, str) else stop)
+        tokens = re.findall(r'\s*\S+', text)
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        model = body.get('model', 'stub')
+
+        await latencies.llm.wait()
+
+        if body.get('stream'):
+            def chunk(delta: Dict, finish_reason: Optional[str] = None) -> bytes:
+                return ('data: ' + json.dumps({
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+                }) + '\n\n').encode()
+
+            response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+            await response.prepare(request)
+            await response.write(chunk({'role': 'assistant', 'content': ''}))
+            for token in tokens:
+                await response.write(chunk({'content': token}))
+                await asyncio.sleep(latencies.token_interval)
+            await response.write(chunk({}, finish_reason='stop'))
+            await response.write(b'data: [DONE]\n\n')
+            await response.write_eof()
+
+            return response
+
+        await asyncio.sleep(latencies.token_interval * len(tokens))
+
+        prompt_tokens = len(prompt.split())
+        return web.json_response({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': len(tokens),
+                'total_tokens': prompt_tokens + len(tokens)
+            }
+        })
+
+    async def embeddings(request: web.Request) -> web.Response:
+        body = await request.json()
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        # Inputs may be token ids when the client splits long texts
+        texts = [text if isinstance(text, str) else ' '.join(map(str, text)) for text in inputs]
+        is_base64 = body.get('encoding_format') == 'base64'
+
+        await latencies.embedding.wait()
+        vectors = [embed(text) for text in texts]
+
+        return web.json_response({
+            'object': 'list',
+            'data': [{
+                'object': 'embedding',
+                'index': i,
+                'embedding': base64.b64encode(vector.tobytes()).decode() if is_base64 else vector.tolist()
+            } for i, vector in enumerate(vectors)],
+            'model': body.get('model', 'stub'),
+            'usage': {'prompt_tokens': len(texts), 'total_tokens': len(texts)}
+        })
+
+    async def serper_search(request: web.Request) -> web.Response:
+        query = request.query.get('q', '')
+        await latencies.search.wait()
+
+        return web.json_response({
+            'searchParameters': {'q': query, 'type': 'search'},
+            'organic': [{
+                'title': f'Result {i} of {query}',
+                'link': f'https://example.com/{i}',
+                'snippet': f'Snippet {i} about {query}.',
+                'position': i + 1
+            } for i in range(3)]
+        })
+
+    async def wolfram_query(request: web.Request) -> web.Response:
+        await latencies.search.wait()
+        return web.Response(text=WOLFRAM_RESULT.format(input=request.query.get('input', '')), content_type='text/xml')
+
+    async def wikipedia_api(request: web.Request) -> web.Response:
+        await latencies.search.wait()
+
+        if request.query.get('list') == 'search':
+            query = request.query.get('srsearch', '')
+            limit = int(request.query.get('srlimit', 3))
+            return web.json_response({'query': {'search': [{'title': f'{query} ({i})'} for i in range(limit)]}})
+
+        title = request.query.get('titles', '')
+        return web.json_response({'query': {'pages': {str(zlib.crc32(title.encode())): {
+            'title': title,
+            'extract': f'{title} is the subject of this article. ' * 5
+        }}}})
+
+    app = web.Application()
+    app.router.add_post('/v1/chat/completions', chat_completions)
+    app.router.add_post('/v1/embeddings', embeddings)
+    app.router.add_post('/search', serper_search)
+    app.router.add_get('/v2/query', wolfram_query)
+    app.router.add_get('/w/api.php', wikipedia_api)
+
+    return app
+
+
+class StubServer:
+    """Serves the stubs from an event loop of its own thread"""
+    def __init__(self, app: web.Application, host: str, port: int = 0):
+        self.runner = web.AppRunner(app, access_log=None)
+        self.host = host
+        self.port = port
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=f'stub-{host}', daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    async def serve(self):
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.port = self.runner.addresses[0][1]
+
+    def start(self) -> 'StubServer':
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.serve(), self.loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()